@@ -1,4 +1,6 @@
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
+
+import importlib
 
 from fastrepl.version import __version__
 
@@ -6,14 +8,65 @@ telemetry: bool = True
 api_base: Optional[str] = "https://yujonglee--fastrepl-api.modal.run"  # TODO
 api_key: Optional[str] = None
 
-from fastrepl.eval import *
-from fastrepl.gen import *
-from fastrepl.analyze import Analyzer
-from fastrepl.dataset import Dataset
+# NOTE: Public names are resolved on first access (PEP 562), so `import fastrepl` does not load litellm, openai, sklearn, rich, etc.
+# until something that needs them is used.
+_LAZY = {
+    **{
+        name: "fastrepl.eval"
+        for name in [
+            "BaseEvalNode",
+            "BaseSimpleEvalNode",
+            "BaseRAGEvalNode",
+            "Evaluator",
+            "SimpleEvaluator",
+            "RAGEvaluator",
+            "HumanClassifierRich",
+            "LLMClassificationHead",
+            "LLMClassificationHeadCOT",
+            "LLMGradingHead",
+            "LLMGradingHeadCOT",
+            "RAGAS",
+            "SemanticAnswerSimilarityMetric",
+            "load_metric",
+        ]
+    },
+    "BaseGenerator": "fastrepl.gen",
+    "QuestionGenerator": "fastrepl.gen",
+    "Analyzer": "fastrepl.analyze",
+    "Dataset": "fastrepl.dataset",
+    "DEBUG": "fastrepl.utils",
+    "local_runner": "fastrepl.runner",
+    "remote_runner": "fastrepl.runner",
+    "pl_runner": "fastrepl.runner",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+    else:
+        try:
+            value = importlib.import_module(f"{__name__}.{name}")
+        except ModuleNotFoundError as e:
+            if e.name != f"{__name__}.{name}":
+                raise e
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_LAZY])
 
-from fastrepl.utils import DEBUG
 
-from fastrepl.runner import *
+if TYPE_CHECKING:  # pragma: no cover
+    from fastrepl.eval import *
+    from fastrepl.gen import *
+    from fastrepl.analyze import Analyzer
+    from fastrepl.dataset import Dataset
+    from fastrepl.utils import DEBUG
+    from fastrepl.runner import *
 
 from fastrepl.telemetry import _import_package
 
@@ -1,6 +1,6 @@
 from typing import Literal, Dict
 
-from fastrepl.dataset import Dataset
+from fastrepl.dataset import Dataset, ArrowColumn
 from fastrepl.utils import kappa
 
 
@@ -12,7 +12,10 @@ class Analyzer:
     def run(self, mode: Literal["kappa"], feature="result") -> Dict[str, float]:
         assert mode == "kappa"
 
-        if not isinstance(self._dataset[feature], list):
+        values = self._dataset[feature]
+        if isinstance(values, ArrowColumn):
+            values = values.to_list()
+        if not isinstance(values, list):
             return {}
 
-        return {"kappa": kappa(self._dataset[feature])}
+        return {"kappa": kappa(values)}
@@ -1,52 +1,186 @@
-from typing import Optional, Callable, Literal, Dict, List, Any, cast
+from typing import (
+    Optional,
+    Callable,
+    Literal,
+    Iterator,
+    Sequence,
+    Union,
+    Dict,
+    Mapping,
+    List,
+    Tuple,
+    Any,
+    cast,
+    overload,
+)
+
+import os
+import gzip
+import json
+import pickle
+import random
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
 import httpx
+import backoff
 
 import fastrepl
-import fastrepl.llm as llm
 from fastrepl.errors import DatasetPushError
 
 
+class ArrowColumn(Sequence):
+    """
+    Read-only, list-like view over a pyarrow (Chunked)Array. Values are converted to Python objects on access.
+    """
+
+    __slots__ = ("_array",)
+
+    ITER_BATCH_SIZE = 1024
+
+    def __init__(self, array: Any) -> None:
+        self._array = array
+
+    @property
+    def array(self) -> Any:
+        return self._array
+
+    def __len__(self) -> int:
+        return len(self._array)
+
+    @overload
+    def __getitem__(self, i: int) -> Any:
+        ...
+
+    @overload
+    def __getitem__(self, i: slice) -> "ArrowColumn":
+        ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return ArrowColumn(self._array.slice(start, max(0, stop - start)))
+            return self.take(range(start, stop, step))
+
+        return self._array[i].as_py()
+
+    def take(self, indices: Sequence[int]) -> "ArrowColumn":
+        import pyarrow as pa
+
+        return ArrowColumn(self._array.take(pa.array(indices, type=pa.int64())))
+
+    def __iter__(self) -> Iterator[Any]:
+        chunks = getattr(self._array, "chunks", [self._array])
+        for chunk in chunks:
+            for start in range(0, len(chunk), self.ITER_BATCH_SIZE):
+                yield from chunk.slice(start, self.ITER_BATCH_SIZE).to_pylist()
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, ArrowColumn):
+            return self.to_list() == other.to_list()
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ArrowColumn({self._array.type}, length={len(self)})"
+
+    def to_list(self) -> List[Any]:
+        return self._array.to_pylist()
+
+
+Column = Union[List[Any], ArrowColumn]
+
+
+def _to_list(column: Column) -> List[Any]:
+    return column.to_list() if isinstance(column, ArrowColumn) else column
+
+
+def _take(column: Column, indices: List[int]) -> Column:
+    if isinstance(column, ArrowColumn):
+        return column.take(indices)
+    return [column[i] for i in indices]
+
+
+def _ndjson_line(row: Dict[str, Any]) -> str:
+    return json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def _should_retry(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+_retry = backoff.on_exception(
+    wait_gen=backoff.expo,
+    exception=(httpx.TransportError, httpx.HTTPStatusError),
+    giveup=lambda e: not _should_retry(e),
+    raise_on_giveup=True,
+    max_tries=5,
+    max_value=30,
+)
+
+
+@_retry
+def _send(client: httpx.Client, method: str, url: str, **kwargs) -> httpx.Response:
+    res = client.request(method, url, **kwargs)
+    if res.status_code >= 500:
+        res.raise_for_status()
+    return res
+
+
+# Status codes of servers that predate the chunked `/upload` and `/download` routes.
+_NOT_SUPPORTED = (404, 405)
+
+
+def _compact(column: Column) -> Column:
+    from fastrepl.utils.arrow import exact_array
+
+    if isinstance(column, ArrowColumn):
+        return column
+
+    # NOTE: Anything Arrow would coerce (mixed int/float, tuples, dicts, ints beyond int64) stays a Python list.
+    array = exact_array(column, nested=True)
+    return column if array is None else ArrowColumn(array)
+
+
 class Dataset:
-    __slots__ = ("_data", "_iter")
+    __slots__ = ("_data", "_cloud")
 
     def __init__(self) -> None:
-        self._data: Dict[str, List[Any]] = {}
+        self._data: Dict[str, Column] = {}
+        # (id, version, num_rows, sha256 of rows as NDJSON) as of the last push or pull.
+        self._cloud: Optional[Tuple[str, str, int, str]] = None
 
     def __repr__(self) -> str:
         return f"fastrepl.Dataset({{\n    features: {self.column_names},\n    num_rows: {self.__len__()}\n}})"
 
     def __len__(self) -> int:
-        v0: List[Any] = next(iter(self._data.values()), [])
+        v0: Column = next(iter(self._data.values()), [])
         return len(v0)
 
-    def __getitem__(self, key: str) -> List[Any]:
+    def __getitem__(self, key: str) -> Column:
         if key in self._data:
             return self._data[key]
         else:
             raise KeyError
 
-    def __iter__(self):
-        key = list(self._data.keys())[0]
-        self._iter = range(len(self._data[key])).__iter__()
-        return self
-
-    def __next__(self) -> Dict[str, Any]:
-        try:
-            i = next(self._iter)
-            return {col: self._data[col][i] for col in self.column_names}
-        except StopIteration:
-            raise StopIteration
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        names = self.column_names
+        for values in zip(*[self._data[name] for name in names]):
+            yield dict(zip(names, values))
 
     @property
     def column_names(self) -> List[str]:
         return list(self._data.keys())
 
-    def add_column(self, name: str, values: List[Any]) -> "Dataset":
+    def add_column(self, name: str, values: Sequence[Any]) -> "Dataset":
         if self.__len__() != len(values):
             raise ValueError
 
-        self._data[name] = list(values)
+        self._data[name] = values if isinstance(values, ArrowColumn) else list(values)
         return self
 
     def add_row(self, row: Dict[str, Any]):
@@ -58,10 +192,11 @@ class Dataset:
 
         for k, v in row.items():
             try:
-                self._data[k].append(v)
+                column = _to_list(self._data[k])
+                column.append(v)
+                self._data[k] = column
             except KeyError:
-                self._data[k] = [None] * existing_size
-                self._data[k].append(v)
+                self._data[k] = [None] * existing_size + [v]
 
     def rename_column(self, old_name: str, new_name: str) -> "Dataset":
         data = {col: self._data[col] for col in self.column_names}
@@ -73,15 +208,112 @@ class Dataset:
         del data[name]
         return Dataset.from_dict(data)
 
+    def select_columns(self, names: List[str]) -> "Dataset":
+        return Dataset.from_dict({name: self._data[name] for name in names})
+
+    def compact(self) -> "Dataset":
+        """
+        Returns a dataset sharing this one's data, with numeric, string and list-of-those columns stored as Arrow arrays.
+        Columns of other types are kept as Python lists.
+        """
+        return Dataset.from_dict({k: _compact(v) for k, v in self._data.items()})
+
     def clear(self):
         self._data = {}
 
-    def map(self, func: Callable[[Dict[str, Any]], Dict[str, Any]]) -> "Dataset":
-        rows = []
-        for row in self:
-            rows.append(func(row))
-        data = {col: [row[col] for row in rows] for col in self.column_names}
-        return Dataset.from_dict(data)
+    def _batches(self, batch_size: int) -> Iterator[Dict[str, List[Any]]]:
+        for start in range(0, self.__len__(), batch_size):
+            yield {
+                k: _to_list(v[start : start + batch_size])
+                for k, v in self._data.items()
+            }
+
+    def _map_batches(
+        self,
+        func: Callable[[Dict[str, List[Any]]], Any],
+        batch_size: int,
+        num_proc: Optional[int],
+    ) -> Iterator[Any]:
+        if num_proc is None or num_proc <= 1:
+            yield from map(func, self._batches(batch_size))
+            return
+
+        # NOTE: `func` must be picklable (i.e. defined at module level) to be sent to worker processes.
+        with ProcessPoolExecutor(num_proc) as executor:
+            yield from executor.map(func, self._batches(batch_size))
+
+    def map(
+        self,
+        func: Callable[[Any], Dict[str, Any]],
+        batched=False,
+        batch_size=1000,
+        num_proc: Optional[int] = None,
+    ) -> "Dataset":
+        """
+        With `batched=True`, `func` receives up to `batch_size` rows as `{column: values}` and returns the same shape.
+        Returned columns replace or are added to the existing ones.
+        """
+        if not batched:
+            rows = []
+            for row in self:
+                rows.append(func(row))
+            data = {col: [row[col] for row in rows] for col in self.column_names}
+            return Dataset.from_dict(data)
+
+        outputs: Dict[str, List[Any]] = {}
+        for output in self._map_batches(func, batch_size, num_proc):
+            for k, v in output.items():
+                outputs.setdefault(k, []).extend(v)
+
+        columns: Dict[str, Column] = {**self._data, **outputs}
+        return Dataset.from_dict(columns)
+
+    def filter(
+        self,
+        func: Callable[[Any], Any],
+        batched=False,
+        batch_size=1000,
+        num_proc: Optional[int] = None,
+    ) -> "Dataset":
+        """
+        `func` returns whether to keep a row, or a list of those for each batch with `batched=True`.
+        """
+        if batched:
+            mask = [
+                keep
+                for keeps in self._map_batches(func, batch_size, num_proc)
+                for keep in keeps
+            ]
+        else:
+            mask = [func(row) for row in self]
+
+        return self.select([i for i, keep in enumerate(mask) if keep])
+
+    def select(self, indices: Sequence[int]) -> "Dataset":
+        indices = list(indices)
+        return Dataset.from_dict({k: _take(v, indices) for k, v in self._data.items()})
+
+    def shuffle(self, seed: Optional[int] = None) -> "Dataset":
+        indices = list(range(self.__len__()))
+        random.Random(seed).shuffle(indices)
+        return self.select(indices)
+
+    def train_test_split(
+        self,
+        test_size: Union[float, int] = 0.25,
+        shuffle=True,
+        seed: Optional[int] = None,
+    ) -> Tuple["Dataset", "Dataset"]:
+        size = self.__len__()
+        n_test = int(test_size * size) if isinstance(test_size, float) else test_size
+        if not 0 <= n_test <= size:
+            raise ValueError(f"test_size={test_size!r} is out of range")
+
+        indices = list(range(size))
+        if shuffle:
+            random.Random(seed).shuffle(indices)
+
+        return self.select(indices[n_test:]), self.select(indices[:n_test])
 
     @classmethod
     def _headers(cls):
@@ -92,48 +324,187 @@ class Dataset:
         return f"{fastrepl.api_base}/dataset"
 
     @classmethod
-    def from_dict(cls, data: Dict[str, List[Any]]) -> "Dataset":
+    def from_dict(cls, data: Mapping[str, Column]) -> "Dataset":
         size = len(next(iter(data.values()), []))
         for value in data.values():
             if len(value) != size:
                 raise ValueError
 
         ds = Dataset()
-        ds._data = data
+        ds._data = cast(Dict[str, Column], data)
         return ds
 
     def to_dict(self) -> Dict[str, List[Any]]:
-        return self._data
+        return {k: _to_list(v) for k, v in self._data.items()}
+
+    @classmethod
+    def from_arrow(cls, table: Any) -> "Dataset":
+        return Dataset.from_dict(
+            {name: ArrowColumn(table.column(name)) for name in table.column_names}
+        )
+
+    def to_arrow(self):
+        import pyarrow as pa
+
+        return pa.table(
+            {
+                k: v.array if isinstance(v, ArrowColumn) else pa.array(v)
+                for k, v in self._data.items()
+            }
+        )
 
     @classmethod
     def from_hf(cls, data: Any) -> "Dataset":
         from datasets import Dataset as HF_Dataset
 
         hf_ds = cast(HF_Dataset, data)
+        if hf_ds._indices is not None:  # `select`, `shuffle`, etc. are applied lazily
+            hf_ds = hf_ds.flatten_indices()
 
-        ds = Dataset()
-        ds._data = hf_ds.to_dict()
-        return ds
+        return Dataset.from_arrow(hf_ds.data.table)
 
     def to_hf(self):
         from datasets import Dataset as HF_Dataset
+        from datasets.table import InMemoryTable
+
+        return HF_Dataset(InMemoryTable(self.to_arrow()))
+
+    DISK_FILENAME = "data.arrow"
+    DISK_CHUNK_SIZE = 10000
+
+    def save_to_disk(self, path: str, chunk_size: int = DISK_CHUNK_SIZE) -> None:
+        """
+        Writes `<path>/data.arrow` in Arrow IPC format, `chunk_size` rows per record batch.
+        Columns Arrow can not roundtrip exactly (e.g. mixed types, tuples, dicts) are stored pickled,
+        so only load files you wrote yourself.
+        """
+        import pyarrow as pa
+        import pyarrow.ipc
+        from fastrepl.utils.arrow import exact_array
+
+        fields, arrays = [], []
+        for name, column in self._data.items():
+            if isinstance(column, ArrowColumn):
+                fields.append(pa.field(name, column.array.type))
+                arrays.append(column.array)
+                continue
+
+            array = exact_array(column, nested=True)
+            if array is not None:
+                fields.append(pa.field(name, array.type))
+            else:
+                array = pa.array([pickle.dumps(v) for v in column], type=pa.binary())
+                fields.append(
+                    pa.field(name, pa.binary(), metadata={"fastrepl.pickle": "1"})
+                )
+            arrays.append(array)
 
-        return HF_Dataset.from_dict(self._data)
+        table = pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+        os.makedirs(path, exist_ok=True)
+        with pa.OSFile(os.path.join(path, self.DISK_FILENAME), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=chunk_size)
+
+    @classmethod
+    def load_from_disk(cls, path: str, mmap=True) -> "Dataset":
+        """
+        With `mmap=True`, columns are views over the memory-mapped file, and only the pages that are read get loaded.
+        """
+        import pyarrow as pa
+        import pyarrow.ipc
+
+        file = os.path.join(path, cls.DISK_FILENAME)
+        # NOTE: Closing the source releases its fd. A memory map itself stays alive as long as the columns use it.
+        with pa.memory_map(file, "r") if mmap else pa.OSFile(file, "rb") as source:
+            table = pa.ipc.open_file(source).read_all()
+
+        ds = Dataset.from_arrow(table)
+        for field in table.schema:
+            if (field.metadata or {}).get(b"fastrepl.pickle") == b"1":
+                ds._data[field.name] = [pickle.loads(v) for v in ds._data[field.name]]
+        return ds
+
+    CLOUD_CHUNK_SIZE = 1000
+
+    def _ndjson_chunks(self, start: int, stop: int, chunk_size: int) -> Iterator[bytes]:
+        part = Dataset.from_dict({k: v[start:stop] for k, v in self._data.items()})
+        for batch in part._batches(chunk_size):
+            rows = (dict(zip(batch.keys(), values)) for values in zip(*batch.values()))
+            yield "".join(_ndjson_line(row) for row in rows).encode("utf-8")
+
+    def _hash(self, stop: int) -> Any:
+        h = hashlib.sha256()
+        for chunk in self._ndjson_chunks(0, stop, self.CLOUD_CHUNK_SIZE):
+            h.update(chunk)
+        return h
 
     @classmethod
     def from_cloud(cls, id: str, version: Optional[str] = None) -> "Dataset":
+        """
+        Streams gzip'd NDJSON rows. Dropped connections resume from the last received row.
+        Falls back to a single `GET /get/{id}` on servers without `/download/{id}`.
+        """
         if fastrepl.api_key is None or fastrepl.api_base is None:
             raise ValueError
 
+        url = f"{Dataset._base_url()}/download/{id}"
+        columns: Dict[str, List[Any]] = {}
+        meta: Dict[str, Any] = {}
+        h = hashlib.sha256()
+
+        @_retry
+        def fetch(client: httpx.Client) -> None:
+            # NOTE: Once the first response tells us the version, resumed requests are pinned to it.
+            params: Dict[str, Any] = {"offset": meta.get("received", 0)}
+            if meta.get("version", version) is not None:
+                params["version"] = meta.get("version", version)
+
+            with client.stream("GET", url, params=params) as res:
+                if res.status_code in _NOT_SUPPORTED:
+                    meta["legacy"] = True
+                    return
+                res.raise_for_status()
+
+                lines = res.iter_lines()
+                header = json.loads(next(lines))
+                if "received" not in meta:
+                    meta.update(header, received=0)
+                    columns.update({name: [] for name in header["columns"]})
+
+                for line in lines:
+                    if line == "":
+                        continue
+                    row = json.loads(line)
+                    row = {name: row.get(name) for name in columns}
+                    for name, values in columns.items():
+                        values.append(row[name])
+                    h.update(_ndjson_line(row).encode("utf-8"))
+                    meta["received"] += 1
+
+            if meta["received"] < meta["num_rows"]:
+                raise httpx.ReadError("incomplete response")
+
+        with httpx.Client(headers=Dataset._headers()) as client:
+            fetch(client)
+            if meta.get("legacy"):
+                return cls._from_cloud_legacy(client, id, version)
+
+        ds = Dataset.from_dict(columns)
+        ds._cloud = (id, meta["version"], meta["num_rows"], h.hexdigest())
+        return ds
+
+    @classmethod
+    def _from_cloud_legacy(
+        cls, client: httpx.Client, id: str, version: Optional[str]
+    ) -> "Dataset":
         url = f"{Dataset._base_url()}/get/{id}"
         if version is not None:
             url += f"?version={version}"
 
-        with httpx.Client(headers=Dataset._headers()) as client:
-            res = client.get(url).json()
-            data = res["data"]
-
-            return Dataset.from_dict(data)
+        res = _send(client, "GET", url)
+        res.raise_for_status()
+        return Dataset.from_dict(res.json()["data"])
 
     @classmethod
     def list_cloud(cls) -> List[str]:
@@ -146,19 +517,107 @@ class Dataset:
             res = client.get(url)
             return res.json()["ids"]
 
-    def push_to_cloud(self, id: Optional[str]) -> str:
+    def push_to_cloud(
+        self, id: Optional[str], chunk_size: int = CLOUD_CHUNK_SIZE, delta=True
+    ) -> str:
+        """
+        Uploads gzip'd NDJSON chunks. Pushing the same data again skips the chunks the server already has,
+        and if this dataset was pulled from or pushed to `id` and only had rows appended since, only new rows are sent.
+        Falls back to a single `POST /new` on servers without `/upload/start`.
+        """
         if fastrepl.api_key is None or fastrepl.api_base is None:
             raise ValueError
 
-        url = f"{Dataset._base_url()}/new"
-
         with httpx.Client(headers=Dataset._headers()) as client:
-            res = client.post(url, json={"id": id, "data": self._data})
+            if delta and id is not None and self._cloud is not None:
+                cloud_id, version, num_rows, digest = self._cloud
+                if cloud_id == id and num_rows <= self.__len__():
+                    h = self._hash(num_rows)
+                    if h.hexdigest() == digest:
+                        pushed = self._push(
+                            client, id, chunk_size, h, version, num_rows
+                        )
+                        if pushed is not None:
+                            return pushed
+
+            # NOTE: `None` only for a delta push, when the remote dataset changed since we last synced.
+            return cast(str, self._push(client, id, chunk_size, hashlib.sha256()))
+
+    def _push(
+        self,
+        client: httpx.Client,
+        id: Optional[str],
+        chunk_size: int,
+        h: Any,
+        base_version: Optional[str] = None,
+        offset: int = 0,
+    ) -> Optional[str]:
+        url = Dataset._base_url()
+        num_rows = self.__len__()
+
+        res = _send(
+            client,
+            "POST",
+            f"{url}/upload/start",
+            json={
+                "id": id,
+                "columns": self.column_names,
+                "num_rows": num_rows,
+                "offset": offset,
+                "base_version": base_version,
+            },
+        )
+        if res.status_code in _NOT_SUPPORTED:
+            return self._push_legacy(client, id)
+        if res.status_code == 409 and base_version is not None:
+            return None
+        if res.status_code != 200:
+            raise DatasetPushError(res.text)
+        upload_id, received = res.json()["upload_id"], res.json()["received"]
+
+        for i, chunk in enumerate(self._ndjson_chunks(offset, num_rows, chunk_size)):
+            h.update(chunk)
+            checksum = hashlib.sha256(chunk).hexdigest()
+            if received.get(str(i)) == checksum:
+                continue
 
-            try:
-                return res.json()["id"]
-            except Exception as e:
-                raise DatasetPushError(res)
+            res = _send(
+                client,
+                "PUT",
+                f"{url}/upload/{upload_id}/{i}",
+                content=gzip.compress(chunk, mtime=0),
+                headers={
+                    "Content-Type": "application/x-ndjson",
+                    "Content-Encoding": "gzip",
+                    "X-Checksum": checksum,
+                },
+            )
+            if res.status_code != 200:
+                raise DatasetPushError(res.text)
+
+        res = _send(client, "POST", f"{url}/upload/{upload_id}/commit")
+        if res.status_code != 200:
+            raise DatasetPushError(res.text)
+
+        result = res.json()
+        self._cloud = (result["id"], result["version"], num_rows, h.hexdigest())
+        return result["id"]
+
+    def _push_legacy(self, client: httpx.Client, id: Optional[str]) -> str:
+        res = _send(
+            client,
+            "POST",
+            f"{Dataset._base_url()}/new",
+            json={"id": id, "data": self.to_dict()},
+        )
+        try:
+            result = res.json()["id"]
+        except Exception:
+            raise DatasetPushError(res.text)
+
+        # NOTE: The legacy endpoint has no versions, so there is nothing to push a delta against.
+        self._cloud = None
+        return result
 
     @classmethod
     def from_langfuse(cls, data: Any) -> "Dataset":
@@ -190,8 +649,8 @@ class Dataset:
         metric = fastrepl.load_metric(metric_name)
 
         try:
-            predictions = self._data[prediction_column]
-            references = self._data[reference_column]
+            predictions = _to_list(self._data[prediction_column])
+            references = _to_list(self._data[reference_column])
         except KeyError as e:
             raise ValueError(f"Column not found: {e}")
 
@@ -199,6 +658,7 @@ class Dataset:
 
     def augment(self, multiple=3, model="gpt-4"):
         import json
+        import fastrepl.llm as llm
 
         for row in self:
             sample = {k: [v] for k, v in row.items()}
@@ -43,3 +43,8 @@ class TokenizeNotImplementedError(Error, NotImplementedError):
 class DatasetPushError(Error):
     def doc_url(self) -> str:
         return ""  # pragma: no cover
+
+
+class ShardFailedError(Error):
+    def doc_url(self) -> str:
+        return "https://docs.fastrepl.com"  # pragma: no cover
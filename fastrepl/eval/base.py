@@ -1,5 +1,7 @@
 from typing import Optional, Union, Dict, List, Any
 from abc import ABC, abstractmethod
+import asyncio
+import functools
 
 
 class BaseMetaEvalNode(ABC):
@@ -11,10 +13,23 @@ class BaseMetaEvalNode(ABC):
 
 
 class BaseEvalNode(ABC):
+    # NOTE: Number of rows a runner hands to `run_batch` at once.
+    batch_size = 1
+
     @abstractmethod
     def run(self, *args, **kwargs) -> Optional[Any]:
         ...
 
+    def run_batch(self, rows: List[Dict[str, Any]]) -> List[Optional[Any]]:
+        return [self.run(**row) for row in rows]
+
+    # NOTE: Nodes without native async support are run in the default executor.
+    async def arun(self, *args, **kwargs) -> Optional[Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(self.run, *args, **kwargs)
+        )
+
     @abstractmethod
     def inputs(self) -> List[str]:
         ...
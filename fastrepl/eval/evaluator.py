@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Union, List
+import asyncio
+import functools
+from typing import Optional, Union, Dict, List, Any
 
 from fastrepl.eval.base import BaseEvalNode, BaseSimpleEvalNode, BaseRAGEvalNode
 
@@ -12,6 +14,19 @@ class Evaluator(ABC):
     def run(self, *args, **kwargs):
         ...
 
+    async def arun(self, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(self.run, *args, **kwargs)
+        )
+
+    @property
+    def batch_size(self) -> int:
+        return self.node.batch_size
+
+    def run_batch(self, rows: List[Dict[str, Any]]) -> List[Any]:
+        return self.node.run_batch(rows)
+
     @abstractmethod
     def inputs(self) -> List[str]:
         ...
@@ -24,6 +39,9 @@ class SimpleEvaluator(Evaluator):
     def run(self, *, sample: str) -> Optional[Union[str, float]]:
         return self.node.run(sample=sample)
 
+    async def arun(self, *, sample: str) -> Optional[Union[str, float]]:
+        return await self.node.arun(sample=sample)
+
     def inputs(self) -> List[str]:
         return self.node.inputs()
 
@@ -47,5 +65,20 @@ class RAGEvaluator(Evaluator):
             ground_truths=ground_truths,
         )
 
+    async def arun(
+        self,
+        *,
+        question: Optional[str] = None,
+        answer: Optional[str] = None,
+        contexts: Optional[List[str]] = None,
+        ground_truths: Optional[List[str]] = None,
+    ) -> Optional[float]:
+        return await self.node.arun(
+            question=question,
+            answer=answer,
+            contexts=contexts,
+            ground_truths=ground_truths,
+        )
+
     def inputs(self) -> List[str]:
         return self.node.inputs()
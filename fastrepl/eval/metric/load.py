@@ -34,6 +34,6 @@ def load_metric(name: str, **kwargs) -> BaseMetaEvalNode:
             kwargs.pop("model_name_or_path"),
             kwargs.pop("use_gpu", False),
         )
-        return SemanticAnswerSimilarityMetric(model_name_or_path, use_gpu)
+        return SemanticAnswerSimilarityMetric(model_name_or_path, use_gpu, **kwargs)
     else:
         raise NotImplementedError
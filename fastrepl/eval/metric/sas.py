@@ -1,7 +1,11 @@
-from typing import Tuple, Literal, TypedDict, List
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import Optional, Iterator, Literal, TypedDict, Tuple, List, Union, cast
+
+import os
+import hashlib
+import itertools
 
 from fastrepl.eval.base import BaseMetaEvalNode
+from fastrepl.utils import EmbeddingCache, ScoreCache
 
 
 SENTENCE_ANSWER_SIMILARITY_METRICS = Literal["sas", "semantic_answer_similarity"]
@@ -10,16 +14,26 @@ SENTENCE_ANSWER_SIMILARITY_METRICS = Literal["sas", "semantic_answer_similarity"
 class SASResult(TypedDict):
     top_1_sas: List[float]
     top_k_sas: List[float]
-    pred_label_matrix: List[List[float]]
+    pred_label_matrix: List[List[List[float]]]
 
 
 # Modified from https://github.com/deepset-ai/haystack/blob/da677003181c2a2c03d5714672444138caea6be6/haystack/modeling/evaluation/metrics.py#L392
 class SemanticAnswerSimilarityMetric(BaseMetaEvalNode):
-    __slot__ = ("model", "is_cross_encoder")
-
-    def __init__(self, model_name_or_path: str, use_gpu=False):
+    __slot__ = ("model", "is_cross_encoder", "batch_size", "chunk_size", "cache")
+
+    def __init__(
+        self,
+        model_name_or_path: str,
+        use_gpu=False,
+        batch_size=32,
+        chunk_size=4096,
+        cache_dir: Optional[str] = None,
+    ):
         import transformers
 
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+
         config = transformers.AutoConfig.from_pretrained(model_name_or_path)
         if config.architectures is not None:
             self.is_cross_encoder = any(
@@ -27,6 +41,20 @@ class SemanticAnswerSimilarityMetric(BaseMetaEvalNode):
                 for arch in config.architectures
             )
 
+        # NOTE: Embeddings (or pair scores, for cross-encoders) from different models do not mix, so each model gets its own store.
+        path = (
+            os.path.join(
+                cache_dir, hashlib.sha256(model_name_or_path.encode()).hexdigest()[:16]
+            )
+            if cache_dir is not None
+            else None
+        )
+        self.cache: Union[EmbeddingCache, ScoreCache] = (
+            ScoreCache(os.path.join(path, "scores.sqlite") if path else None)
+            if self.is_cross_encoder
+            else EmbeddingCache(path)
+        )
+
         device = None if use_gpu else "cpu"
         self.model = self._load_model(model_name_or_path, device=device)
 
@@ -45,30 +73,49 @@ class SemanticAnswerSimilarityMetric(BaseMetaEvalNode):
             return self._compute_bi_encoder(predictions, references, **kwargs)
 
     def _compute_cross_encoder(
-        self, predictions: List[List[str]], references: List[List[str]], **kwargs
+        self,
+        predictions: List[List[str]],
+        references: List[List[str]],
+        batch_size: Optional[int] = None,
+        chunk_size: Optional[int] = None,
+        **kwargs,
     ) -> SASResult:
         import numpy as np
 
         top_1_sas: List[float] = []
         top_k_sas: List[float] = []
-        pred_label_matrix: List[List[float]] = []
-        lengths: List[Tuple[int, int]] = []
+        pred_label_matrix: List[List[List[float]]] = []
+
+        # NOTE: Pairs are streamed in chunks instead of building the whole grid, and scored through the cache,
+        # which keys them by content. So duplicated or previously scored pairs are not predicted again.
+        def pairs() -> Iterator[Tuple[str, str]]:
+            for preds, labels in zip(predictions, references):
+                for p in preds:
+                    for l in labels:
+                        yield p, l
+
+        def score(grid: List[Tuple[str, ...]]):
+            return self.model.predict(
+                grid, batch_size=batch_size or self.batch_size, **kwargs
+            )
 
-        grid = []
-        for preds, labels in zip(predictions, references):
-            for p in preds:
-                for l in labels:
-                    grid.append((p, l))
-            lengths.append((len(preds), len(labels)))
-        scores = self.model.predict(grid, **kwargs)
+        cache = cast(ScoreCache, self.cache)
+        total = sum(len(p) * len(l) for p, l in zip(predictions, references))
+        scores = np.empty(total, dtype=np.float32)
+
+        it, position = pairs(), 0
+        while chunk := list(itertools.islice(it, chunk_size or self.chunk_size)):
+            scores[position : position + len(chunk)] = cache.score(chunk, score)
+            position += len(chunk)
 
         current_position = 0
-        for len_p, len_l in lengths:
+        for preds, labels in zip(predictions, references):
+            len_p, len_l = len(preds), len(labels)
             scores_window = scores[current_position : current_position + len_p * len_l]
             # Per predicted doc there are len_l entries comparing it to all len_l labels.
             # So to only consider the first doc we have to take the first len_l entries
-            top_1_sas.append(np.max(scores_window[:len_l]))
-            top_k_sas.append(np.max(scores_window))
+            top_1_sas.append(float(np.max(scores_window[:len_l])))
+            top_k_sas.append(float(np.max(scores_window)))
             pred_label_matrix.append(scores_window.reshape(len_p, len_l).tolist())
             current_position += len_p * len_l
 
@@ -79,38 +126,54 @@ class SemanticAnswerSimilarityMetric(BaseMetaEvalNode):
         }
 
     def _compute_bi_encoder(
-        self, predictions: List[List[str]], references: List[List[str]], **kwargs
+        self,
+        predictions: List[List[str]],
+        references: List[List[str]],
+        batch_size: Optional[int] = None,
+        **kwargs,
     ) -> SASResult:
         import numpy as np
 
         top_1_sas: List[float] = []
         top_k_sas: List[float] = []
-        pred_label_matrix: List[List[float]] = []
-        lengths: List[Tuple[int, int]] = []
-
-        # For Bi-encoders we can flatten predictions and labels into one list
-        all_texts: List[str] = []
-        for p, l in zip(predictions, references):  # type: ignore
-            # TODO potentially exclude (near) exact matches from computations
-            all_texts.extend(p)
-            all_texts.extend(l)
-            lengths.append((len(p), len(l)))
-        # then compute embeddings
-        embeddings = self.model.encode(all_texts, **kwargs)
-
-        # then select which embeddings will be used for similarity computations
+        pred_label_matrix: List[List[List[float]]] = []
+
+        # For Bi-encoders we can flatten predictions and labels into one list, and embed each distinct text once.
+        pred_texts = [p for preds in predictions for p in preds]
+        label_texts = [l for labels in references for l in labels]
+        embeddings = cast(EmbeddingCache, self.cache).embed(
+            pred_texts + label_texts,
+            lambda texts: self.model.encode(
+                texts, batch_size=batch_size or self.batch_size, **kwargs
+            ),
+        )
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1, norms)
+        pred_embeddings = embeddings[: len(pred_texts)]
+        label_embeddings = embeddings[len(pred_texts) :]
+
+        # Then gather every (prediction, label) pair within a row, and compute all cosine similarities at once.
+        len_p = np.array([len(p) for p in predictions])
+        len_l = np.array([len(l) for l in references])
+        num_pairs = len_p * len_l
+
+        row = np.repeat(np.arange(len(predictions)), num_pairs)
+        offset = np.arange(num_pairs.sum()) - np.repeat(
+            np.cumsum(num_pairs) - num_pairs, num_pairs
+        )
+        pred_index = (np.cumsum(len_p) - len_p)[row] + offset // len_l[row]
+        label_index = (np.cumsum(len_l) - len_l)[row] + offset % len_l[row]
+        sims = np.einsum(
+            "ij,ij->i", pred_embeddings[pred_index], label_embeddings[label_index]
+        )
+
         current_position = 0
-        for len_p, len_l in lengths:
-            pred_embeddings = embeddings[current_position : current_position + len_p, :]
-            current_position += len_p
-            label_embeddings = embeddings[
-                current_position : current_position + len_l, :
-            ]
-            current_position += len_l
-            sims = cosine_similarity(pred_embeddings, label_embeddings)
-            top_1_sas.append(np.max(sims[0, :]))
-            top_k_sas.append(np.max(sims))
-            pred_label_matrix.append(sims.tolist())
+        for p, l in zip(len_p.tolist(), len_l.tolist()):
+            window = sims[current_position : current_position + p * l]
+            top_1_sas.append(float(np.max(window[:l])))
+            top_k_sas.append(float(np.max(window)))
+            pred_label_matrix.append(window.reshape(p, l).tolist())
+            current_position += p * l
 
         return {
             "top_1_sas": top_1_sas,
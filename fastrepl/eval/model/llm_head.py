@@ -1,13 +1,27 @@
 import random
+import asyncio
 import functools
 import itertools
+from collections import Counter
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 
 from abc import abstractmethod
-from typing import Optional, Union, Tuple, Iterable, TypedDict, List, Dict, cast
+from typing import (
+    Optional,
+    Union,
+    Tuple,
+    Iterable,
+    TypedDict,
+    List,
+    Dict,
+    Any,
+    cast,
+)
 from typing_extensions import Unpack, NotRequired
 
 import fastrepl.llm as llm
-from fastrepl.utils import prompt, to_number, map_number_range
+from fastrepl.utils import prompt, getenv, to_number, map_number_range
 from fastrepl.eval.base import BaseSimpleEvalNode
 
 from fastrepl.warnings import (
@@ -18,9 +32,12 @@ from fastrepl.warnings import (
 from fastrepl.eval.model.utils import (
     logit_bias_from,
     mappings_from_labels,
+    permuted_mappings,
+    rotated_mappings,
     next_mappings_for_consensus,
     check_length_inbalance,
     PositionDebiasStrategy,
+    LabelMapping,
 )
 
 
@@ -40,6 +57,8 @@ class LLMEvaluationHead(BaseSimpleEvalNode):
         self.rg = kwargs.get("rg", random.Random(42))
         self.references = kwargs.get("references", [])
 
+        self._logit_bias: Dict[Tuple[str, Tuple[str, ...]], Dict[int, int]] = {}
+
     @abstractmethod
     def system_message(self, sample: str, context: str) -> Dict[str, str]:
         ...
@@ -62,29 +81,44 @@ class LLMEvaluationHead(BaseSimpleEvalNode):
             )
         )
 
+    def _references(self) -> List[Tuple[str, str]]:
+        return self.rg.sample(self.references, len(self.references))
+
     def messages(self, sample: str) -> List[Dict[str, str]]:
         system_message = self.system_message(sample, self.context)
-        reference_messages = self.reference_messages(
-            self.rg.sample(self.references, len(self.references))
-        )
+        reference_messages = self.reference_messages(self._references())
         final_message = self.final_message(sample, self.context)
 
         return [system_message, *reference_messages, final_message]
 
-    def completion(self, sample: str) -> Optional[str]:
-        logit_bias = logit_bias_from(self.model, [str(i) for i in self.options])
+    def logit_bias(self) -> Dict[int, int]:
+        # NOTE: `model` and `options` are public, so we key by them instead of computing once in `__init__`.
+        key = (self.model, tuple(str(i) for i in self.options))
+        if key not in self._logit_bias:
+            self._logit_bias[key] = logit_bias_from(*key)
+        return self._logit_bias[key]
+
+    def completion_kwargs(self, sample: str) -> Dict[str, Any]:
+        logit_bias = self.logit_bias()
         max_tokens = 1 if logit_bias != {} else 2
 
-        return llm.completion(
-            model=self.model,
-            messages=self.messages(sample),
-            max_tokens=max_tokens,
-            logit_bias=logit_bias,
-        )["choices"][0]["message"]["content"]
+        return {
+            "model": self.model,
+            "messages": self.messages(sample),
+            "max_tokens": max_tokens,
+            "logit_bias": logit_bias,
+        }
 
-    # NOTE: It is safe to return NONE, since metric will skip prediction-reference pair if prediction is NONE
-    def run(self, *, sample: str) -> Optional[Union[str, float]]:
-        result = self.completion(sample)
+    def completion(self, sample: str) -> Optional[str]:
+        return llm.completion(**self.completion_kwargs(sample))["choices"][0][
+            "message"
+        ]["content"]
+
+    async def acompletion(self, sample: str) -> Optional[str]:
+        result = await llm.acompletion(**self.completion_kwargs(sample))
+        return result["choices"][0]["message"]["content"]
+
+    def _validate(self, result: Optional[str]) -> Optional[str]:
         if result is None:
             return None
 
@@ -100,39 +134,85 @@ class LLMEvaluationHead(BaseSimpleEvalNode):
 
         return result
 
+    # NOTE: It is safe to return NONE, since metric will skip prediction-reference pair if prediction is NONE
+    def run(self, *, sample: str) -> Optional[Union[str, float]]:
+        return self._validate(self.completion(sample))
+
+    async def arun(self, *, sample: str) -> Optional[Union[str, float]]:
+        return self._validate(await self.acompletion(sample))
+
+
+# (head, mapping, index) of the voting call running in the current thread or task.
+_vote: ContextVar[Optional[Tuple[Any, List[LabelMapping], int]]] = ContextVar(
+    "_vote", default=None
+)
+
+# Runs the votes of every `position_debias_strategy="vote"` head, except the first one of each sample.
+VOTE_EXECUTOR = ThreadPoolExecutor(getenv("NUM_VOTE_THREADS", 16))
+
 
 class LLMClassificationHead(LLMEvaluationHead):
     def __init__(
         self,
         labels: Dict[str, str],
         position_debias_strategy: PositionDebiasStrategy = "shuffle",
+        num_permutations: Optional[int] = None,
         **kwargs: Unpack[LLMEvaluationHeadParams],
     ) -> None:
+        """
+        With `position_debias_strategy="vote"`, every sample is classified under `num_permutations` (default: one per label)
+        orderings of the labels at once, and the label picked by a strict majority of them wins.
+        Each call keeps its own ordering, so a head can be shared across threads and tasks.
+        """
         if check_length_inbalance(labels.values()):  # pragma: no cover
             warn(VerbosityBiasWarning)
 
         self.labels = labels
         self.mapping = mappings_from_labels(labels)
+        self._permutations = permuted_mappings(labels)
         self.position_debias_strategy: PositionDebiasStrategy = position_debias_strategy
+        self.num_permutations = num_permutations or len(labels)
+        self._votes = rotated_mappings(self.mapping, self.num_permutations)
 
         kwargs.update({"options": [m.token for m in self.mapping]})
         super().__init__(**kwargs)
 
-    def system_message(self, sample: str, context: str) -> Dict[str, str]:
-        @prompt
-        def p(context, labels, label_keys):
-            """You are master of classification who can classify any text according to the user's instructions.
-            {{context}}
+    # NOTE: `mapping` is reshuffled while running, so it lives in `_mapping` and is not part of the head's config.
+    @property
+    def mapping(self) -> List[LabelMapping]:
+        vote = _vote.get()
+        if vote is not None and vote[0] is self:
+            return vote[1]
+        return self._mapping
+
+    @mapping.setter
+    def mapping(self, mapping: List[LabelMapping]) -> None:
+        self._mapping = mapping
+
+    def _references(self) -> List[Tuple[str, str]]:
+        vote = _vote.get()
+        if vote is None or vote[0] is not self or not self.references:
+            return super()._references()
+
+        # NOTE: Rotated instead of shuffled with the shared `rg`, so the result does not depend on which call draws first.
+        k = vote[2] % len(self.references)
+        return self.references[k:] + self.references[:k]
+
+    @prompt
+    def system_prompt(context, labels, label_keys):
+        """You are master of classification who can classify any text according to the user's instructions.
+        {{context}}
 
-            These are the labels you can use:
-            {{labels}}
+        These are the labels you can use:
+        {{labels}}
 
-            Only output one of these label keys:
-            {{label_keys}}"""
+        Only output one of these label keys:
+        {{label_keys}}"""
 
+    def system_message(self, sample: str, context: str) -> Dict[str, str]:
         return {
             "role": "system",
-            "content": p(
+            "content": self.system_prompt(
                 context=context,
                 labels="\n".join(f"{m.token}: {m.description}" for m in self.mapping),
                 label_keys=", ".join(m.token for m in self.mapping),
@@ -156,7 +236,9 @@ class LLMClassificationHead(LLMEvaluationHead):
 
     def _compute(self, sample: str) -> Optional[str]:
         if self.position_debias_strategy == "shuffle":
-            self.mapping = mappings_from_labels(self.labels, rg=self.rg)
+            self.mapping = mappings_from_labels(
+                self.labels, rg=self.rg, precomputed=self._permutations
+            )
             return cast(str, super().run(sample=sample))
 
         if self.position_debias_strategy == "consensus":
@@ -175,13 +257,100 @@ class LLMClassificationHead(LLMEvaluationHead):
 
             return initial_result if initial_result == next_result else None
 
+        # NOTE: "vote" does not go through here, see `run`.
+        raise ValueError(self.position_debias_strategy)
+
+    # NOTE: Messages are rendered from `self.mapping` before the first `await`,
+    # so concurrent tasks can not interleave there. We keep our own reference for decoding the result.
+    async def _acompute(self, sample: str) -> Tuple[Optional[str], List[LabelMapping]]:
+        if self.position_debias_strategy == "shuffle":
+            mapping = self.mapping = mappings_from_labels(
+                self.labels, rg=self.rg, precomputed=self._permutations
+            )
+            return cast(str, await super().arun(sample=sample)), mapping
+
+        mapping = self.mapping
+        initial_result = cast(str, await super().arun(sample=sample))
+        if initial_result is None:
+            return None, mapping
+
+        next_mapping = next_mappings_for_consensus(mapping, initial_result)
+        if next_mapping is None:
+            return initial_result, mapping
+
+        self.mapping = next_mapping
+        next_result = await super().arun(sample=sample)
+        if next_result is None:
+            return None, next_mapping
+
+        result = initial_result if initial_result == next_result else None
+        return result, next_mapping
+
+    def _tally(self, tokens: List[Optional[str]]) -> Optional[str]:
+        votes = Counter(
+            next(m.label for m in mapping if m.token == token)
+            for mapping, token in zip(self._votes, tokens)
+            if token is not None
+        )
+        if not votes:
+            return None
+
+        # NOTE: Invalid predictions count against the majority. With two orderings, this is the same as "consensus".
+        label, count = votes.most_common(1)[0]
+        return label if 2 * count > len(tokens) else None
+
+    def _vote_all(self, sample: str) -> Optional[str]:
+        run = super().run
+
+        def call(k: int) -> Optional[str]:
+            token = _vote.set((self, self._votes[k], k))
+            try:
+                return cast(Optional[str], run(sample=sample))
+            finally:
+                _vote.reset(token)
+
+        # NOTE: One pool shared by every head and runner thread, so votes do not multiply the runner's threads.
+        # The first vote runs on the calling thread, so each sample makes progress even when the pool is busy.
+        futures = [VOTE_EXECUTOR.submit(call, k) for k in range(1, len(self._votes))]
+        try:
+            first = call(0)
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+        return self._tally([first, *(f.result() for f in futures)])
+
+    async def _avote_all(self, sample: str) -> Optional[str]:
+        arun = super().arun
+
+        # NOTE: `gather` runs each call in a task with its own copy of the context, so `set` does not leak between them.
+        async def call(k: int) -> Optional[str]:
+            _vote.set((self, self._votes[k], k))
+            return cast(Optional[str], await arun(sample=sample))
+
+        tokens = await asyncio.gather(*[call(k) for k in range(len(self._votes))])
+        return self._tally(list(tokens))
+
     def run(self, *, sample: str) -> Optional[str]:
+        if self.position_debias_strategy == "vote":
+            return self._vote_all(sample)
+
         token = self._compute(sample)
         if token is None:
             return None
 
         return next(m.label for m in self.mapping if m.token == token)
 
+    async def arun(self, *, sample: str) -> Optional[str]:
+        if self.position_debias_strategy == "vote":
+            return await self._avote_all(sample)
+
+        token, mapping = await self._acompute(sample)
+        if token is None:
+            return None
+
+        return next(m.label for m in mapping if m.token == token)
+
 
 class LLMGradingHead(LLMEvaluationHead):
     def __init__(
@@ -206,17 +375,22 @@ class LLMGradingHead(LLMEvaluationHead):
         kwargs.update({"options": options})
         super().__init__(**kwargs)
 
-    def system_message(self, sample: str, context: str) -> Dict[str, str]:
-        @prompt
-        def p(context, min, max):
-            """You are master of grading who can grade any text according to the context information that the user gives.
+    @prompt
+    def system_prompt(context, min, max):
+        """You are master of grading who can grade any text according to the context information that the user gives.
 
-            Context: {{context}}
+        Context: {{context}}
 
-            Now, you will receive a text to grade. Output a single integer number from {{min}} to {{max}}.
-            """
+        Now, you will receive a text to grade. Output a single integer number from {{min}} to {{max}}.
+        """
 
-        return {"role": "system", "content": p(context, self.from_min, self.from_max)}
+    def system_message(self, sample: str, context: str) -> Dict[str, str]:
+        return {
+            "role": "system",
+            "content": self.system_prompt(
+                context=context, min=self.from_min, max=self.from_max
+            ),
+        }
 
     def reference_messages(
         self,
@@ -236,9 +410,7 @@ class LLMGradingHead(LLMEvaluationHead):
     def final_message(self, sample: str, context: str) -> Dict[str, str]:
         return {"role": "user", "content": sample}
 
-    def run(self, *, sample: str) -> Optional[float]:
-        completion = self.completion(sample)
-
+    def _score(self, completion: Optional[str]) -> Optional[float]:
         result = to_number(completion)
         if result is None:
             warn(
@@ -261,3 +433,9 @@ class LLMGradingHead(LLMEvaluationHead):
             return closest
 
         return result
+
+    def run(self, *, sample: str) -> Optional[float]:
+        return self._score(self.completion(sample))
+
+    async def arun(self, *, sample: str) -> Optional[float]:
+        return self._score(await self.acompletion(sample))
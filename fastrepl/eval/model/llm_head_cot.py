@@ -1,4 +1,4 @@
-from typing import Optional, Dict
+from typing import Optional, Dict, Any
 
 import fastrepl.llm as llm
 from fastrepl.utils import prompt
@@ -6,36 +6,44 @@ from fastrepl.eval.model import LLMClassificationHead, LLMGradingHead
 
 
 class LLMClassificationHeadCOT(LLMClassificationHead):
-    def system_message(self, sample: str, context: str) -> Dict[str, str]:
-        @prompt
-        def p(context, labels):
-            """You are master of classification who can classify any text according to the user's instructions.
-            When user give you the text to classify, you do step-by-step thinking within 3 sentences and give a final result.
+    @prompt
+    def system_prompt(context, labels):
+        """You are master of classification who can classify any text according to the user's instructions.
+        When user give you the text to classify, you do step-by-step thinking within 3 sentences and give a final result.
 
-            When doing step-by-step thinking, you must consider the following:
-            {{ context }}
+        When doing step-by-step thinking, you must consider the following:
+        {{ context }}
 
-            These are the labels(KEY: DESCRIPTION) you can use:
-            {{labels}}
+        These are the labels(KEY: DESCRIPTION) you can use:
+        {{labels}}
 
-            Your response must strictly follow this format:
-            ### Thoughts
-            <STEP_BY_STEP_THOUGHTS>
-            ### Result
-            <SINGLE_LABEL_KEY>"""
+        Your response must strictly follow this format:
+        ### Thoughts
+        <STEP_BY_STEP_THOUGHTS>
+        ### Result
+        <SINGLE_LABEL_KEY>"""
 
+    def system_message(self, sample: str, context: str) -> Dict[str, str]:
         return {
             "role": "system",
-            "content": p(
+            "content": self.system_prompt(
                 context=context,
                 labels="\n".join(f"{m.token}: {m.description}" for m in self.mapping),
             ),
         }
 
+    def completion_kwargs(self, sample: str) -> Dict[str, Any]:
+        return {"model": self.model, "messages": self.messages(sample)}
+
     def completion(self, sample: str) -> Optional[str]:
-        prediction: str = llm.completion(
-            model=self.model, messages=self.messages(sample)
-        )["choices"][0]["message"]["content"]
+        result = llm.completion(**self.completion_kwargs(sample))
+        return self._parse(result["choices"][0]["message"]["content"])
+
+    async def acompletion(self, sample: str) -> Optional[str]:
+        result = await llm.acompletion(**self.completion_kwargs(sample))
+        return self._parse(result["choices"][0]["message"]["content"])
+
+    def _parse(self, prediction: str) -> str:
         prediction = prediction.split("### Result")[-1].strip()
 
         # TODO
@@ -48,25 +56,40 @@ class LLMClassificationHeadCOT(LLMClassificationHead):
 
 
 class LLMGradingHeadCOT(LLMGradingHead):
-    def system_message(self, sample: str, context: str) -> Dict[str, str]:
-        @prompt
-        def p(context, min, max):
-            """You are master of grading who can grade any text according to the context information that the user gives.
-            When you got the text to grade, you must do step-by-step thinking within 3 sentences and output a single integer from {{min}} to {{max}}.
+    @prompt
+    def system_prompt(context, min, max):
+        """You are master of grading who can grade any text according to the context information that the user gives.
+        When you got the text to grade, you must do step-by-step thinking within 3 sentences and output a single integer from {{min}} to {{max}}.
+
+        Context: {{ context }}
 
-            Context: {{ context }}
+        Now, you will receive a text to grade. Your response must strictly follow this format:
+        ### Thoughts
+        <STEP_BY_STEP_THOUGHTS>
+        ### Result
+        <NUMBER>"""
 
-            Now, you will receive a text to grade. Your response must strictly follow this format:
-            ### Thoughts
-            <STEP_BY_STEP_THOUGHTS>
-            ### Result
-            <NUMBER>"""
+    def system_message(self, sample: str, context: str) -> Dict[str, str]:
+        return {
+            "role": "system",
+            "content": self.system_prompt(
+                context=context, min=self.from_min, max=self.from_max
+            ),
+        }
 
-        return {"role": "system", "content": p(context, self.from_min, self.from_max)}
+    def completion_kwargs(self, sample: str) -> Dict[str, Any]:
+        return {"model": self.model, "messages": self.messages(sample)}
 
     def completion(self, sample: str) -> Optional[str]:
-        result = llm.completion(model=self.model, messages=self.messages(sample))[
-            "choices"
-        ][0]["message"]["content"]
+        result = llm.completion(**self.completion_kwargs(sample))
+
+        return (
+            result["choices"][0]["message"]["content"].split("### Result")[-1].strip()
+        )
+
+    async def acompletion(self, sample: str) -> Optional[str]:
+        result = await llm.acompletion(**self.completion_kwargs(sample))
 
-        return result.split("### Result")[-1].strip()
+        return (
+            result["choices"][0]["message"]["content"].split("### Result")[-1].strip()
+        )
@@ -1,4 +1,7 @@
-from typing import Literal, Optional, List
+from typing import Literal, Optional, Dict, List, Any
+
+import copy
+import math
 
 import backoff
 import openai.error
@@ -11,6 +14,8 @@ from fastrepl.utils import (
     suppress,
 )
 
+TIMEOUT = 40
+
 RAGAS_METRICS = Literal[  # pragma: no cover
     "Faithfulness",
     "AnswerRelevancy",
@@ -27,6 +32,8 @@ from fastrepl.eval.base import BaseRAGEvalNode
 
 
 class RAGAS(BaseRAGEvalNode):
+    _volatile = ("batch_size",)
+
     def __init__(
         self,
         metric: RAGAS_METRICS,
@@ -38,10 +45,17 @@ class RAGAS(BaseRAGEvalNode):
             "gpt-4-0314",
             "gpt-4-0613",
         ] = "gpt-3.5-turbo",
+        batch_size: int = 1,
+    ):
+        # NOTE: `_metric` is not part of the checkpoint fingerprint, so these are kept for it.
+        self.metric = metric
+        self.model = model
+        self.batch_size = batch_size
+        self._metric = self._load_metric(model, metric, batch_size)
+
+    def _load_metric(
+        self, model_name: str, metric_name: RAGAS_METRICS, batch_size: int
     ):
-        self._metric = self._load_metric(model, metric)
-
-    def _load_metric(self, model_name: str, metric_name: RAGAS_METRICS):
         from langchain.chat_models import ChatOpenAI
 
         from ragas.metrics.base import MetricWithLLM
@@ -59,6 +73,14 @@ class RAGAS(BaseRAGEvalNode):
             conciseness,
         )
 
+        critiques = {
+            "harmfulness": harmfulness,
+            "maliciousness": maliciousness,
+            "coherence": coherence,
+            "correctness": correctness,
+            "conciseness": conciseness,
+        }
+
         if not model_name.startswith("gpt"):
             raise NotImplementedError
 
@@ -66,31 +88,21 @@ class RAGAS(BaseRAGEvalNode):
 
         metric: MetricWithLLM
         if metric_name == "AnswerRelevancy":
-            metric = AnswerRelevancy(llm=llm, batch_size=1)
+            metric = AnswerRelevancy(llm=llm, batch_size=batch_size)
         elif metric_name == "ContextRecall":
-            metric = ContextRecall(llm=llm, batch_size=1)
+            metric = ContextRecall(llm=llm, batch_size=batch_size)
         elif metric_name == "ContextPrecision":
-            metric = ContextPrecision(llm=llm, batch_size=1)
+            metric = ContextPrecision(llm=llm, batch_size=batch_size)
         elif metric_name == "Faithfulness":
-            metric = Faithfulness(llm=llm, batch_size=1)
-        elif metric_name == "harmfulness":
-            harmfulness.llm = llm
-            metric = harmfulness
-        elif metric_name == "maliciousness":
-            maliciousness.llm = llm
-            metric = maliciousness
-        elif metric_name == "coherence":
-            coherence.llm = llm
-            metric = coherence
-        elif metric_name == "correctness":
-            correctness.llm = llm
-            metric = correctness
-        elif metric_name == "conciseness":
-            conciseness.llm = llm
-            metric = conciseness
+            metric = Faithfulness(llm=llm, batch_size=batch_size)
+        elif metric_name in critiques:
+            # NOTE: Critiques are module-level instances shared by every `RAGAS`, so each one gets its own copy.
+            metric = copy.copy(critiques[metric_name])
+            metric.llm = llm
         else:
             raise ValueError
 
+        metric.batch_size = batch_size
         return metric
 
     def inputs(self) -> List[str]:
@@ -107,68 +119,74 @@ class RAGAS(BaseRAGEvalNode):
         else:
             raise ValueError
 
-    def run(
+    def _columns(
         self,
         question: Optional[str] = None,
         answer: Optional[str] = None,
         contexts: Optional[List[str]] = None,
         ground_truths: Optional[List[str]] = None,
-    ) -> Optional[float]:
-        from datasets import Dataset
+    ) -> Dict[str, Any]:
         from ragas.metrics.base import EvaluationMode
 
-        ds: Dataset
-
         if self._metric.evaluation_mode == EvaluationMode.qac:
             if question is None or answer is None or contexts is None:
                 raise ValueError
             if len(contexts) == 0:
                 raise ValueError
 
-            ds = Dataset.from_dict(
-                {
-                    "question": [question],
-                    "answer": [answer],
-                    "contexts": [contexts],
-                }
-            )
+            return {"question": question, "answer": answer, "contexts": contexts}
         elif self._metric.evaluation_mode == EvaluationMode.qa:
             if question is None or answer is None:
                 raise ValueError
 
-            ds = Dataset.from_dict(
-                {
-                    "question": [question],
-                    "answer": [answer],
-                }
-            )
+            return {"question": question, "answer": answer}
         elif self._metric.evaluation_mode == EvaluationMode.qc:
             if question is None:
                 raise ValueError
             if contexts is None or len(contexts) == 0:
                 raise ValueError
 
-            ds = Dataset.from_dict(
-                {
-                    "question": [question],
-                    "contexts": [contexts],
-                }
-            )
+            return {"question": question, "contexts": contexts}
         elif self._metric.evaluation_mode == EvaluationMode.gc:
             if contexts is None or ground_truths is None:
                 raise ValueError
             if len(contexts) != len(ground_truths) or len(contexts) == 0:
                 raise ValueError
 
-            ds = Dataset.from_dict(
-                {
-                    "ground_truths": [ground_truths],
-                    "contexts": [contexts],
-                }
-            )
+            return {"ground_truths": ground_truths, "contexts": contexts}
         else:
             raise ValueError
 
+    def run(
+        self,
+        question: Optional[str] = None,
+        answer: Optional[str] = None,
+        contexts: Optional[List[str]] = None,
+        ground_truths: Optional[List[str]] = None,
+    ) -> Optional[float]:
+        return self.run_batch(
+            [
+                {
+                    "question": question,
+                    "answer": answer,
+                    "contexts": contexts,
+                    "ground_truths": ground_truths,
+                }
+            ]
+        )[0]
+
+    def run_batch(self, rows: List[Dict[str, Any]]) -> List[Optional[float]]:
+        """
+        Scores every row with a single `ragas.evaluate` call, `batch_size` rows per LLM batch.
+        """
+        from datasets import Dataset
+
+        if len(rows) == 0:
+            return []
+
+        columns = [self._columns(**row) for row in rows]
+        ds = Dataset.from_dict({k: [c[k] for c in columns] for k in columns[0]})
+
         return self._evaluate_with_retry(dataset=ds, metric=self._metric)
 
     @backoff.on_exception(
@@ -186,20 +204,24 @@ class RAGAS(BaseRAGEvalNode):
         max_value=100,
         factor=1.5,
     )
-    def _evaluate_with_retry(self, dataset, metric) -> Optional[float]:
+    def _evaluate_with_retry(self, dataset, metric) -> List[Optional[float]]:
         from datasets import Dataset
         from ragas.metrics.base import MetricWithLLM
 
-        @timeout(40, timeout_exception=openai.error.Timeout)
+        @timeout(TIMEOUT, timeout_exception=openai.error.Timeout)
         @suppress
-        def evaluate(dataset: Dataset, metric: MetricWithLLM) -> Optional[float]:
+        def evaluate(dataset: Dataset, metric: MetricWithLLM) -> List[Optional[float]]:
             from ragas import evaluate as _evaluate
 
             result = _evaluate(dataset=dataset, metrics=[metric])
-            return list(result.scores[0].values())[0]
+            return [list(score.values())[0] for score in result.scores]
 
+        # NOTE: The timeout is per LLM batch, so it grows with the number of batches.
+        num_batches = math.ceil(len(dataset) / self.batch_size)
         try:
-            return evaluate(dataset=dataset, metric=metric)
+            return evaluate(
+                dataset=dataset, metric=metric, dec_timeout=TIMEOUT * num_batches
+            )
         except Exception as e:
             raise_openai_exception_for_retry(e)
 
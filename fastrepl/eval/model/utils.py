@@ -1,7 +1,7 @@
 import random
 from dataclasses import dataclass
-from typing import Optional, Union, Literal, Iterable, List, Dict
-from itertools import combinations
+from typing import Optional, Union, Literal, Iterable, Tuple, List, Dict
+from itertools import combinations, permutations
 
 import sys
 
@@ -38,17 +38,69 @@ class LabelMapping:
     description: str
 
 
-def mappings_from_labels(
-    labels: Dict[str, str], start=ord("A"), rg=random.Random(42)
+Permutations: TypeAlias = Dict[Tuple[int, ...], List[LabelMapping]]
+
+# 5! = 120 mappings at most.
+MAX_PRECOMPUTED_LABELS = 5
+
+
+def _mappings(
+    labels: Dict[str, str], indices: Iterable[int], start: int
 ) -> List[LabelMapping]:
-    keys = rg.sample(list(labels.keys()), len(labels))
+    keys = list(labels.keys())
     return [
-        LabelMapping(token=chr(start + i), label=label, description=labels[label])
-        for i, label in enumerate(keys)
+        LabelMapping(token=chr(start + i), label=keys[j], description=labels[keys[j]])
+        for i, j in enumerate(indices)
     ]
 
 
-PositionDebiasStrategy: TypeAlias = Literal["shuffle", "consensus"]
+def permuted_mappings(labels: Dict[str, str], start=ord("A")) -> Permutations:
+    if len(labels) > MAX_PRECOMPUTED_LABELS:
+        return {}
+
+    return {
+        indices: _mappings(labels, indices, start)
+        for indices in permutations(range(len(labels)))
+    }
+
+
+def mappings_from_labels(
+    labels: Dict[str, str],
+    start=ord("A"),
+    rg=random.Random(42),
+    precomputed: Optional[Permutations] = None,
+) -> List[LabelMapping]:
+    # NOTE: `sample` only depends on the population size, so this draws the same permutation as sampling the keys.
+    indices = tuple(rg.sample(range(len(labels)), len(labels)))
+
+    if precomputed is not None and indices in precomputed:
+        return precomputed[indices]
+    return _mappings(labels, indices, start)
+
+
+PositionDebiasStrategy: TypeAlias = Literal["shuffle", "consensus", "vote"]
+
+
+def rotated_mappings(
+    mappings: List[LabelMapping], num: int
+) -> List[List[LabelMapping]]:
+    """
+    `num` orderings of the labels in `mappings`, for voting. The first `len(mappings)` are its rotations, so that every label
+    takes every position once, the next ones rotate the reversed order, and so on. Tokens stay in place, so all share the same options.
+    """
+    size = len(mappings)
+
+    ret = []
+    for k in range(num):
+        base = mappings if (k // size) % 2 == 0 else mappings[::-1]
+        shift = k % size
+        ret.append(
+            [
+                LabelMapping(token=m.token, label=b.label, description=b.description)
+                for m, b in zip(mappings, base[shift:] + base[:shift])
+            ]
+        )
+    return ret
 
 
 # TODO: we can not be sure that every LLM has bias toward the first
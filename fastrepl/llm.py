@@ -1,5 +1,7 @@
-from typing import Optional, List, Dict, Any
-import functools
+from typing import Optional, Iterable, Tuple, List, Dict, Any
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, Future
 
 import backoff
 import openai.error
@@ -9,13 +11,19 @@ from fastrepl.warnings import (
     warn,
     CompletionTruncatedWarning,
 )
-from fastrepl.errors import TokenizeNotImplementedError
 from fastrepl.utils import (
     getenv,
     debug,
     RetryExpoException,
     RetryConstantException,
     raise_openai_exception_for_retry,
+    SQLiteCache,
+    RateLimiter,
+    AdaptiveConcurrency,
+    SingleFlight,
+    TokenizerRegistry,
+    TiktokenEncoder,
+    CohereEncoder,
 )
 
 import litellm
@@ -28,8 +36,10 @@ def custom_get_cache_key(*args, **kwargs):  # pragma: no cover
     messages = str(kwargs.get("messages", ""))
     temperature = str(kwargs.get("temperature", ""))
     logit_bias = str(kwargs.get("logit_bias", ""))
+    max_tokens = str(kwargs.get("max_tokens", ""))
+    stop = str(kwargs.get("stop", ""))
 
-    key = f"{model}/{messages}/{temperature}/{logit_bias}"
+    key = f"{model}/{messages}/{temperature}/{logit_bias}/{max_tokens}/{stop}"
     return key
 
 
@@ -37,56 +47,243 @@ litellm.telemetry = False  # pragma: no cover
 litellm.cache = Cache()  # pragma: no cover
 litellm.cache.get_cache_key = custom_get_cache_key  # pragma: no cover
 
+disk_cache: Optional[SQLiteCache] = None
 
-@timeout(25, timeout_exception=openai.error.Timeout)
-def litellm_completion(**kwargs) -> litellm.ModelResponse:  # pragma: no cover
-    litellm_config = {
-        "function": "completion",
-        "model": {
-            "gpt-3.5-turbo": {
-                "error_handling": {
-                    "ContextWindowExceededError": {
-                        "fallback_model": "gpt-3.5-turbo-16k"
-                    }
-                }
-            },
-            "gpt-3.5-turbo-0301": {
-                "error_handling": {
-                    "ContextWindowExceededError": {
-                        "fallback_model": "gpt-3.5-turbo-16k-0301"
-                    }
-                }
-            },
-            "gpt-3.5-turbo-0613": {
-                "error_handling": {
-                    "ContextWindowExceededError": {
-                        "fallback_model": "gpt-3.5-turbo-16k-0613"
-                    }
-                }
-            },
-            "gpt-4": {
-                "error_handling": {
-                    "ContextWindowExceededError": {"fallback_model": "gpt-4-32k"}
-                }
-            },
-            "gpt-4-0314": {
-                "error_handling": {
-                    "ContextWindowExceededError": {"fallback_model": "gpt-4-32k-0314"}
+
+def use_disk_cache(
+    path="~/.cache/fastrepl/llm.db",
+    ttl: Optional[float] = None,
+    max_size: Optional[int] = None,
+) -> SQLiteCache:
+    global disk_cache
+    disk_cache = SQLiteCache(path, ttl=ttl, max_size=max_size)
+    return disk_cache
+
+
+rate_limiters: Dict[str, RateLimiter] = {}
+
+
+def set_rate_limit(
+    model: str, rpm: Optional[float] = None, tpm: Optional[float] = None
+) -> RateLimiter:
+    rate_limiters[model] = RateLimiter(rpm=rpm, tpm=tpm)
+    return rate_limiters[model]
+
+
+concurrency_limits: Dict[str, AdaptiveConcurrency] = {}
+
+
+def set_adaptive_concurrency(
+    model: str, initial: int = 4, minimum: int = 1, maximum: int = 64, **kwargs
+) -> AdaptiveConcurrency:
+    """
+    Caps in-flight calls to `model`, raising the cap while calls stay fast and cutting it on rate limits and timeouts.
+    Runners size their pools to `maximum`, so the cap is what actually bounds the concurrency.
+    """
+    concurrency_limits[model] = AdaptiveConcurrency(
+        initial=initial, minimum=minimum, maximum=maximum, **kwargs
+    )
+    return concurrency_limits[model]
+
+
+def concurrency_levels() -> Dict[str, int]:
+    return {model: c.limit for model, c in concurrency_limits.items()}
+
+
+def _overloaded(e: Exception) -> bool:
+    return isinstance(e, (openai.error.RateLimitError, openai.error.Timeout))
+
+
+# Tokens each chat message costs on top of its content. `runner.estimate` counts them the same way.
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    # NOTE: We count with cl100k_base for every model. It is exact for OpenAI models,
+    # and close enough to pace others without a tokenizer round trip.
+    ids = tokenize_many("gpt-3.5-turbo", [m["content"] for m in messages])
+    return sum(len(i) + MESSAGE_OVERHEAD for i in ids) + max_tokens
+
+
+# NOTE: Identical deterministic calls made at the same time (e.g. duplicated samples, or `num>1`) share one request.
+# Calls with `temperature > 0` are never coalesced, since each of them is meant to be an independent sample.
+in_flight = SingleFlight()
+
+
+LITELLM_CONFIG: Dict[str, Any] = {
+    "function": "completion",
+    "model": {
+        "gpt-3.5-turbo": {
+            "error_handling": {
+                "ContextWindowExceededError": {"fallback_model": "gpt-3.5-turbo-16k"}
+            }
+        },
+        "gpt-3.5-turbo-0301": {
+            "error_handling": {
+                "ContextWindowExceededError": {
+                    "fallback_model": "gpt-3.5-turbo-16k-0301"
                 }
-            },
-            "gpt-4-0613": {
-                "error_handling": {
-                    "ContextWindowExceededError": {"fallback_model": "gpt-4-32k-0613"}
+            }
+        },
+        "gpt-3.5-turbo-0613": {
+            "error_handling": {
+                "ContextWindowExceededError": {
+                    "fallback_model": "gpt-3.5-turbo-16k-0613"
                 }
-            },
+            }
+        },
+        "gpt-4": {
+            "error_handling": {
+                "ContextWindowExceededError": {"fallback_model": "gpt-4-32k"}
+            }
+        },
+        "gpt-4-0314": {
+            "error_handling": {
+                "ContextWindowExceededError": {"fallback_model": "gpt-4-32k-0314"}
+            }
+        },
+        "gpt-4-0613": {
+            "error_handling": {
+                "ContextWindowExceededError": {"fallback_model": "gpt-4-32k-0613"}
+            }
         },
-    }
-    res = litellm.completion_with_config(litellm_config, **kwargs)
+    },
+}
+
+# NOTE: litellm fetches `model_cost` over the network on import, so we keep our own entries for the models we fall back between.
+# USD per token, as of 2023-10.
+MODEL_INFO: Dict[str, Dict[str, float]] = {
+    **{
+        m: {
+            "max_tokens": 4097,
+            "input_cost_per_token": 1.5e-06,
+            "output_cost_per_token": 2e-06,
+        }
+        for m in ["gpt-3.5-turbo", "gpt-3.5-turbo-0301", "gpt-3.5-turbo-0613"]
+    },
+    **{
+        m: {
+            "max_tokens": 16385,
+            "input_cost_per_token": 3e-06,
+            "output_cost_per_token": 4e-06,
+        }
+        for m in [
+            "gpt-3.5-turbo-16k",
+            "gpt-3.5-turbo-16k-0301",
+            "gpt-3.5-turbo-16k-0613",
+        ]
+    },
+    **{
+        m: {
+            "max_tokens": 8192,
+            "input_cost_per_token": 3e-05,
+            "output_cost_per_token": 6e-05,
+        }
+        for m in ["gpt-4", "gpt-4-0314", "gpt-4-0613"]
+    },
+    **{
+        m: {
+            "max_tokens": 32768,
+            "input_cost_per_token": 6e-05,
+            "output_cost_per_token": 1.2e-04,
+        }
+        for m in ["gpt-4-32k", "gpt-4-32k-0314", "gpt-4-32k-0613"]
+    },
+}
+
+
+def model_info(model: str) -> Optional[Dict[str, Any]]:
+    return litellm.model_cost.get(model, MODEL_INFO.get(model))
+
+
+def fallback_model(model: str) -> Optional[str]:
+    config = LITELLM_CONFIG["model"].get(model, {})
+    return (
+        config.get("error_handling", {})
+        .get("ContextWindowExceededError", {})
+        .get("fallback_model")
+    )
+
+
+def route_model(model: str, tokens: int) -> str:
+    """
+    Returns the first model in the fallback chain whose context window fits `tokens` (prompt + max_tokens),
+    or the last one if none does.
+    """
+    info = model_info(model)
+    while info is not None and tokens > info["max_tokens"]:
+        fallback = fallback_model(model)
+        if fallback is None:
+            break
+        model, info = fallback, model_info(fallback)
+    return model
+
+
+# NOTE: When enabled, prompts that will not fit go straight to the fallback model,
+# instead of finding out through `ContextWindowExceededError`. Costs a tokenization per call.
+preflight_fallback = False
+
+TIMEOUT = 25
+DEFAULT_MAX_TOKENS = 200
+
+# NOTE: litellm(0.8.x) has no native async transport, so `acompletion` offloads blocking calls here.
+# Threads are spawned lazily, so this costs nothing until the async path is used.
+ASYNC_EXECUTOR = ThreadPoolExecutor(getenv("MAX_CONCURRENCY", 256))
+
+
+def _litellm_completion(**kwargs) -> litellm.ModelResponse:  # pragma: no cover
+    res = litellm.completion_with_config(LITELLM_CONFIG, **kwargs)
     if res is None:
         raise RetryConstantException
     return res
 
 
+@timeout(TIMEOUT, timeout_exception=openai.error.Timeout)
+def litellm_completion(**kwargs) -> litellm.ModelResponse:  # pragma: no cover
+    return _litellm_completion(**kwargs)
+
+
+async def litellm_acompletion(
+    future: Future,
+) -> litellm.ModelResponse:  # pragma: no cover
+    """
+    Waits for a `_litellm_completion` call submitted to `ASYNC_EXECUTOR`. On timeout we stop waiting,
+    but a call that already started keeps running in its thread.
+    """
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), TIMEOUT)
+    except asyncio.TimeoutError as e:
+        raise openai.error.Timeout from e
+
+
+def _preprocess(kwargs: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+    if kwargs["model"].startswith("deepinfra/mistralai") and kwargs["temperature"] == 0:
+        kwargs["temperature"] = 0.0001
+
+    if preflight_fallback:
+        tokens = estimate_tokens(kwargs["messages"], kwargs["max_tokens"])
+        kwargs["model"] = route_model(kwargs["model"], tokens)
+
+    return kwargs, custom_get_cache_key(**kwargs)
+
+
+def _postprocess(
+    result: Dict[str, Any], kwargs: Dict[str, Any], cache_key: str
+) -> Dict[str, Any]:
+    content = result["choices"][0]["message"]["content"]
+
+    if kwargs["max_tokens"] > 2 and result["choices"][0]["finish_reason"] == "length":
+        warn(CompletionTruncatedWarning, context=content)
+
+    # TODO: debug call should be done in eval side
+    debug({"llm_input": kwargs["messages"], "llm_output": content})
+
+    if disk_cache is not None:
+        disk_cache.set_cache(cache_key, result)
+
+    return result
+
+
 @backoff.on_exception(
     wait_gen=backoff.constant,
     exception=(RetryConstantException),
@@ -108,7 +305,7 @@ def completion(  # pragma: no cover
     messages: List[Dict[str, str]],
     temperature: float = 0,
     logit_bias: Dict[int, int] = {},
-    max_tokens: int = 200,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
     functions: List[Dict[str, Any]] = [],
     stop: Optional[List[str]] = None,
 ) -> Dict[str, Any]:
@@ -116,46 +313,140 @@ def completion(  # pragma: no cover
     https://docs.litellm.ai/docs/providers
     """
 
-    if model.startswith("deepinfra/mistralai") and temperature == 0:
-        temperature = 0.0001
+    kwargs, cache_key = _preprocess(
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "logit_bias": logit_bias,
+            "max_tokens": max_tokens,
+            "functions": functions,
+            "stop": stop,
+        }
+    )
+    if disk_cache is not None:
+        cached = disk_cache.get_cache(cache_key)
+        if cached is not None:
+            return cached
 
-    try:
-        result = litellm_completion(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            logit_bias=logit_bias,
-            max_tokens=max_tokens,
-            functions=functions,
-            stop=stop,
-        )
-        content = result["choices"][0]["message"]["content"]
+    def call() -> Dict[str, Any]:
+        limiter = rate_limiters.get(kwargs["model"])
+        if limiter is not None:
+            limiter.acquire(estimate_tokens(messages, max_tokens))
 
-        if max_tokens > 2 and result["choices"][0]["finish_reason"] == "length":
-            warn(CompletionTruncatedWarning, context=content)
+        controller = concurrency_limits.get(kwargs["model"])
+        if controller is not None:
+            controller.acquire()
 
-        # TODO: debug call should be done in eval side
-        debug({"llm_input": messages, "llm_output": content})
+        started = time.monotonic()
+        try:
+            result = litellm_completion(**kwargs)
+            if controller is not None:
+                controller.on_success(started)
+            return _postprocess(result, kwargs, cache_key)
+        except Exception as e:
+            if controller is not None and _overloaded(e):
+                controller.on_overload(started)
+            raise_openai_exception_for_retry(e)
+        finally:
+            if controller is not None:
+                controller.release()
 
-        return result
-    except Exception as e:
-        raise_openai_exception_for_retry(e)
+        raise Exception  # to make mypy happy
 
-    raise Exception  # to make mypy happy
+    if kwargs["temperature"] == 0:
+        return in_flight.do(cache_key, call)
+    return call()
+
+
+@backoff.on_exception(
+    wait_gen=backoff.constant,
+    exception=(RetryConstantException),
+    raise_on_giveup=True,
+    max_tries=3,
+    interval=3,
+)
+@backoff.on_exception(
+    wait_gen=backoff.expo,
+    exception=(RetryExpoException),
+    raise_on_giveup=True,
+    jitter=backoff.full_jitter,
+    max_value=100,
+    factor=1.5,
+)
+async def acompletion(  # pragma: no cover
+    *,
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float = 0,
+    logit_bias: Dict[int, int] = {},
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    functions: List[Dict[str, Any]] = [],
+    stop: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    kwargs, cache_key = _preprocess(
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "logit_bias": logit_bias,
+            "max_tokens": max_tokens,
+            "functions": functions,
+            "stop": stop,
+        }
+    )
+    if disk_cache is not None:
+        cached = disk_cache.get_cache(cache_key)
+        if cached is not None:
+            return cached
+
+    async def call() -> Dict[str, Any]:
+        limiter = rate_limiters.get(kwargs["model"])
+        if limiter is not None:
+            await limiter.aacquire(estimate_tokens(messages, max_tokens))
+
+        controller = concurrency_limits.get(kwargs["model"])
+        if controller is not None:
+            await controller.aacquire()
+
+        started = time.monotonic()
+        future = ASYNC_EXECUTOR.submit(_litellm_completion, **kwargs)
+        if controller is not None:
+            # NOTE: Released when the thread is done rather than when we give up waiting, since the request is in flight until then.
+            release = controller.release
+            future.add_done_callback(lambda _: release())
+
+        try:
+            result = await litellm_acompletion(future)
+            if controller is not None:
+                controller.on_success(started)
+            return _postprocess(result, kwargs, cache_key)
+        except Exception as e:
+            if controller is not None and _overloaded(e):
+                controller.on_overload(started)
+            raise_openai_exception_for_retry(e)
+
+        raise Exception  # to make mypy happy
+
+    if kwargs["temperature"] == 0:
+        return await in_flight.ado(cache_key, call)
+    return await call()
+
+
+tokenizers = TokenizerRegistry(max_size=getenv("TOKENIZE_CACHE_SIZE", 4096))
+tokenizers.register("gpt", lambda: TiktokenEncoder("cl100k_base"))
+tokenizers.register(
+    "command", lambda: CohereEncoder(getenv("COHERE_API_KEY", ""), model="command")
+)
 
 
-@functools.lru_cache(maxsize=None)
 def tokenize(model: str, text: str) -> List[int]:
-    if model.startswith("command"):
-        import cohere
+    return tokenizers.tokenize(model, text)
+
 
-        co = cohere.Client(getenv("COHERE_API_KEY", ""))
-        response = co.tokenize(text=text, model="command")
-        return response.tokens
-    elif model.startswith("gpt"):
-        import tiktoken
+def tokenize_many(model: str, texts: List[str]) -> List[List[int]]:
+    return tokenizers.tokenize_many(model, texts)
 
-        enc = tiktoken.get_encoding("cl100k_base")
-        return enc.encode(text)
 
-    raise TokenizeNotImplementedError(model)
+def count_tokens(model: str, texts: Iterable[str]) -> List[int]:
+    return tokenizers.count_tokens(model, texts)
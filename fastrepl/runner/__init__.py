@@ -1,17 +1,38 @@
-from typing import Union, Callable, Optional, overload
+from typing import (
+    Union,
+    Callable,
+    Optional,
+    Literal,
+    Iterable,
+    Mapping,
+    Tuple,
+    Dict,
+    overload,
+)
 
 from fastrepl.dataset import Dataset
 from fastrepl.eval import Evaluator
 from fastrepl.gen.question import BaseGenerator
 
-from fastrepl.runner.evaluator import LocalEvaluatorRunner, RemoteEvaluatorRunner
+from fastrepl.runner.evaluator import (
+    LocalEvaluatorRunner,
+    LocalMultiEvaluatorRunner,
+    RemoteEvaluatorRunner,
+)
 from fastrepl.runner.generator import LocalGeneratorRunner, RemoteGeneratorRunner
 from fastrepl.runner.promptlayer import PromptLayerRunner
 from fastrepl.runner.custom import LocalCustomRunner
+from fastrepl.runner.estimate import Estimate
 
 
 @overload
-def local_runner(*, fn: Callable, output_feature: str) -> LocalCustomRunner:
+def local_runner(
+    *,
+    fn: Callable,
+    output_feature: str,
+    executor: Literal["thread", "process"] = "thread",
+    models: Optional[Iterable[str]] = None,
+) -> LocalCustomRunner:
     ...
 
 
@@ -22,14 +43,34 @@ def local_runner(*, generator: BaseGenerator) -> LocalGeneratorRunner:
 
 @overload
 def local_runner(
-    *, evaluator: Evaluator, dataset: Dataset, output_feature: str
+    *,
+    evaluator: Evaluator,
+    dataset: Dataset,
+    output_feature: str,
+    checkpoint_dir: Optional[str] = None,
+    executor: Literal["thread", "process"] = "thread",
 ) -> LocalEvaluatorRunner:
     ...
 
 
+@overload
+def local_runner(
+    *,
+    evaluators: Mapping[str, Evaluator],
+    dataset: Dataset,
+    concurrency: Optional[Dict[str, int]] = None,
+) -> LocalMultiEvaluatorRunner:
+    ...
+
+
 def local_runner(
     **kwargs,
-) -> Union[LocalGeneratorRunner, LocalEvaluatorRunner, LocalCustomRunner]:
+) -> Union[
+    LocalGeneratorRunner,
+    LocalEvaluatorRunner,
+    LocalMultiEvaluatorRunner,
+    LocalCustomRunner,
+]:
     if "generator" in kwargs:
         return LocalGeneratorRunner(generator=kwargs["generator"])
 
@@ -38,12 +79,23 @@ def local_runner(
             evaluator=kwargs["evaluator"],
             dataset=kwargs["dataset"],
             output_feature=kwargs.get("output_feature", "result"),
+            checkpoint_dir=kwargs.get("checkpoint_dir"),
+            executor=kwargs.get("executor", "thread"),
+        )
+
+    if "evaluators" in kwargs:
+        return LocalMultiEvaluatorRunner(
+            evaluators=kwargs["evaluators"],
+            dataset=kwargs["dataset"],
+            concurrency=kwargs.get("concurrency"),
         )
 
     if "fn" in kwargs:
         return LocalCustomRunner(
             fn=kwargs["fn"],
             output_feature=kwargs.get("output_feature", "result"),
+            executor=kwargs.get("executor", "thread"),
+            models=kwargs.get("models"),
         )
 
     raise ValueError
@@ -56,7 +108,15 @@ def remote_runner(*, generator: BaseGenerator) -> RemoteGeneratorRunner:
 
 @overload
 def remote_runner(
-    *, evaluator: Evaluator, dataset: Dataset, output_feature="result"
+    *,
+    evaluator: Evaluator,
+    dataset: Dataset,
+    output_feature="result",
+    address: Tuple[str, int] = ("localhost", 0),
+    authkey: Optional[bytes] = None,
+    shard_size=100,
+    max_retries=3,
+    num_local_workers=0,
 ) -> RemoteEvaluatorRunner:
     return RemoteEvaluatorRunner(evaluator, dataset, output_feature)
 
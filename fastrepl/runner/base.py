@@ -1,5 +1,9 @@
+from typing import Iterable, Iterator, Tuple, List, Any
 from abc import ABC, abstractmethod
 
+from concurrent.futures import Future, as_completed
+
+from fastrepl import llm
 from fastrepl.dataset import Dataset
 
 
@@ -7,3 +11,30 @@ class BaseRunner(ABC):
     @abstractmethod
     def run(self, *args, **kwargs) -> Dataset:
         pass
+
+
+def iter_rows(
+    rows: List[List[Future]], ordered: bool
+) -> Iterator[Tuple[int, List[Any]]]:
+    if ordered:
+        for i, futures in enumerate(rows):
+            yield i, [future.result() for future in futures]
+        return
+
+    indices = {future: i for i, futures in enumerate(rows) for future in futures}
+    remaining = [len(futures) for futures in rows]
+
+    for future in as_completed(indices):
+        i = indices[future]
+        remaining[i] -= 1
+        if remaining[i] == 0:
+            yield i, [future.result() for future in rows[i]]
+
+
+def num_workers(num_threads: int, num_tasks: int, models: Iterable[str] = ()) -> int:
+    # NOTE: Models with adaptive concurrency are capped by their controller, so the pool must not be the tighter bound.
+    # Only the models the runner actually calls count, so one controller does not grow every other runner's pool.
+    caps = [
+        llm.concurrency_limits[m].maximum for m in models if m in llm.concurrency_limits
+    ]
+    return max(1, min(max([num_threads, *caps]), num_tasks))
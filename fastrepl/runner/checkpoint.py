@@ -0,0 +1,107 @@
+from typing import Dict, Any
+
+import os
+import json
+import random
+import hashlib
+import threading
+import dataclasses
+
+from fastrepl.utils.prompt import Prompt
+
+
+def _simplify(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple, set)):
+        return [_simplify(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _simplify(v) for k, v in value.items()}
+    if isinstance(value, random.Random):  # NOTE: its state is not part of the config
+        return type(value).__name__
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return _simplify(dataclasses.asdict(value))
+    if hasattr(value, "__dict__"):
+        volatile = getattr(value, "_volatile", ())
+        # NOTE: Prompt templates live on the class, so subclasses that only override them differ here.
+        prompts = {
+            name: getattr(type(value), name).template
+            for name in dir(type(value))
+            if isinstance(getattr(type(value), name, None), Prompt)
+        }
+        return {
+            "__type__": type(value).__qualname__,
+            **({"__prompts__": prompts} if prompts else {}),
+            **{
+                k: _simplify(v)
+                for k, v in vars(value).items()
+                if not k.startswith("_") and k not in volatile
+            },
+        }
+    return type(value).__qualname__
+
+
+def _plain(value: Any) -> Any:
+    # NOTE: numpy scalars and arrays (e.g. scores) are saved as the Python values they hold, and resume as those.
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(
+        f"results of type {type(value).__qualname__} can not be checkpointed, return JSON-serializable values instead"
+    )
+
+
+def fingerprint(value: Any) -> str:
+    s = json.dumps(_simplify(value), sort_keys=True)
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()[:16]
+
+
+class Checkpoint:
+    """
+    Append-only JSONL files under `<directory>/<evaluator fingerprint>/<repetition>.jsonl`,
+    mapping a hash of each row's inputs to its result.
+    """
+
+    def __init__(self, directory: str, evaluator: Any) -> None:
+        self._dir = os.path.join(os.path.expanduser(directory), fingerprint(evaluator))
+        os.makedirs(self._dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(row: Dict[str, Any]) -> str:
+        s = json.dumps(row, sort_keys=True, default=str)
+        return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+    def _path(self, rep: int) -> str:
+        return os.path.join(self._dir, f"{rep}.jsonl")
+
+    def load(self, rep: int) -> Dict[str, Any]:
+        done: Dict[str, Any] = {}
+
+        path = self._path(rep)
+        if not os.path.exists(path):
+            return done
+
+        line = ""
+        with open(path, "r") as f:
+            for line in f:
+                # NOTE: The last line can be partially written if the previous run was killed.
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                done[item["key"]] = item["result"]
+
+        # Make sure the next append does not land on the partially written line.
+        if line != "" and not line.endswith("\n"):
+            with open(path, "a") as f:
+                f.write("\n")
+
+        return done
+
+    def save(self, rep: int, key: str, result: Any) -> None:
+        line = json.dumps({"key": key, "result": result}, default=_plain)
+
+        with self._lock:
+            with open(self._path(rep), "a") as f:
+                f.write(line + "\n")
@@ -1,10 +1,25 @@
-from typing import Callable, Optional, Iterable, Mapping, List, Any, cast
+from typing import (
+    Callable,
+    Optional,
+    Literal,
+    Iterable,
+    Iterator,
+    Mapping,
+    Tuple,
+    List,
+    Dict,
+    Any,
+    cast,
+)
 
 from concurrent.futures import ThreadPoolExecutor, Future
 from rich.progress import Progress
 
 import fastrepl
 from fastrepl.utils import getenv, console
+from fastrepl import llm
+from fastrepl.runner.base import iter_rows, num_workers
+from fastrepl.runner.process import ProcessPool
 
 NUM_THREADS = getenv("NUM_THREADS", 12)
 
@@ -14,17 +29,45 @@ class LocalCustomRunner:
         self,
         fn: Callable,
         output_feature="sample",
+        executor: Literal["thread", "process"] = "thread",
+        models: Optional[Iterable[str]] = None,
     ) -> None:
+        """
+        With `executor="process"`, `run` calls `fn` in a process pool, so it must be picklable (e.g. a module-level function).
+        `models` are the models `fn` calls. The thread pool grows with their adaptive concurrency limits,
+        or with every model set up with `llm.set_adaptive_concurrency` if not given.
+        """
         self._fn = fn
         self._output_feature = output_feature
+        self._executor = executor
+        self._models_called = list(models) if models is not None else None
+
+    @property
+    def concurrency(self) -> Dict[str, int]:
+        """
+        Current in-flight limit per model set up with `llm.set_adaptive_concurrency`.
+        """
+        return llm.concurrency_levels()
+
+    def _models(self) -> List[str]:
+        # NOTE: We can not tell which models `fn` calls, so without `models` every controller counts.
+        if self._models_called is None:
+            return list(llm.concurrency_limits)
+        return self._models_called
 
     def _run_single(
         self,
         args_list: List[Iterable[Any]],
         kwds_list: List[Mapping[str, Any]],
-        cb: Callable[[Future], None],
+        cb: Callable[[Optional[Future]], None],
+        processes: Optional[ProcessPool] = None,
     ) -> List[Any]:
-        with ThreadPoolExecutor(min(NUM_THREADS, len(args_list))) as executor:
+        if processes is not None:
+            return processes.map(list(zip(args_list, kwds_list)), lambda: cb(None))
+
+        with ThreadPoolExecutor(
+            num_workers(NUM_THREADS, len(args_list), self._models())
+        ) as executor:
             futures: List[Future] = []
 
             for args, kwds in zip(args_list, kwds_list):
@@ -53,12 +96,43 @@ class LocalCustomRunner:
             task_id = progress.add_task(msg, total=len(args_list))
             cb = lambda future: progress.update(task_id, advance=1, refresh=True)
 
-            if num > 1:
-                results = [
-                    self._run_single(args_list, kwds_list, cb) for _ in range(num)
-                ]
-                data = [list(item) for item in zip(*results)]
-            else:
-                data = self._run_single(args_list, kwds_list, cb)
+            processes = ProcessPool(self._fn) if self._executor == "process" else None
+            try:
+                if num > 1:
+                    results = [
+                        self._run_single(args_list, kwds_list, cb, processes)
+                        for _ in range(num)
+                    ]
+                    data = [list(item) for item in zip(*results)]
+                else:
+                    data = self._run_single(args_list, kwds_list, cb, processes)
+            finally:
+                if processes is not None:
+                    processes.shutdown()
 
             return fastrepl.Dataset.from_dict({self._output_feature: data})
+
+    def stream(
+        self,
+        args_list: Optional[List[Iterable[Any]]] = None,
+        kwds_list: Optional[List[Mapping[str, Any]]] = None,
+        num=1,
+        ordered=False,
+    ) -> Iterator[Tuple[int, Any]]:
+        assert args_list is not None or kwds_list is not None
+
+        args_list = args_list or [()] * len(cast(List[Iterable[Any]], kwds_list))
+        kwds_list = kwds_list or [{}] * len(cast(List[Mapping[str, Any]], args_list))
+
+        executor = ThreadPoolExecutor(
+            num_workers(NUM_THREADS, len(args_list), self._models())
+        )
+        try:
+            rows = [
+                [executor.submit(self._fn, *args, **kwds) for _ in range(num)]
+                for args, kwds in zip(args_list, kwds_list)
+            ]
+            for i, results in iter_rows(rows, ordered):
+                yield i, results if num > 1 else results[0]
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
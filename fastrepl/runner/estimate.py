@@ -0,0 +1,84 @@
+from typing import Iterable, List, Dict, Any
+from dataclasses import dataclass, field
+import itertools
+
+import fastrepl.llm as llm
+
+
+@dataclass
+class Estimate:
+    num_rows: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    # USD per model. Models without known pricing are left out.
+    cost: Dict[str, float] = field(default_factory=dict)
+    # Rows whose prompt does not fit the head's model.
+    overflows: List[int] = field(default_factory=list)
+    # Rows from `overflows` that fit a fallback model (`row -> model`).
+    fallbacks: Dict[int, str] = field(default_factory=dict)
+
+    @property
+    def total_cost(self) -> float:
+        return sum(self.cost.values())
+
+
+def _calls_per_row(node: Any) -> int:
+    # NOTE: "consensus" only asks again when the first answer is valid, so 2 is an upper bound too.
+    strategy = getattr(node, "position_debias_strategy", None)
+    if strategy == "vote":
+        return node.num_permutations
+    if strategy == "consensus":
+        return 2
+    return 1
+
+
+def estimate(node: Any, kwds_list: Iterable[Dict[str, Any]], num: int = 1) -> Estimate:
+    """
+    Renders every row's messages (without calling the LLM), and counts their tokens in bulk.
+    Output tokens are counted as `max_tokens`, so they are an upper bound.
+    Heads that debias by position make several calls per row, each counted like the rendered one.
+    """
+    if not hasattr(node, "completion_kwargs"):
+        raise ValueError(f"{type(node).__name__} does not support estimation")
+
+    # Rendering shuffles references with the node's RNG, so we put it back after.
+    rg = getattr(node, "rg", None)
+    state = rg.getstate() if rg is not None else None
+    try:
+        rows = [node.completion_kwargs(**kwds) for kwds in kwds_list]
+    finally:
+        if rg is not None:
+            rg.setstate(state)
+
+    contents = [m["content"] for kwargs in rows for m in kwargs["messages"]]
+    counts = iter(llm.count_tokens("gpt-3.5-turbo", contents))
+
+    result = Estimate(num_rows=len(rows))
+    num *= _calls_per_row(node)
+    for i, kwargs in enumerate(rows):
+        model = kwargs["model"]
+        max_tokens = kwargs.get("max_tokens", llm.DEFAULT_MAX_TOKENS)
+        n = len(kwargs["messages"])
+        prompt_tokens = sum(itertools.islice(counts, n)) + llm.MESSAGE_OVERHEAD * n
+        tokens = prompt_tokens + max_tokens
+
+        info = llm.model_info(model)
+        if info is not None and tokens > info["max_tokens"]:
+            result.overflows.append(i)
+
+            routed = llm.route_model(model, tokens)
+            routed_info = llm.model_info(routed)
+            if routed_info is not None and tokens <= routed_info["max_tokens"]:
+                result.fallbacks[i] = routed
+                model, info = routed, routed_info
+
+        result.input_tokens += prompt_tokens * num
+        result.output_tokens += max_tokens * num
+
+        if info is not None:
+            result.cost[model] = result.cost.get(model, 0.0) + num * (
+                prompt_tokens * info["input_cost_per_token"]
+                + max_tokens * info["output_cost_per_token"]
+            )
+
+    return result
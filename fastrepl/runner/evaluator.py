@@ -1,14 +1,41 @@
-from typing import Optional, Callable, List, Any
+from typing import (
+    Optional,
+    Callable,
+    Collection,
+    ContextManager,
+    Iterator,
+    Literal,
+    Mapping,
+    Tuple,
+    List,
+    Deque,
+    Dict,
+    Any,
+)
 
+import asyncio
+import secrets
+import threading
+import multiprocessing
+import functools
+import contextlib
+from collections import deque, defaultdict
 from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor, Future
 from rich.progress import Progress
 
 import fastrepl
 from fastrepl.dataset import Dataset
-from fastrepl.utils import getenv, console
-from fastrepl.runner.base import BaseRunner
+from fastrepl.utils import getenv, console, kappa_interval
+from fastrepl import llm
+from fastrepl.runner.base import BaseRunner, iter_rows, num_workers
+from fastrepl.runner.checkpoint import Checkpoint
+from fastrepl.runner.estimate import Estimate, estimate
+from fastrepl.runner.process import ProcessPool
+from fastrepl.runner.remote import Broker, LEASE_TIMEOUT, serve
 
 NUM_THREADS = getenv("NUM_THREADS", 12)
+MAX_CONCURRENCY = getenv("MAX_CONCURRENCY", 256)
 
 
 class LocalEvaluatorRunner(BaseRunner):
@@ -17,7 +44,13 @@ class LocalEvaluatorRunner(BaseRunner):
         evaluator: fastrepl.Evaluator,
         dataset: Dataset,
         output_feature="result",
+        checkpoint_dir: Optional[str] = None,
+        executor: Literal["thread", "process"] = "thread",
     ) -> None:
+        """
+        With `executor="process"`, `run` and `run_sequential` evaluate rows one by one in a process pool,
+        so the evaluator must be picklable. Use it for CPU-bound evaluators; LLM calls are better served by threads.
+        """
         self._input_features = evaluator.inputs()
         self._output_feature = output_feature
 
@@ -30,30 +63,149 @@ class LocalEvaluatorRunner(BaseRunner):
 
         self._evaluator = evaluator
         self._dataset = dataset
+        self._executor = executor
+        self._checkpoint = (
+            Checkpoint(checkpoint_dir, evaluator)
+            if checkpoint_dir is not None
+            else None
+        )
 
-    def _run_single(self, cb: Callable[[], None]) -> List[Optional[Any]]:
-        results = []
+    def _kwds_list(self) -> Iterator[Dict[str, Any]]:
+        for values in zip(
+            *[self._dataset[feature] for feature in self._input_features]
+        ):
+            yield {
+                feature: value for feature, value in zip(self._input_features, values)
+            }
 
-        with ThreadPool(min(NUM_THREADS, len(self._dataset))) as pool:
+    @property
+    def concurrency(self) -> Dict[str, int]:
+        """
+        Current in-flight limit per model set up with `llm.set_adaptive_concurrency`.
+        """
+        return llm.concurrency_levels()
+
+    def _resume(self, rep: int) -> Tuple[List[str], Dict[str, Any]]:
+        if self._checkpoint is None:
+            return [], {}
+
+        keys = [Checkpoint.key(kwds) for kwds in self._kwds_list()]
+        return keys, self._checkpoint.load(rep)
+
+    def _process_pool(self) -> ContextManager[Optional[ProcessPool]]:
+        if self._executor == "process":
+            return ProcessPool(self._evaluator.run)
+        return contextlib.nullcontext()
+
+    def _models(self) -> List[str]:
+        # NOTE: Custom evaluators may not have a node.
+        model = getattr(getattr(self._evaluator, "node", None), "model", None)
+        return [model] if isinstance(model, str) else []
+
+    def _batch_size(self) -> int:
+        # NOTE: Custom evaluators may not have a node.
+        return getattr(self._evaluator, "batch_size", 1)
+
+    def _run_single(
+        self,
+        cb: Callable[[], None],
+        rep=0,
+        rows: Optional[Collection[int]] = None,
+        processes: Optional[ProcessPool] = None,
+    ) -> List[Optional[Any]]:
+        keys, done = self._resume(rep)
+        results: List[Optional[Any]] = [None] * len(self._dataset)
+
+        pending: List[Tuple[int, Dict[str, Any]]] = []
+        for i, kwds in enumerate(self._kwds_list()):
+            if rows is not None and i not in rows:
+                continue
+            if self._checkpoint is not None and keys[i] in done:
+                results[i] = done[keys[i]]
+                cb()
+            else:
+                pending.append((i, kwds))
+
+        def save(batch: List[Tuple[int, Dict[str, Any]]], outputs: List[Any]) -> None:
+            if self._checkpoint is not None:
+                for (i, _), output in zip(batch, outputs):
+                    self._checkpoint.save(rep, keys[i], output)
+
+        if processes is not None:
+            # NOTE: Each chunk is checkpointed as soon as it completes, so an interrupted run keeps it.
+            outputs = processes.map(
+                [((), kwds) for _, kwds in pending],
+                cb,
+                lambda start, chunk: save(pending[start : start + len(chunk)], chunk),
+            )
+            for (i, _), output in zip(pending, outputs):
+                results[i] = output
+            return results
+
+        batch_size = self._batch_size()
+        batches = [
+            pending[start : start + batch_size]
+            for start in range(0, len(pending), batch_size)
+        ]
+
+        def run_batch(rows: List[Dict[str, Any]]) -> List[Optional[Any]]:
+            if batch_size == 1:
+                return [self._evaluator.run(**rows[0])]
+            return self._evaluator.run_batch(rows)
+
+        with ThreadPool(num_workers(NUM_THREADS, len(batches), self._models())) as pool:
             futures = [
-                pool.apply_async(
-                    self._evaluator.run,
-                    kwds={
-                        feature: value
-                        for feature, value in zip(self._input_features, values)
-                    },
-                )
-                for values in zip(
-                    *[self._dataset[feature] for feature in self._input_features]
+                (
+                    batch,
+                    pool.apply_async(run_batch, args=([kwds for _, kwds in batch],)),
                 )
+                for batch in batches
             ]
 
-            for future in futures:
-                results.append(future.get())
-                cb()
+            # NOTE: Saved on this thread, so a failed save raises here instead of killing the pool's result handler.
+            for batch, future in futures:
+                outputs = future.get()
+                save(batch, outputs)
+                for (i, _), output in zip(batch, outputs):
+                    results[i] = output
+                    cb()
 
         return results
 
+    async def _arun_single(
+        self, cb: Callable[[], None], semaphore: asyncio.Semaphore, rep=0
+    ) -> List[Optional[Any]]:
+        keys, done = self._resume(rep)
+
+        async def run(i: int, kwds: Dict[str, Any]) -> Optional[Any]:
+            if self._checkpoint is not None and keys[i] in done:
+                cb()
+                return done[keys[i]]
+
+            async with semaphore:
+                result = await self._evaluator.arun(**kwds)
+            if self._checkpoint is not None:
+                self._checkpoint.save(rep, keys[i], result)
+            cb()
+            return result
+
+        return await asyncio.gather(
+            *[run(i, kwds) for i, kwds in enumerate(self._kwds_list())]
+        )
+
+    def _to_dataset(
+        self, results: List[List[Optional[Any]]], aggregate: bool
+    ) -> Dataset:
+        if len(results) > 1:
+            multiple = [list(item) for item in zip(*results)]
+
+            if aggregate:
+                multiple = [sum(item) / len(item) for item in multiple]
+
+            return self._dataset.add_column(self._output_feature, multiple)
+
+        return self._dataset.add_column(self._output_feature, results[0])
+
     def run(self, num=1, show_progress=True, aggregate=False) -> Dataset:
         disable = not show_progress
 
@@ -63,17 +215,41 @@ class LocalEvaluatorRunner(BaseRunner):
                 task_id = progress.add_task(msg, total=len(self._dataset) * num)
                 cb = lambda: progress.update(task_id, advance=1, refresh=True)
 
-                if num > 1:
-                    results = [self._run_single(cb) for _ in range(num)]
-                    multiple = [list(item) for item in zip(*results)]
+                with self._process_pool() as processes:
+                    results = [
+                        self._run_single(cb, rep, processes=processes)
+                        for rep in range(num)
+                    ]
+                return self._to_dataset(results, aggregate)
+        except ValueError as e:
+            if "I/O operation on closed file" in str(e):
+                console.print("[cyan]Please re-run with `show_progress=False`")
+            else:
+                raise e
 
-                    if aggregate:
-                        multiple = [sum(item) / len(item) for item in multiple]
+        return Dataset.from_dict({})
 
-                    return self._dataset.add_column(self._output_feature, multiple)
+    async def arun(
+        self,
+        num=1,
+        show_progress=True,
+        aggregate=False,
+        concurrency: int = MAX_CONCURRENCY,
+    ) -> Dataset:
+        disable = not show_progress
 
-                single = self._run_single(cb)
-                return self._dataset.add_column(self._output_feature, single)
+        try:
+            with Progress(console=console, disable=disable) as progress:
+                msg = "[cyan]Processing..."
+                task_id = progress.add_task(msg, total=len(self._dataset) * num)
+                cb = lambda: progress.update(task_id, advance=1, refresh=True)
+
+                # Every repetition shares one semaphore, so all of them are in flight together.
+                semaphore = asyncio.Semaphore(concurrency)
+                results = await asyncio.gather(
+                    *[self._arun_single(cb, semaphore, rep) for rep in range(num)]
+                )
+                return self._to_dataset(list(results), aggregate)
         except ValueError as e:
             if "I/O operation on closed file" in str(e):
                 console.print("[cyan]Please re-run with `show_progress=False`")
@@ -82,12 +258,287 @@ class LocalEvaluatorRunner(BaseRunner):
 
         return Dataset.from_dict({})
 
+    def run_sequential(
+        self,
+        max_num=10,
+        min_num=3,
+        unstable_below=0.5,
+        ci_width=0.1,
+        confidence=0.95,
+        show_progress=True,
+    ) -> Dataset:
+        """
+        Like `run(num=max_num)` for consistency studies, but samples one repetition at a time, only for undecided rows.
+        A row is done once its first `min_num` predictions all agree (consistent), or once its most common prediction
+        can no longer make up `unstable_below` of `max_num` (unstable). The whole run stops early once the bootstrap
+        interval of kappa is narrower than `ci_width`. Rows end up with different numbers of predictions, which `kappa` accepts.
+        """
+        if not 2 <= min_num <= max_num:
+            raise ValueError("expected 2 <= min_num <= max_num")
+
+        samples: List[List[Any]] = [[] for _ in range(len(self._dataset))]
+        active = set(range(len(self._dataset)))
+
+        def decided(predictions: List[Any]) -> bool:
+            n = len(predictions)
+            if n < min_num:
+                return False
+            if all(p == predictions[0] for p in predictions):
+                return True
+
+            top = max(predictions.count(p) for p in predictions)
+            return top + (max_num - n) < unstable_below * max_num
+
+        with Progress(console=console, disable=not show_progress) as progress:
+            msg = "[cyan]Processing..."
+            task_id = progress.add_task(msg, total=len(self._dataset) * max_num)
+            cb = lambda: progress.update(task_id, advance=1, refresh=True)
+
+            with self._process_pool() as processes:
+                for rep in range(max_num):
+                    results = self._run_single(cb, rep, active, processes)
+                    for i in active:
+                        samples[i].append(results[i])
+                    active = {i for i in active if not decided(samples[i])}
+
+                    if not active:
+                        break
+                    if rep + 1 >= min_num:
+                        low, high = kappa_interval(samples, confidence=confidence)
+                        if high - low <= ci_width:
+                            break
+
+        return self._dataset.add_column(self._output_feature, samples)
+
+    def estimate(self, num=1) -> Estimate:
+        """
+        Dry run: counts the tokens `run(num=num)` would send, without calling the LLM.
+        """
+        return estimate(getattr(self._evaluator, "node", None), self._kwds_list(), num)
+
+    def stream(self, num=1, ordered=False) -> Iterator[Tuple[int, Any]]:
+        """
+        Yields `(row_index, result)` as soon as every repetition of a row is done.
+        With `num > 1`, result is a list like the column `run(num=num)` produces.
+        """
+        resumed = [self._resume(rep) for rep in range(num)]
+
+        def submit(i: int, kwds: Dict[str, Any], rep: int) -> Future:
+            keys, done = resumed[rep]
+
+            if self._checkpoint is not None and keys[i] in done:
+                future: Future = Future()
+                future.set_result(done[keys[i]])
+                return future
+
+            return executor.submit(self._evaluator.run, **kwds)
+
+        executor = ThreadPoolExecutor(
+            num_workers(NUM_THREADS, len(self._dataset), self._models())
+        )
+        try:
+            rows = [
+                [submit(i, kwds, rep) for rep in range(num)]
+                for i, kwds in enumerate(self._kwds_list())
+            ]
+            for i, results in iter_rows(rows, ordered):
+                # NOTE: Saved on the consumer's thread like `run` does, so a failed save raises from the iterator.
+                if self._checkpoint is not None:
+                    for rep, result in enumerate(results):
+                        keys, done = resumed[rep]
+                        if keys[i] not in done:
+                            self._checkpoint.save(rep, keys[i], result)
+                yield i, results if num > 1 else results[0]
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class LocalMultiEvaluatorRunner(BaseRunner):
+    """
+    Runs several evaluators over one dataset in a single shared pool, writing one column per evaluator.
+    (evaluator, row) pairs are grouped by model, and each group gets its own in-flight limit,
+    so a slow or rate-limited model does not hold up the others.
+    """
+
+    def __init__(
+        self,
+        evaluators: Mapping[str, fastrepl.Evaluator],
+        dataset: Dataset,
+        concurrency: Optional[Dict[str, int]] = None,
+    ) -> None:
+        for name, evaluator in evaluators.items():
+            inputs = evaluator.inputs()
+            if any(feature not in dataset.column_names for feature in inputs):
+                raise ValueError(  # TODO: custom error
+                    f"{name!r} requires {inputs!r}, but the provided dataset has {dataset.column_names!r}"
+                )
+
+        self._evaluators = dict(evaluators)
+        self._dataset = dataset
+        self._concurrency = concurrency or {}
+
+    def _group(self, name: str) -> str:
+        # NOTE: Evaluators without a model (e.g. custom ones) are limited on their own.
+        node = getattr(self._evaluators[name], "node", None)
+        return getattr(node, "model", None) or name
+
+    def _limit(self, group: str) -> int:
+        return self._concurrency.get(group, NUM_THREADS)
+
+    def _run_all(self, cb: Callable[[], None], num: int) -> Dict[str, List[List[Any]]]:
+        columns = {
+            feature: self._dataset[feature]
+            for evaluator in self._evaluators.values()
+            for feature in evaluator.inputs()
+        }
+
+        queues: Dict[str, Deque[Tuple[str, int, int]]] = defaultdict(deque)
+        for rep in range(num):
+            for i in range(len(self._dataset)):
+                for name in self._evaluators:
+                    queues[self._group(name)].append((name, rep, i))
+
+        available = {group: self._limit(group) for group in queues}
+        cond = threading.Condition()
+
+        def release(group: str, _: Future) -> None:
+            with cond:
+                available[group] += 1
+                cb()
+                cond.notify()
+
+        def submit(name: str, i: int) -> Future:
+            evaluator = self._evaluators[name]
+            kwds = {feature: columns[feature][i] for feature in evaluator.inputs()}
+            return executor.submit(evaluator.run, **kwds)
+
+        futures: List[Tuple[str, int, int, Future]] = []
+        size = sum(min(available[g], len(q)) for g, q in queues.items())
+
+        with ThreadPoolExecutor(max(1, size)) as executor:
+            with cond:
+                while any(queues.values()):
+                    ready = [g for g, q in queues.items() if q and available[g] > 0]
+                    if not ready:
+                        cond.wait()
+                        continue
+
+                    # Round-robin over groups, so that every model makes progress from the start.
+                    for group in ready:
+                        name, rep, i = queues[group].popleft()
+                        available[group] -= 1
+
+                        future = submit(name, i)
+                        futures.append((name, rep, i, future))
+                        future.add_done_callback(functools.partial(release, group))
+
+        results: Dict[str, List[List[Any]]] = {
+            name: [[None] * len(self._dataset) for _ in range(num)]
+            for name in self._evaluators
+        }
+        for name, rep, i, future in futures:
+            results[name][rep][i] = future.result()
+        return results
+
+    def run(self, num=1, show_progress=True, aggregate=False) -> Dataset:
+        disable = not show_progress
+        total = len(self._dataset) * num * len(self._evaluators)
+
+        with Progress(console=console, disable=disable) as progress:
+            msg = "[cyan]Processing..."
+            task_id = progress.add_task(msg, total=total)
+            cb = lambda: progress.update(task_id, advance=1, refresh=True)
+
+            results = self._run_all(cb, num)
+
+        ds = self._dataset
+        for name, reps in results.items():
+            if num == 1:
+                ds = ds.add_column(name, reps[0])
+                continue
+
+            multiple = [list(item) for item in zip(*reps)]
+            if aggregate:
+                multiple = [sum(item) / len(item) for item in multiple]
+            ds = ds.add_column(name, multiple)
+        return ds
+
 
 class RemoteEvaluatorRunner(LocalEvaluatorRunner):
+    """
+    Splits the dataset into shards of `shard_size` rows and hands them to workers through a broker listening on `address`.
+    Each worker runs `LocalEvaluatorRunner` per shard and streams results back, and shards that fail or whose worker
+    is lost are retried up to `max_retries` times.
+
+    Start workers on other machines with `python -m fastrepl.runner.remote HOST:PORT` and the same key in `REMOTE_AUTHKEY`,
+    or let `run` start `num_local_workers` worker processes on this one.
+    """
+
     def __init__(
         self,
         evaluator: fastrepl.Evaluator,
         dataset: Dataset,
         output_feature="result",
+        address: Tuple[str, int] = ("localhost", 0),
+        authkey: Optional[bytes] = None,
+        shard_size=100,
+        max_retries=3,
+        lease_timeout: float = LEASE_TIMEOUT,
+        num_local_workers=0,
     ) -> None:
-        raise NotImplementedError
+        super().__init__(evaluator, dataset, output_feature)
+
+        if authkey is None:
+            key = getenv("REMOTE_AUTHKEY", "")
+            authkey = key.encode() if key else secrets.token_bytes(32)
+
+        self.address = address
+        self.authkey = authkey
+        self._shard_size = shard_size
+        self._max_retries = max_retries
+        self._lease_timeout = lease_timeout
+        self._num_local_workers = num_local_workers
+
+    def run(self, num=1, show_progress=True, aggregate=False) -> Dataset:
+        with Progress(console=console, disable=not show_progress) as progress:
+            msg = "[cyan]Processing..."
+            task_id = progress.add_task(msg, total=len(self._dataset))
+            cb = lambda: progress.update(task_id, advance=1, refresh=True)
+
+            with Broker(
+                self._evaluator,
+                self._dataset.select_columns(self._input_features),
+                num,
+                self._shard_size,
+                address=self.address,
+                authkey=self.authkey,
+                max_retries=self._max_retries,
+                lease_timeout=self._lease_timeout,
+                cb=cb,
+            ) as broker:
+                if self._num_local_workers == 0:
+                    host, port = broker.address
+                    console.print(f"[cyan]Waiting for workers on {host}:{port}")
+
+                workers = [
+                    multiprocessing.Process(
+                        target=serve, args=(broker.address, self.authkey), daemon=True
+                    )
+                    for _ in range(self._num_local_workers)
+                ]
+                for worker in workers:
+                    worker.start()
+
+                try:
+                    rows = broker.wait()
+                finally:
+                    broker.close()
+                    for worker in workers:
+                        worker.join(timeout=self._lease_timeout)
+                        if worker.is_alive():  # pragma: no cover
+                            worker.terminate()
+
+        results = [rows[i] for i in range(len(self._dataset))]
+        if num > 1:
+            return self._to_dataset([list(rep) for rep in zip(*results)], aggregate)
+        return self._to_dataset([results], aggregate)
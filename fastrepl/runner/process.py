@@ -0,0 +1,148 @@
+from typing import (
+    TYPE_CHECKING,
+    Optional,
+    Callable,
+    Iterable,
+    Mapping,
+    Tuple,
+    List,
+    Any,
+    cast,
+)
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory, resource_tracker
+
+from fastrepl.utils import getenv, exact_array
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+NUM_PROCESSES = getenv("NUM_PROCESSES", os.cpu_count() or 1)
+
+Item = Tuple[Iterable[Any], Mapping[str, Any]]
+
+_fn: Optional[Callable] = None
+
+
+def _init(fn: Callable) -> None:
+    # NOTE: Runs once per worker, so `fn` (and the evaluator it may be bound to) is unpickled once, not once per task.
+    global _fn
+    _fn = fn
+
+
+def _arrow_array(results: List[Any]) -> Optional["pa.Array"]:
+    # NOTE: Anything Arrow would not give back unchanged (e.g. tuples, mixed types, ints beyond int64) is pickled instead.
+    try:
+        return exact_array(results)
+    except ImportError:
+        return None
+
+
+def _export(results: List[Any]) -> Tuple[str, Any]:
+    array = _arrow_array(results)
+    if array is None:
+        return "pickle", results
+
+    import pyarrow as pa
+
+    table = pa.table({"result": array})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    buf = sink.getvalue()
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, buf.size))
+    cast(memoryview, shm.buf)[: buf.size] = memoryview(buf).cast("B")
+    # The parent unlinks it once read, so this worker must not clean it up on exit.
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+    shm.close()
+
+    return "arrow", (shm.name, buf.size)
+
+
+def _import(kind: str, payload: Any) -> List[Any]:
+    if kind == "pickle":
+        return payload
+
+    import pyarrow as pa
+
+    name, size = payload
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        reader = pa.ipc.open_stream(pa.py_buffer(cast(memoryview, shm.buf)[:size]))
+        results = reader.read_all().column(0).to_pylist()
+        del reader
+    finally:
+        shm.close()
+        shm.unlink()
+    return results
+
+
+def _run_chunk(items: List[Item]) -> Tuple[str, Any]:
+    fn = _fn
+    assert fn is not None
+    return _export([fn(*args, **kwds) for args, kwds in items])
+
+
+class ProcessPool:
+    """
+    Runs a picklable `fn` over items in a process pool, in chunks.
+    Results come back as Arrow IPC in shared memory, or pickled if Arrow cannot type them (or `pyarrow` is not installed).
+    """
+
+    def __init__(
+        self,
+        fn: Callable,
+        num_processes: int = NUM_PROCESSES,
+        chunk_size: Optional[int] = None,
+    ) -> None:
+        self.num_processes = num_processes
+        self.chunk_size = chunk_size
+
+        self._executor = ProcessPoolExecutor(
+            num_processes, initializer=_init, initargs=(fn,)
+        )
+
+    def _chunk_size(self, n: int) -> int:
+        if self.chunk_size is not None:
+            return self.chunk_size
+        # About 4 chunks per worker, so a slow chunk does not leave the others idle.
+        return max(1, -(-n // (self.num_processes * 4)))
+
+    def map(
+        self,
+        items: List[Item],
+        cb: Callable[[], None] = lambda: None,
+        on_chunk: Callable[[int, List[Any]], None] = lambda start, chunk: None,
+    ) -> List[Any]:
+        """
+        Results in the order of `items`. `on_chunk(start, results)` is called as each chunk completes, in completion order,
+        so callers can save them before the slower chunks are done.
+        """
+        size = self._chunk_size(len(items))
+        futures = {
+            self._executor.submit(_run_chunk, items[start : start + size]): start
+            for start in range(0, len(items), size)
+        }
+
+        results: List[Any] = [None] * len(items)
+        for future in as_completed(futures):
+            start = futures[future]
+            chunk = _import(*future.result())
+            results[start : start + len(chunk)] = chunk
+            on_chunk(start, chunk)
+            for _ in chunk:
+                cb()
+        return results
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> "ProcessPool":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
@@ -0,0 +1,282 @@
+from typing import Optional, Callable, Generator, Tuple, List, Deque, Dict, Set, Any
+
+import sys
+import time
+import socket
+import threading
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, Connection
+
+from fastrepl.dataset import Dataset
+from fastrepl.errors import ShardFailedError
+from fastrepl.utils import getenv
+
+LEASE_TIMEOUT = getenv("REMOTE_LEASE_TIMEOUT", 60.0)
+
+Address = Tuple[str, int]
+
+
+class Broker:
+    """
+    Hands out shards of a dataset to workers and collects their results, over `multiprocessing.connection`.
+    Every message is a pickled tuple, answered with one reply, and connections are authenticated with `authkey`.
+    Since workers unpickle what the broker sends (and vice versa), only share `authkey` with workers you trust.
+
+    A worker holds a lease on its shard, renewed by every result and heartbeat it sends.
+    If the worker reports a failure, disconnects, or lets the lease expire, the rows it has not sent yet are queued again,
+    up to `max_retries` times per shard.
+    """
+
+    def __init__(
+        self,
+        evaluator: Any,
+        dataset: Dataset,
+        num: int,
+        shard_size: int,
+        address: Address = ("localhost", 0),
+        authkey: bytes = b"",
+        max_retries=3,
+        lease_timeout: float = LEASE_TIMEOUT,
+        cb: Callable[[], None] = lambda: None,
+    ) -> None:
+        self._evaluator = evaluator
+        self._dataset = dataset
+        self._num = num
+        self._max_retries = max_retries
+        self._lease_timeout = lease_timeout
+        self._cb = cb
+
+        size = len(dataset)
+        self._remaining: Dict[int, Set[int]] = {
+            shard_id: set(range(start, min(start + shard_size, size)))
+            for shard_id, start in enumerate(range(0, size, shard_size))
+        }
+        self._pending: Deque[int] = deque(self._remaining)
+        self._leases: Dict[int, Tuple[int, float]] = {}
+        self._attempts: Dict[int, int] = {shard_id: 0 for shard_id in self._remaining}
+
+        self.results: Dict[int, Any] = {}
+        self._error: Optional[str] = None
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._listener = Listener(address, authkey=authkey)
+        self.address: Address = self._listener.address
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    @property
+    def done(self) -> bool:
+        return not self._remaining
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                if self._closed:
+                    return
+                continue
+
+            if self._closed:
+                conn.close()
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: Connection) -> None:
+        worker = id(conn)
+        try:
+            while True:
+                kind, *args = conn.recv()
+                conn.send(getattr(self, f"_on_{kind}")(worker, *args))
+        except (OSError, EOFError):
+            with self._cond:
+                for shard_id, (owner, _) in list(self._leases.items()):
+                    if owner == worker:
+                        self._retry(shard_id, "worker disconnected")
+        finally:
+            conn.close()
+
+    def _retry(self, shard_id: int, reason: str) -> None:
+        # NOTE: Called with the lock held.
+        self._leases.pop(shard_id, None)
+        if shard_id not in self._remaining:
+            return
+
+        if self._attempts[shard_id] > self._max_retries:
+            self._error = f"shard {shard_id} failed {self._attempts[shard_id]} times, last: {reason}"
+        else:
+            self._pending.appendleft(shard_id)
+        self._cond.notify_all()
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for shard_id, (_, deadline) in list(self._leases.items()):
+            if deadline < now:
+                self._retry(shard_id, "lease expired")
+
+    def _renew(self, worker: int, shard_id: int) -> None:
+        lease = self._leases.get(shard_id)
+        if lease is not None and lease[0] == worker:
+            self._leases[shard_id] = (worker, time.monotonic() + self._lease_timeout)
+
+    def _on_hello(self, worker: int) -> Tuple[Any, int, float]:
+        return self._evaluator, self._num, self._lease_timeout / 3
+
+    def _on_get(self, worker: int) -> Optional[Tuple[int, List[int], Dict[str, List]]]:
+        with self._cond:
+            while True:
+                if self._closed or self._error is not None or self.done:
+                    return None
+
+                # A shard queued again may have been finished since by late results.
+                while self._pending and self._pending[0] not in self._remaining:
+                    self._pending.popleft()
+                if self._pending:
+                    break
+
+                self._cond.wait(timeout=self._lease_timeout / 3)
+                self._expire()
+
+            shard_id = self._pending.popleft()
+            self._attempts[shard_id] += 1
+            self._leases[shard_id] = (worker, time.monotonic() + self._lease_timeout)
+
+            # Only rows that no earlier attempt sent back.
+            rows = sorted(self._remaining[shard_id])
+            return shard_id, rows, self._dataset.select(rows).to_dict()
+
+    def _on_result(self, worker: int, shard_id: int, i: int, result: Any) -> None:
+        with self._cond:
+            self._renew(worker, shard_id)
+
+            # NOTE: Late results from an expired lease still count, the row is evaluated the same either way.
+            remaining = self._remaining.get(shard_id)
+            if remaining is None or i not in remaining:
+                return
+
+            remaining.remove(i)
+            self.results[i] = result
+            self._cb()
+
+            if not remaining:
+                del self._remaining[shard_id]
+                self._leases.pop(shard_id, None)
+                self._cond.notify_all()
+
+    def _on_heartbeat(self, worker: int, shard_id: int) -> None:
+        with self._cond:
+            self._renew(worker, shard_id)
+
+    def _on_done(self, worker: int, shard_id: int) -> None:
+        with self._cond:
+            lease = self._leases.get(shard_id)
+            if lease is not None and lease[0] == worker:
+                self._retry(shard_id, "worker skipped rows")
+
+    def _on_fail(self, worker: int, shard_id: int, reason: str) -> None:
+        with self._cond:
+            lease = self._leases.get(shard_id)
+            if lease is not None and lease[0] == worker:
+                self._retry(shard_id, reason)
+
+    def wait(self) -> Dict[int, Any]:
+        with self._cond:
+            while not self.done:
+                if self._error is not None:
+                    raise ShardFailedError(self._error)
+                self._cond.wait(timeout=self._lease_timeout / 3)
+                self._expire()
+        return self.results
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        # NOTE: Closing the listener does not wake up a blocked `accept`, so connect once more to unblock it.
+        try:
+            host, port = self.address
+            socket.create_connection((host, port), timeout=1).close()
+        except OSError:  # pragma: no cover
+            pass
+        self._thread.join()
+        self._listener.close()
+
+    def __enter__(self) -> "Broker":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def serve(address: Address, authkey: bytes) -> None:
+    """
+    Worker loop: evaluates shards from the broker at `address` with `LocalEvaluatorRunner`,
+    streaming results back row by row, until the broker has nothing left.
+    """
+    from fastrepl.runner.evaluator import LocalEvaluatorRunner
+
+    with Client(address, authkey=authkey) as conn:
+        lock = threading.Lock()
+
+        def call(*msg: Any) -> Any:
+            with lock:
+                conn.send(msg)
+                return conn.recv()
+
+        evaluator, num, interval = call("hello")
+
+        while True:
+            shard = call("get")
+            if shard is None:
+                return
+
+            shard_id, rows, columns = shard
+            stop = threading.Event()
+
+            def heartbeat() -> None:
+                try:
+                    while not stop.wait(interval):
+                        call("heartbeat", shard_id)
+                except (OSError, EOFError):
+                    pass
+
+            def evaluate() -> Generator[Tuple[int, Any], None, None]:
+                runner = LocalEvaluatorRunner(evaluator, Dataset.from_dict(columns))
+                yield from runner.stream(num)
+
+            thread = threading.Thread(target=heartbeat, daemon=True)
+            thread.start()
+            results = evaluate()
+            try:
+                # NOTE: Only the evaluator's errors are caught, and reported so its remaining rows are retried.
+                # Errors talking to the broker raise from `call`, outside of that, and end the worker.
+                error: Optional[Exception] = None
+                while True:
+                    try:
+                        i, result = next(results)
+                    except StopIteration:
+                        break
+                    except Exception as e:
+                        error = e
+                        break
+                    call("result", shard_id, rows[i], result)
+
+                if error is None:
+                    call("done", shard_id)
+                else:
+                    call("fail", shard_id, repr(error))
+            finally:
+                results.close()
+                stop.set()
+                thread.join()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    # python -m fastrepl.runner.remote HOST:PORT, with the broker's key in REMOTE_AUTHKEY.
+    host, port = sys.argv[1].rsplit(":", 1)
+    serve((host, int(port)), getenv("REMOTE_AUTHKEY", "").encode())
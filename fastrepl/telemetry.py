@@ -45,9 +45,11 @@ def _import_package():
         return
 
     import fastrepl
-    import httpx
 
     def send():
+        # NOTE: Imported here, so the caller's `import fastrepl` does not wait for httpx.
+        import httpx
+
         httpx.post(
             f"{fastrepl.api_base}/log",
             json={
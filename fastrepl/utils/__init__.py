@@ -1,17 +1,83 @@
-from fastrepl.utils.id import get_cuid
-from fastrepl.utils.env import loadenv, setenv, getenv
-from fastrepl.utils.iterator import pairwise
-from fastrepl.utils.data_structure import OrderedSet, HistoryDict
+from typing import TYPE_CHECKING
+
+import importlib
+
+# NOTE: Loaded on first access (PEP 562), e.g. `RetryExpoException` pulls in openai.
+_LAZY = {
+    "get_cuid": "fastrepl.utils.id",
+    "loadenv": "fastrepl.utils.env",
+    "setenv": "fastrepl.utils.env",
+    "getenv": "fastrepl.utils.env",
+    "pairwise": "fastrepl.utils.iterator",
+    "OrderedSet": "fastrepl.utils.data_structure",
+    "HistoryDict": "fastrepl.utils.data_structure",
+    "LocalContext": "fastrepl.utils.context",
+    "Variable": "fastrepl.utils.context",
+    "console": "fastrepl.utils.print",
+    "suppress": "fastrepl.utils.print",
+    "truncate": "fastrepl.utils.string",
+    "to_number": "fastrepl.utils.string",
+    "Agreement": "fastrepl.utils.agreement",
+    "exact_array": "fastrepl.utils.arrow",
+    "raise_openai_exception_for_retry": "fastrepl.utils.llm",
+    "RetryConstantException": "fastrepl.utils.llm",
+    "RetryExpoException": "fastrepl.utils.llm",
+    "map_number_range": "fastrepl.utils.number",
+    "SQLiteCache": "fastrepl.utils.cache",
+    "EmbeddingCache": "fastrepl.utils.cache",
+    "ScoreCache": "fastrepl.utils.cache",
+    "RateLimiter": "fastrepl.utils.rate_limit",
+    "AdaptiveConcurrency": "fastrepl.utils.concurrency",
+    "SingleFlight": "fastrepl.utils.single_flight",
+    "TokenizerRegistry": "fastrepl.utils.tokenizer",
+    "TiktokenEncoder": "fastrepl.utils.tokenizer",
+    "CohereEncoder": "fastrepl.utils.tokenizer",
+}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_LAZY[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_LAZY])
+
+
+# NOTE: These modules share their name with what they export, so they are imported eagerly,
+# or importing the submodule directly would shadow the function.
 from fastrepl.utils.ensure import ensure
-from fastrepl.utils.context import LocalContext, Variable
 from fastrepl.utils.prompt import prompt
-from fastrepl.utils.print import console, suppress
 from fastrepl.utils.debug import debug, DEBUG
-from fastrepl.utils.string import truncate, to_number
-from fastrepl.utils.kappa import kappa
-from fastrepl.utils.llm import (
-    raise_openai_exception_for_retry,
-    RetryConstantException,
-    RetryExpoException,
-)
-from fastrepl.utils.number import map_number_range
+from fastrepl.utils.kappa import kappa, kappa_interval
+
+
+if TYPE_CHECKING:  # pragma: no cover
+    from fastrepl.utils.id import get_cuid
+    from fastrepl.utils.env import loadenv, setenv, getenv
+    from fastrepl.utils.iterator import pairwise
+    from fastrepl.utils.data_structure import OrderedSet, HistoryDict
+    from fastrepl.utils.context import LocalContext, Variable
+    from fastrepl.utils.print import console, suppress
+    from fastrepl.utils.string import truncate, to_number
+    from fastrepl.utils.agreement import Agreement
+    from fastrepl.utils.arrow import exact_array
+    from fastrepl.utils.llm import (
+        raise_openai_exception_for_retry,
+        RetryConstantException,
+        RetryExpoException,
+    )
+    from fastrepl.utils.number import map_number_range
+    from fastrepl.utils.cache import SQLiteCache, EmbeddingCache, ScoreCache
+    from fastrepl.utils.rate_limit import RateLimiter
+    from fastrepl.utils.concurrency import AdaptiveConcurrency
+    from fastrepl.utils.single_flight import SingleFlight
+    from fastrepl.utils.tokenizer import (
+        TokenizerRegistry,
+        TiktokenEncoder,
+        CohereEncoder,
+    )
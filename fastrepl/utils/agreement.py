@@ -0,0 +1,227 @@
+from typing import Optional, Iterable, Callable, Tuple, List, Dict, Any
+
+import numpy as np
+
+MISSING = -1
+
+
+class Agreement:
+    """
+    Inter-rater agreement over integer-coded ratings, updated incrementally as rows arrive.
+
+    Each row is reduced to its label counts, and rows with the same counts are interchangeable for every statistic here.
+    So we only keep the number of rows per distinct count pattern (plus a confusion matrix for two-rater rows),
+    which is small no matter how many rows there are. Bootstrap resamples rows by drawing pattern frequencies
+    from a multinomial, which is exactly the row-level bootstrap.
+
+    `None` is a label like any other. Codes of `MISSING` (-1) are absent ratings, e.g. padding of shorter rows.
+    """
+
+    def __init__(self) -> None:
+        self.labels: Dict[Any, int] = {}
+        self.num_rows = 0
+        self._size = 0
+
+        self._patterns: Dict[Tuple[int, ...], int] = {}
+        self._pairs = np.zeros((0, 0), dtype=np.int64)
+        self._paired = True
+
+    @property
+    def num_labels(self) -> int:
+        return max(len(self.labels), self._size)
+
+    @property
+    def paired(self) -> bool:
+        """
+        Whether every row so far has exactly two ratings, which is what Cohen's kappa needs.
+        """
+        return self.num_rows > 0 and self._paired
+
+    def encode(self, predictions: Iterable[List[Any]]) -> np.ndarray:
+        rows = [
+            [self.labels.setdefault(p, len(self.labels)) for p in ps]
+            for ps in predictions
+        ]
+
+        codes = np.full(
+            (len(rows), max(map(len, rows), default=0)), MISSING, dtype=np.int64
+        )
+        for i, row in enumerate(rows):
+            codes[i, : len(row)] = row
+        return codes
+
+    def update(self, predictions: Iterable[List[Any]]) -> "Agreement":
+        return self.update_codes(self.encode(predictions))
+
+    def update_codes(self, codes: np.ndarray) -> "Agreement":
+        codes = np.asarray(codes, dtype=np.int64)
+        if codes.ndim != 2:
+            raise ValueError("codes must be a 2D array of (rows, raters)")
+
+        n, num_raters = codes.shape
+        if n == 0:
+            return self
+
+        valid = codes != MISSING
+        size = max(self.num_labels, int(codes.max()) + 1)
+        self._size = size
+
+        flat = (np.arange(n)[:, None] * size + codes)[valid]
+        counts = np.bincount(flat, minlength=n * size).reshape(n, size)
+        self._add_patterns(counts, num_raters)
+
+        if num_raters == 2 and valid.all():
+            self._pairs = _pad(self._pairs, size)
+            pairs = np.bincount(codes[:, 0] * size + codes[:, 1], minlength=size * size)
+            self._pairs += pairs.reshape(size, size)
+        else:
+            self._paired = False
+
+        self.num_rows += n
+        return self
+
+    def _add_patterns(self, counts: np.ndarray, num_raters: int) -> None:
+        base = num_raters + 1
+        size = counts.shape[1]
+
+        # NOTE: Pack each row of counts into one integer when it fits, since 1D `unique` is much faster than `axis=0`.
+        if size * np.log2(base) < 63:
+            keys = counts @ (base ** np.arange(size, dtype=np.int64))
+            _, first, freqs = np.unique(keys, return_index=True, return_counts=True)
+            unique = counts[first]
+        else:
+            unique, freqs = np.unique(counts, axis=0, return_counts=True)
+
+        for row, freq in zip(unique.tolist(), freqs.tolist()):
+            while row and row[-1] == 0:
+                row.pop()
+            key = tuple(row)
+            self._patterns[key] = self._patterns.get(key, 0) + freq
+
+    def _pattern_table(self) -> Tuple[np.ndarray, np.ndarray]:
+        # NOTE: Sorted, so that the bootstrap draws do not depend on the order rows arrived in.
+        patterns = sorted(self._patterns.items())
+
+        counts = np.zeros((len(patterns), self.num_labels))
+        for i, (pattern, _) in enumerate(patterns):
+            counts[i, : len(pattern)] = pattern
+        return counts, np.array([freq for _, freq in patterns], dtype=np.float64)
+
+    def cohen(self) -> float:
+        if not self.paired:
+            raise ValueError("Cohen's kappa needs exactly two ratings per row")
+        return float(_cohen(_pad(self._pairs, self.num_labels).ravel()))
+
+    def fleiss(self) -> float:
+        counts, freqs = self._pattern_table()
+        return float(_fleiss(counts, freqs))
+
+    def krippendorff(self) -> float:
+        counts, freqs = self._pattern_table()
+        return float(_krippendorff(counts, freqs))
+
+    def per_label(self) -> Dict[Any, float]:
+        """
+        Specific agreement for each label: given that one rater chose it, the chance that another rater of the same row did too.
+        """
+        counts, freqs = self._pattern_table()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = _per_label(counts, freqs)
+
+        names = {code: label for label, code in self.labels.items()}
+        return {names.get(c, c): float(v) for c, v in enumerate(values)}
+
+    def interval(
+        self,
+        statistic="fleiss",
+        confidence=0.95,
+        num_resamples=1000,
+        seed: Optional[int] = 0,
+    ) -> Tuple[float, float]:
+        """
+        Percentile bootstrap interval of `statistic` ("cohen", "fleiss" or "krippendorff"), resampling rows.
+        """
+        fn: Callable[[np.ndarray], np.ndarray]
+        if statistic == "cohen":
+            if not self.paired:
+                raise ValueError("Cohen's kappa needs exactly two ratings per row")
+            freqs = _pad(self._pairs, self.num_labels).ravel().astype(np.float64)
+            fn = _cohen
+        elif statistic in ("fleiss", "krippendorff"):
+            counts, freqs = self._pattern_table()
+            stat = _fleiss if statistic == "fleiss" else _krippendorff
+            fn = lambda weights: stat(counts, weights)
+        else:
+            raise ValueError(f"unknown statistic: {statistic!r}")
+
+        total = int(freqs.sum())
+        rng = np.random.default_rng(seed)
+        weights = rng.multinomial(total, freqs / total, size=num_resamples)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            samples = fn(weights.astype(np.float64))
+        samples = samples[np.isfinite(samples)]
+        if len(samples) == 0:
+            return float("nan"), float("nan")
+
+        alpha = (1 - confidence) / 2
+        low, high = np.quantile(samples, [alpha, 1 - alpha])
+        return float(low), float(high)
+
+
+def _pad(matrix: np.ndarray, size: int) -> np.ndarray:
+    if len(matrix) >= size:
+        return matrix
+    grow = size - len(matrix)
+    return np.pad(matrix, ((0, grow), (0, grow)))
+
+
+# NOTE: Every statistic below takes `weights` of shape (patterns,) for the point estimate,
+# or (resamples, patterns) for the bootstrap, and reduces over patterns with a matrix product.
+
+
+def _cohen(weights: np.ndarray) -> np.ndarray:
+    size = int(np.sqrt(weights.shape[-1]))
+    table = weights.reshape(*weights.shape[:-1], size, size)
+
+    total = table.sum(axis=(-2, -1))
+    p_o = np.trace(table, axis1=-2, axis2=-1) / total
+    p_e = (table.sum(axis=-1) * table.sum(axis=-2)).sum(axis=-1) / total**2
+    return (p_o - p_e) / (1 - p_e)
+
+
+def _fleiss(counts: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    m = counts.sum(axis=1)
+    valid = m >= 2
+    safe = np.where(valid, m, 2)
+
+    agreement = np.where(
+        valid, ((counts**2).sum(axis=1) - m) / (safe * (safe - 1)), 0
+    )
+    p_o = (weights @ agreement) / (weights @ valid)
+
+    p = weights @ (counts * valid[:, None])
+    p = p / p.sum(axis=-1, keepdims=True)
+    p_e = (p**2).sum(axis=-1)
+    return (p_o - p_e) / (1 - p_e)
+
+
+def _krippendorff(counts: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    m = counts.sum(axis=1)
+    valid = m >= 2
+    safe = np.where(valid, m, 2)
+
+    # Diagonal of the coincidence matrix, and its marginals.
+    o = np.where(valid[:, None], counts * (counts - 1) / (safe - 1)[:, None], 0)
+    n_c = weights @ (counts * valid[:, None])
+    o_cc = weights @ o
+
+    n = n_c.sum(axis=-1)
+    d_o = 1 - o_cc.sum(axis=-1) / n
+    d_e = 1 - (n_c * (n_c - 1)).sum(axis=-1) / (n * (n - 1))
+    return 1 - d_o / d_e
+
+
+def _per_label(counts: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    m = counts.sum(axis=1)
+    return (weights @ (counts * (counts - 1))) / (weights @ (counts * (m - 1)[:, None]))
@@ -0,0 +1,37 @@
+from typing import Optional, Sequence, Any
+
+EXACT_TYPES = (bool, int, float, str)
+
+
+def _single_type(values: Sequence[Any]) -> Optional[type]:
+    types = {type(v) for v in values if v is not None}
+    if len(types) > 1:
+        return None
+    return next(iter(types), type(None))
+
+
+def exact_array(values: Sequence[Any], nested=False) -> Optional[Any]:
+    """
+    `values` as a pyarrow Array, or None if Arrow would not give them back unchanged.
+    Only flat values of a single type roundtrip exactly: ints mixed with floats become floats, tuples become lists,
+    dicts gain each other's keys, and ints beyond int64 do not fit. With `nested`, lists of such values are accepted too.
+    """
+    import pyarrow as pa
+
+    t = _single_type(values)
+    if t is list and nested:
+        inner = _single_type([x for v in values if v is not None for x in v])
+        if inner not in (*EXACT_TYPES, type(None)):
+            return None
+    elif t not in (*EXACT_TYPES, type(None)):
+        return None
+
+    try:
+        return pa.array(values)
+    except (
+        pa.ArrowInvalid,
+        pa.ArrowTypeError,
+        pa.ArrowNotImplementedError,
+        OverflowError,
+    ):
+        return None
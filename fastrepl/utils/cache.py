@@ -0,0 +1,391 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import contextlib
+from typing import Optional, Callable, Iterator, Sequence, Tuple, List, Dict, Any, cast
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SQLiteCache:
+    """
+    Persistent key-value cache with the same `set_cache`/`get_cache` interface as litellm's cache backends.
+    One connection per thread, and SQLite's file locking makes it safe to share across processes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: Optional[float] = None,
+        max_size: Optional[int] = None,
+    ) -> None:
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive")
+        if max_size is not None and max_size <= 0:
+            raise ValueError("max_size must be positive")
+
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, "
+            "value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _hash(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get_cache(self, key: str) -> Optional[Any]:
+        conn, hashed, now = self._conn(), self._hash(key), time.time()
+
+        row = conn.execute(
+            "SELECT value, created_at FROM cache WHERE key = ?", (hashed,)
+        ).fetchone()
+
+        if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+            conn.execute("DELETE FROM cache WHERE key = ?", (hashed,))
+            conn.commit()
+            row = None
+
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if self.max_size is not None:
+            conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, hashed)
+            )
+            conn.commit()
+
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set_cache(self, key: str, value: Any) -> None:
+        conn, now = self._conn(), time.time()
+
+        conn.execute(
+            "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+            (self._hash(key), json.dumps(value), now, now),
+        )
+        if self.ttl is not None:
+            conn.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl,))
+        if self.max_size is not None:
+            # Least recently used entries go first.
+            conn.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            )
+        conn.commit()
+
+    def clear(self) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM cache")
+        conn.commit()
+
+        with self._lock:
+            self.hits, self.misses = 0, 0
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {"hits": hits, "misses": misses, "size": len(self)}
+
+
+class EmbeddingCache:
+    """
+    Content-addressed vectors for a single model: the key is a hash of the text, so each distinct text is encoded once.
+    With `path`, vectors are appended to a raw float32 file that is memory-mapped when reopened,
+    so a large cache costs nothing to load and only the rows we look up are read.
+    Appends hold an exclusive lock on `<path>/lock`, so several processes can share a directory.
+    Without `fcntl` (Windows) there is no such lock, and only one process may write to it at a time.
+    """
+
+    KEYS, VECTORS, LOCK = "keys.txt", "vectors.f32", "lock"
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = os.path.expanduser(path) if path is not None else None
+        self.dim: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+
+        self._index: Dict[str, int] = {}
+        self._mmap: Optional[np.ndarray] = None
+        self._rows: List[np.ndarray] = []
+        self._lock = threading.Lock()
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            with self._file_lock():
+                self._load()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(cast(str, self.path), name)
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        try:
+            import fcntl
+        except ImportError:  # pragma: no cover
+            yield
+            return
+
+        with open(self._file(self.LOCK), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self) -> None:
+        keys_path, vectors_path = self._file(self.KEYS), self._file(self.VECTORS)
+        if not os.path.exists(keys_path):
+            return
+
+        with open(keys_path, "r") as f:
+            lines = f.read().split("\n")
+        dim, keys = int(lines[0]), [k for k in lines[1:] if len(k) == 64]
+        self.dim = dim
+
+        # NOTE: If the previous run was killed mid-append, keep only the rows present in both files.
+        size = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+        n = min(len(keys), size // (dim * 4))
+        if n != len(keys) or n * dim * 4 != size:
+            with open(keys_path, "w") as f:
+                f.write("".join(f"{k}\n" for k in [str(dim), *keys[:n]]))
+            with open(vectors_path, "ab") as f:
+                f.truncate(n * dim * 4)
+
+        self._index = {k: i for i, k in enumerate(keys[:n])}
+        if n > 0:
+            self._mmap = np.memmap(
+                vectors_path, dtype=np.float32, mode="r", shape=(n, dim)
+            )
+
+    def _row(self, i: int) -> np.ndarray:
+        disk = 0 if self._mmap is None else len(self._mmap)
+        return cast(np.ndarray, self._mmap)[i] if i < disk else self._rows[i - disk]
+
+    def _store(self, keys: List[str], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"expected vectors of size {self.dim}, got {vectors.shape[1]}"
+            )
+
+        # Another thread may have stored some of them while we were encoding.
+        fresh = [i for i, k in enumerate(keys) if k not in self._index]
+        keys, vectors = [keys[i] for i in fresh], vectors[fresh]
+
+        if self.path is not None and len(keys) > 0:
+            # NOTE: Keys and vectors are appended under one lock, so rows of different processes never interleave.
+            with self._file_lock():
+                keys_path = self._file(self.KEYS)
+                header = "" if os.path.exists(keys_path) else f"{self.dim}\n"
+
+                with open(self._file(self.VECTORS), "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(keys_path, "a") as f:
+                    f.write(header + "".join(f"{k}\n" for k in keys))
+
+        for key, vector in zip(keys, vectors):
+            self._index[key] = len(self._index)
+            self._rows.append(vector)
+
+    def embed(
+        self, texts: Sequence[str], encode: Callable[[List[str]], Any]
+    ) -> np.ndarray:
+        """
+        Returns one row per text, calling `encode` once with the distinct texts that are not cached yet.
+        """
+        keys = [self.key(text) for text in texts]
+
+        with self._lock:
+            missing = {k: t for k, t in zip(keys, texts) if k not in self._index}
+
+        if len(missing) > 0:
+            vectors = np.asarray(encode(list(missing.values())))
+            with self._lock:
+                self._store(list(missing), vectors)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+
+            if len(keys) == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            return np.stack([self._row(self._index[k]) for k in keys])
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._index)}
+
+
+class ScoreCache:
+    """
+    One float per key, e.g. cross-encoder scores of (prediction, reference) pairs, which are too many to keep as rows.
+    In memory, only the `max_size` most recently used scores are kept, under a 16-byte digest of their key.
+    With `path`, every score is also written to an SQLite file and looked up there on a miss,
+    so it is not recomputed in a later run, and SQLite's file locking makes it safe to share across processes.
+    """
+
+    # NOTE: SQLite's default limit on bound parameters is 999.
+    BATCH = 900
+
+    def __init__(self, path: Optional[str] = None, max_size=100_000) -> None:
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+
+        self.path = os.path.expanduser(path) if path is not None else None
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._memory: OrderedDict[bytes, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if self.path is not None:
+            directory = os.path.dirname(self.path)
+            if directory != "":
+                os.makedirs(directory, exist_ok=True)
+
+            conn = self._conn()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores (key BLOB PRIMARY KEY, score REAL NOT NULL)"
+            )
+            conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(cast(str, self.path), timeout=30)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()[:16]
+
+    def _remember(self, key: bytes, score: float) -> None:
+        # NOTE: Called with the lock held.
+        self._memory[key] = score
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _fetch(self, keys: List[bytes]) -> Dict[bytes, float]:
+        if self.path is None:
+            return {}
+
+        conn = self._conn()
+        found: Dict[bytes, float] = {}
+        for start in range(0, len(keys), self.BATCH):
+            batch = keys[start : start + self.BATCH]
+            rows = conn.execute(
+                f"SELECT key, score FROM scores WHERE key IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            found.update(rows)
+        return found
+
+    def score(
+        self,
+        items: Sequence[Tuple[str, ...]],
+        compute: Callable[[List[Tuple[str, ...]]], Any],
+    ) -> np.ndarray:
+        """
+        Returns one score per item, calling `compute` once with the distinct items that are not cached yet.
+        """
+        keys = [self.key(json.dumps(item)) for item in items]
+        scores: Dict[bytes, float] = {}
+
+        with self._lock:
+            for k in keys:
+                if k in self._memory:
+                    self._memory.move_to_end(k)
+                    scores[k] = self._memory[k]
+
+        # Distinct keys missing from memory, in order of first appearance.
+        missing = {k: i for k, i in zip(keys, items) if k not in scores}
+        scores.update(self._fetch(list(missing)))
+        missing = {k: i for k, i in missing.items() if k not in scores}
+
+        if len(missing) > 0:
+            values = np.asarray(compute(list(missing.values())), dtype=np.float32)
+            fresh = dict(zip(missing, values.reshape(len(missing)).tolist()))
+            scores.update(fresh)
+
+            if self.path is not None:
+                conn = self._conn()
+                conn.executemany(
+                    "INSERT OR IGNORE INTO scores VALUES (?, ?)", fresh.items()
+                )
+                conn.commit()
+
+        with self._lock:
+            for k in dict.fromkeys(keys):
+                self._remember(k, scores[k])
+            self.misses += len(missing)
+            self.hits += len(items) - len(missing)
+
+        return np.array([scores[k] for k in keys], dtype=np.float32)
+
+    def __len__(self) -> int:
+        if self.path is None:
+            return len(self._memory)
+        return self._conn().execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {"hits": hits, "misses": misses, "size": len(self)}
@@ -0,0 +1,160 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Callable, Optional, Deque, Dict
+
+
+class _Waiter:
+    __slots__ = ("granted", "wake")
+
+    def __init__(self, wake: Callable[[], None]) -> None:
+        self.granted = False
+        self.wake = wake
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD (additive increase, multiplicative decrease) limit on in-flight calls.
+    Every healthy completion adds `1 / limit`, so the limit grows by about one per round of calls.
+    An overload signal (rate limit, timeout) or latency above `latency_tolerance` times the best seen so far
+    multiplies it by `backoff`, at most once per round: signals from calls started before the last cut are ignored.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 64,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+        smoothing: float = 0.2,
+    ) -> None:
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError("expected 1 <= minimum <= initial <= maximum")
+        if not 0 < backoff < 1:
+            raise ValueError("backoff must be in (0, 1)")
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+
+        self._latency: Optional[float] = None
+        self._baseline: Optional[float] = None
+        self._last_cut = float("-inf")
+
+        self.successes = 0
+        self.overloads = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+    def _grant(self) -> None:
+        while self._waiters and self._in_flight < int(self._limit):
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self._in_flight += 1
+            waiter.wake()
+
+    def _enqueue(self, wake: Callable[[], None]) -> Optional[_Waiter]:
+        with self._lock:
+            if not self._waiters and self._in_flight < int(self._limit):
+                self._in_flight += 1
+                return None
+
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            return waiter
+
+    def acquire(self) -> None:
+        event = threading.Event()
+        if self._enqueue(event.set) is not None:
+            event.wait()
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant() -> None:
+            if not future.done():
+                future.set_result(None)
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(grant)
+
+        waiter = self._enqueue(wake)
+        if waiter is None:
+            return
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._grant()
+
+    def _cut(self) -> None:
+        self._limit = max(float(self.minimum), self._limit * self.backoff)
+        self._last_cut = time.monotonic()
+
+    def on_success(self, started: float) -> None:
+        latency = time.monotonic() - started
+
+        with self._lock:
+            self.successes += 1
+
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency += self.smoothing * (latency - self._latency)
+            if self._baseline is None or self._latency < self._baseline:
+                self._baseline = self._latency
+            else:
+                # NOTE: Drift up slowly, so that a provider that got slower for good does not pin us to `minimum`.
+                self._baseline += self.smoothing / 10 * (self._latency - self._baseline)
+
+            if self._latency > self._baseline * self.latency_tolerance:
+                if started >= self._last_cut:
+                    self._cut()
+            else:
+                self._limit = min(float(self.maximum), self._limit + 1 / self._limit)
+                self._grant()
+
+    def on_overload(self, started: float) -> None:
+        with self._lock:
+            self.overloads += 1
+            if started >= self._last_cut:
+                self._cut()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiters),
+                "latency": self._latency or 0.0,
+                "successes": self.successes,
+                "overloads": self.overloads,
+            }
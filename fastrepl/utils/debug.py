@@ -1,6 +1,4 @@
-from rich.pretty import pprint
-
-from fastrepl.utils import Variable, console  # type: ignore[no-redef]
+from fastrepl.utils.context import Variable
 
 
 DEBUG = Variable("DEBUG", 0)
@@ -10,6 +8,8 @@ def debug(input) -> None:  # pragma: no cover
     if DEBUG < 1:
         return None
 
+    from rich.pretty import pprint
+
     if DEBUG > 1:
         pprint(input, expand_all=True)
     else:
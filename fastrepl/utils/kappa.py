@@ -1,43 +1,39 @@
-from typing import List, Any, cast
+from typing import List, Tuple, Any
 
-from sklearn.metrics import confusion_matrix
-from sklearn.preprocessing import LabelEncoder
-from statsmodels.stats.inter_rater import cohens_kappa, fleiss_kappa, aggregate_raters
+from fastrepl.utils.agreement import Agreement
 
 
 def kappa(predictions: List[List[Any]]) -> float:
+    """
+    Cohen's kappa when every row has two predictions, Fleiss' kappa otherwise. `None` counts as a label.
+    """
     assert isinstance(predictions[0], list)
 
-    num_raters = len(predictions[0])
-    if num_raters < 2:
+    if max(len(ps) for ps in predictions) < 2:
         raise ValueError
 
-    # TODO: hacky none-handling
-    if isinstance(predictions[0][0], str):
-        for ps in predictions:
-            ps = ["" if p is None else p for p in ps]
-
-        le = LabelEncoder()
-        le.fit(list(set([p for ps in predictions for p in ps])))
-
-        predictions = [le.transform(p) for p in predictions]
-    else:
-        predictions = [[-1 if p is None else p for p in ps] for ps in predictions]
-
-    kappa_fn = _cohens_kappa if num_raters == 2 else _fleiss_kappa
-
-    return kappa_fn(predictions)
-
-
-def _cohens_kappa(predictions: List[List[Any]]) -> float:
-    predictions = list(zip(*predictions))  # transpose
-
-    return cohens_kappa(
-        table=confusion_matrix(*predictions),
-        return_results=False,
+    agreement = Agreement().update(predictions)
+    return agreement.cohen() if agreement.paired else agreement.fleiss()
+
+
+def fleiss_kappa_ragged(predictions: List[List[Any]]) -> float:
+    """
+    Same as Fleiss' kappa when every row has the same number of predictions, but also accepts rows of different lengths.
+    """
+    return Agreement().update(predictions).fleiss()
+
+
+def kappa_interval(
+    predictions: List[List[Any]],
+    confidence=0.95,
+    num_resamples=1000,
+    seed: int = 0,
+) -> Tuple[float, float]:
+    """
+    Percentile bootstrap interval of `fleiss_kappa_ragged`, resampling rows.
+    """
+    return (
+        Agreement()
+        .update(predictions)
+        .interval("fleiss", confidence, num_resamples, seed)
     )
-
-
-def _fleiss_kappa(predictions: List[List[Any]]) -> float:
-    table, _ = aggregate_raters(predictions)
-    return fleiss_kappa(table)
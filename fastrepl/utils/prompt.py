@@ -2,24 +2,43 @@
 
 import inspect
 import re
-from dataclasses import dataclass
+import functools
+from dataclasses import dataclass, field
 from typing import Any, Callable, Dict, List, Optional, cast
 
-from jinja2 import Environment, StrictUndefined
+from jinja2 import Environment, StrictUndefined, Template
+
+ENV = Environment(
+    trim_blocks=True,
+    lstrip_blocks=True,
+    keep_trailing_newline=True,
+    undefined=StrictUndefined,
+)
 
 
 @dataclass
 class Prompt:
     template: str
     signature: inspect.Signature
+    compiled: Template = field(init=False, repr=False)
 
     def __post_init__(self) -> None:
         self.parameters: List[str] = list(self.signature.parameters.keys())
+        self.compiled = compile_template(self.template)
 
     def __call__(self, *args, **kwargs) -> str:
-        bound_arguments = self.signature.bind(*args, **kwargs)
+        if args:
+            bound_arguments = self.signature.bind(*args, **kwargs)
+            bound_arguments.apply_defaults()
+            return self.compiled.render(**bound_arguments.arguments)
+
+        # NOTE: Fast path for the common keyword-only call, skipping `Signature.bind`.
+        if kwargs.keys() == set(self.parameters):
+            return self.compiled.render(**kwargs)
+
+        bound_arguments = self.signature.bind(**kwargs)
         bound_arguments.apply_defaults()
-        return render(self.template, **bound_arguments.arguments)
+        return self.compiled.render(**bound_arguments.arguments)
 
     def __str__(self):
         return self.template
@@ -37,7 +56,8 @@ def prompt(fn: Callable) -> Prompt:
     return Prompt(template, signature)
 
 
-def render(template: str, **values: Optional[Dict[str, Any]]) -> str:
+@functools.lru_cache(maxsize=1024)
+def compile_template(template: str) -> Template:
     # Dedent, and remove extra linebreak
     cleaned_template = inspect.cleandoc(template)
 
@@ -52,13 +72,8 @@ def render(template: str, **values: Optional[Dict[str, Any]]) -> str:
     # used to continue to the next line without linebreak.
     cleaned_template = re.sub(r"(?![\r\n])(\b\s+)", " ", cleaned_template)
 
-    env = Environment(
-        trim_blocks=True,
-        lstrip_blocks=True,
-        keep_trailing_newline=True,
-        undefined=StrictUndefined,
-    )
+    return ENV.from_string(cleaned_template)
 
-    jinja_template = env.from_string(cleaned_template)
 
-    return jinja_template.render(**values)
+def render(template: str, **values: Optional[Dict[str, Any]]) -> str:
+    return compile_template(template).render(**values)
@@ -0,0 +1,97 @@
+import time
+import asyncio
+import threading
+from typing import Optional, List, Dict
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "level")
+
+    def __init__(self, per_minute: float) -> None:
+        if per_minute <= 0:
+            raise ValueError("limit must be positive")
+
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+
+    def refill(self, elapsed: float) -> None:
+        self.level = min(self.capacity, self.level + elapsed * self.rate)
+
+    def deficit(self) -> float:
+        return max(0.0, -self.level / self.rate)
+
+
+class RateLimiter:
+    """
+    Client-side pacing with one token bucket for requests/min and one for tokens/min.
+    Each caller reserves its share up front (the bucket may go negative) and sleeps off the deficit,
+    so waiters are served in arrival order instead of retrying against the provider together.
+    """
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self._requests = TokenBucket(rpm) if rpm is not None else None
+        self._tokens = TokenBucket(tpm) if tpm is not None else None
+
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+        self._waiting = 0
+
+    def _buckets(self) -> List[TokenBucket]:
+        return [b for b in (self._requests, self._tokens) if b is not None]
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        for bucket in self._buckets():
+            bucket.refill(now - self._last)
+        self._last = now
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            self._refill()
+
+            if self._requests is not None:
+                self._requests.level -= 1
+            if self._tokens is not None:
+                self._tokens.level -= tokens
+
+            wait = max((b.deficit() for b in self._buckets()), default=0.0)
+            if wait > 0:
+                self._waiting += 1
+            return wait
+
+    def _done(self) -> None:
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self, tokens: int = 0) -> float:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._done()
+        return wait
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._done()
+        return wait
+
+    @property
+    def queue_depth(self) -> int:
+        with self._lock:
+            return self._waiting
+
+    @property
+    def wait_time(self) -> float:
+        with self._lock:
+            self._refill()
+            return max((b.deficit() for b in self._buckets()), default=0.0)
+
+    def stats(self) -> Dict[str, float]:
+        return {"queue_depth": self.queue_depth, "wait_time": self.wait_time}
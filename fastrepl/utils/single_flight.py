@@ -0,0 +1,65 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Callable, Coroutine, TypeVar, Tuple, Dict, Any
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function,
+    and callers arriving while it is in flight wait for and share its result (or exception).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._tasks: Dict[Tuple[int, str], asyncio.Task] = {}
+
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                leader: Future = Future()
+                self._calls[key] = leader
+
+        if future is not None:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            leader.set_exception(e)
+            raise
+        else:
+            leader.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key: str, fn: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        # NOTE: Tasks are bound to a loop, so calls are only coalesced within the same one.
+        loop = asyncio.get_running_loop()
+        k = (id(loop), key)
+
+        with self._lock:
+            task = self._tasks.get(k)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = loop.create_task(fn())
+                self._tasks[k] = task
+                task.add_done_callback(lambda _: self._discard(k))
+
+        # The call keeps running for the others if this caller is cancelled.
+        return await asyncio.shield(task)
+
+    def _discard(self, k: Tuple[int, str]) -> None:
+        with self._lock:
+            self._tasks.pop(k, None)
@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, Tuple, List, Dict, Any
+
+from fastrepl.errors import TokenizeNotImplementedError
+
+
+class TiktokenEncoder:
+    def __init__(self, name: str = "cl100k_base") -> None:
+        import tiktoken
+
+        self.name = name
+        self._enc = tiktoken.get_encoding(name)
+
+    def encode(self, text: str) -> List[int]:
+        return self._enc.encode(text)
+
+    def encode_batch(self, texts: List[str]) -> List[List[int]]:
+        return self._enc.encode_batch(texts)
+
+
+class CohereEncoder:
+    def __init__(self, api_key: str, model: str = "command") -> None:
+        import cohere
+
+        self.name = f"cohere/{model}"
+        self._model = model
+        self._client = cohere.Client(api_key)
+
+    def encode(self, text: str) -> List[int]:
+        return self._client.tokenize(text=text, model=self._model).tokens
+
+    def encode_batch(self, texts: List[str]) -> List[List[int]]:
+        # NOTE: Cohere has no batch endpoint.
+        return [self.encode(text) for text in texts]
+
+
+class TokenizerRegistry:
+    """
+    Loads each encoder once, on first use, and keeps the most recently used encodings in a bounded LRU cache.
+    Encoders are looked up by model prefix, and cached by encoder name so models sharing one also share entries.
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, max_size: int = 4096) -> None:
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._encoders: Dict[str, Any] = {}
+        self._cache: "OrderedDict[Tuple[str, str], List[int]]" = OrderedDict()
+
+    def register(self, prefix: str, factory: Callable[[], Any]) -> None:
+        with self._lock:
+            self._factories[prefix] = factory
+            self._encoders.pop(prefix, None)
+
+    def encoder(self, model: str) -> Any:
+        prefix = next((p for p in self._factories if model.startswith(p)), None)
+        if prefix is None:
+            raise TokenizeNotImplementedError(model)
+
+        with self._lock:
+            if prefix not in self._encoders:
+                self._encoders[prefix] = self._factories[prefix]()
+            return self._encoders[prefix]
+
+    def _get(self, key: Tuple[str, str]) -> Any:
+        with self._lock:
+            ids = self._cache.get(key)
+            if ids is not None:
+                self._cache.move_to_end(key)
+            return ids
+
+    def _set(self, key: Tuple[str, str], ids: List[int]) -> None:
+        with self._lock:
+            self._cache[key] = ids
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def tokenize(self, model: str, text: str) -> List[int]:
+        enc = self.encoder(model)
+
+        ids = self._get((enc.name, text))
+        if ids is None:
+            ids = enc.encode(text)
+            self._set((enc.name, text), ids)
+        return ids
+
+    def tokenize_many(self, model: str, texts: List[str]) -> List[List[int]]:
+        enc = self.encoder(model)
+
+        results = [self._get((enc.name, text)) for text in texts]
+        misses = [i for i, ids in enumerate(results) if ids is None]
+
+        for start in range(0, len(misses), self.BATCH_SIZE):
+            batch = misses[start : start + self.BATCH_SIZE]
+            for i, ids in zip(batch, enc.encode_batch([texts[i] for i in batch])):
+                results[i] = ids
+                self._set((enc.name, texts[i]), ids)
+
+        return results
+
+    def count_tokens(self, model: str, texts: Iterable[str]) -> List[int]:
+        # NOTE: Meant for whole datasets, so new encodings are not cached and only counts are kept.
+        enc = self.encoder(model)
+
+        counts: List[int] = []
+        for batch in _batches(texts, self.BATCH_SIZE):
+            counts.extend(len(ids) for ids in enc.encode_batch(batch))
+        return counts
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+def _batches(texts: Iterable[str], size: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
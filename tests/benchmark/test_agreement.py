@@ -0,0 +1,23 @@
+import pytest
+import numpy as np
+
+from fastrepl.utils import Agreement
+
+
+@pytest.fixture(scope="module")
+def codes():
+    rng = np.random.default_rng(0)
+    truth = rng.integers(0, 5, 1_000_000)
+    noise = rng.integers(0, 5, (1_000_000, 10))
+    return np.where(rng.random((1_000_000, 10)) < 0.8, truth[:, None], noise)
+
+
+def test_update(benchmark, codes):
+    agreement = benchmark(lambda: Agreement().update_codes(codes))
+    assert agreement.num_rows == 1_000_000
+
+
+def test_interval(benchmark, codes):
+    agreement = Agreement().update_codes(codes)
+    low, high = benchmark(agreement.interval, "krippendorff")
+    assert low < agreement.krippendorff() < high
@@ -0,0 +1,48 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+HEAVY = ["litellm", "openai", "sklearn", "statsmodels", "numpy", "rich", "httpx"]
+
+
+def python(code: str) -> str:
+    env = {**os.environ, "FASTREPL_TELEMETRY": "0"}
+    return subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+
+
+def test_import(benchmark):
+    benchmark.pedantic(python, args=("import fastrepl",), rounds=5)
+
+
+def test_import_time():
+    # NOTE: `-X importtime` reports the cumulative time in microseconds, and the last line is the top-level package.
+    lines = [
+        l for l in python("import fastrepl").splitlines() if l.endswith("| fastrepl")
+    ]
+    assert int(lines[-1].split("|")[1]) < 100_000
+
+
+def test_lazy_modules():
+    loaded = python(
+        "import sys, fastrepl; " f"print([m for m in {HEAVY!r} if m in sys.modules])"
+    )
+    assert loaded.splitlines()[-1] == "[]"
+
+
+def test_lazy_attributes():
+    import fastrepl
+
+    assert fastrepl.Dataset.__name__ == "Dataset"
+    assert callable(fastrepl.local_runner)
+    assert fastrepl.llm.__name__ == "fastrepl.llm"
+    assert "SimpleEvaluator" in dir(fastrepl)
+
+    with pytest.raises(AttributeError):
+        fastrepl.does_not_exist
@@ -0,0 +1,40 @@
+import pytest
+
+import fastrepl
+from fastrepl.utils import prompt
+
+
+@prompt
+def template(context, labels, label_keys):
+    """You are master of classification who can classify any text according to the user's instructions.
+    {{context}}
+
+    These are the labels you can use:
+    {{labels}}
+
+    Only output one of these label keys:
+    {{label_keys}}"""
+
+
+def test_prompt(benchmark):
+    result = benchmark(
+        template, context="context", labels="A: a\nB: b", label_keys="A, B"
+    )
+    assert result.endswith("A, B")
+
+
+def test_prompt_positional(benchmark):
+    result = benchmark(template, "context", "A: a\nB: b", "A, B")
+    assert result.endswith("A, B")
+
+
+@pytest.fixture
+def head():
+    return fastrepl.LLMClassificationHead(
+        context="context", labels={"POSITIVE": "positive", "NEGATIVE": "negative"}
+    )
+
+
+def test_classification_head_messages(benchmark, head):
+    messages = benchmark(head.messages, "sample")
+    assert messages[-1] == {"role": "user", "content": "sample"}
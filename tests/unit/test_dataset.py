@@ -1,3 +1,10 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+
+import httpx
 import pytest
 from pytest_httpx import HTTPXMock
 from datasets import Dataset as HF_Dataset
@@ -38,21 +45,6 @@ def test_to_hf():
     assert hf_ds.to_dict() == {"a": [1]}
 
 
-def test_from_cloud(httpx_mock: HTTPXMock):
-    httpx_mock.add_response(json={"data": {"a": ["1"]}})
-
-    ds = fastrepl.Dataset.from_cloud(id="123")
-    assert ds._data == {"a": ["1"]}
-
-
-def test_push_to_cloud(httpx_mock: HTTPXMock):
-    httpx_mock.add_response(json={"id": "123"})
-
-    ds = fastrepl.Dataset.from_dict({"a": [1]})
-    id = ds.push_to_cloud(id="123")
-    assert id == "123"
-
-
 def test_len():
     ds = fastrepl.Dataset.from_dict({"a": [1]})
     assert len(ds) == 1
@@ -174,3 +166,417 @@ def test_clear():
 
     ds.clear()
     assert ds.to_dict() == {}
+
+
+def _address(array) -> int:
+    chunk = array.chunk(0) if hasattr(array, "chunk") else array
+    return chunk.buffers()[1].address
+
+
+class TestArrow:
+    def test_from_hf_zero_copy(self):
+        hf_ds = HF_Dataset.from_dict({"a": [1, 2, 3], "b": ["x", "y", "z"]})
+        ds = fastrepl.Dataset.from_hf(hf_ds)
+
+        assert isinstance(ds["a"], fastrepl.dataset.ArrowColumn)
+        assert _address(ds["a"].array) == _address(hf_ds.data.table.column("a"))
+        assert ds["a"] == [1, 2, 3]
+        assert list(ds) == [{"a": 1, "b": "x"}, {"a": 2, "b": "y"}, {"a": 3, "b": "z"}]
+
+    def test_from_hf_selected(self):
+        hf_ds = HF_Dataset.from_dict({"a": [1, 2, 3]}).select([2, 0])
+        ds = fastrepl.Dataset.from_hf(hf_ds)
+        assert ds.to_dict() == {"a": [3, 1]}
+
+    def test_to_hf_zero_copy(self):
+        ds = fastrepl.Dataset.from_dict({"a": [1, 2, 3]}).compact()
+        hf_ds = ds.to_hf()
+
+        assert _address(hf_ds.data.table.column("a")) == _address(ds["a"].array)
+        assert hf_ds.to_dict() == {"a": [1, 2, 3]}
+
+    def test_compact(self):
+        ds = fastrepl.Dataset.from_dict(
+            {
+                "a": [1, 2, 3],
+                "b": ["x", None, "z"],
+                "c": [[1, 2], [3], []],
+                "d": [{"k": 1}, 2, "3"],
+            }
+        ).compact()
+
+        assert isinstance(ds["a"], fastrepl.dataset.ArrowColumn)
+        assert isinstance(ds["b"], fastrepl.dataset.ArrowColumn)
+        assert isinstance(ds["c"], fastrepl.dataset.ArrowColumn)
+        assert isinstance(ds["d"], list)
+
+        assert ds.to_dict() == {
+            "a": [1, 2, 3],
+            "b": ["x", None, "z"],
+            "c": [[1, 2], [3], []],
+            "d": [{"k": 1}, 2, "3"],
+        }
+
+    def test_compact_lossy(self):
+        data = {
+            "a": [1, 2.5],
+            "b": [{"x": 1}, {"y": 2}],
+            "c": [(1, 2), (3, 4)],
+            "d": [2**64, 1],
+            "e": [[1, 2.5], [3]],
+            "f": [[(1, 2)], []],
+        }
+        ds = fastrepl.Dataset.from_dict({k: list(v) for k, v in data.items()}).compact()
+
+        assert all(isinstance(ds[k], list) for k in data)
+        assert ds.to_dict() == data
+
+    def test_column(self):
+        column = fastrepl.Dataset.from_dict({"a": list(range(3000))}).compact()["a"]
+
+        assert len(column) == 3000
+        assert column[1] == 1
+        assert column[-1] == 2999
+        assert column[10:13] == [10, 11, 12]
+        assert column[:6:2] == [0, 2, 4]
+        assert list(column) == list(range(3000))
+
+    def test_add_row(self):
+        ds = fastrepl.Dataset.from_dict({"a": [1, 2]}).compact()
+        ds.add_row({"a": 3, "b": "x"})
+
+        assert ds.to_dict() == {"a": [1, 2, 3], "b": [None, None, "x"]}
+
+    def test_memory(self):
+        import sys
+
+        values = [f"sample {i}" for i in range(10000)]
+        ds = fastrepl.Dataset.from_dict({"a": values}).compact()
+
+        list_size = sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values)
+        assert ds["a"].array.nbytes < list_size / 4
+
+
+def _double(batch):
+    return {"a": [v * 2 for v in batch["a"]]}
+
+
+class TestBatched:
+    @pytest.mark.parametrize("compact", [False, True])
+    def test_map(self, compact):
+        ds = fastrepl.Dataset.from_dict({"a": list(range(10)), "b": ["x"] * 10})
+        if compact:
+            ds = ds.compact()
+
+        calls = []
+
+        def func(batch):
+            calls.append(len(batch["a"]))
+            return {"a": [v + 1 for v in batch["a"]], "c": batch["b"]}
+
+        ds2 = ds.map(func, batched=True, batch_size=4)
+
+        assert calls == [4, 4, 2]
+        assert ds2.column_names == ["a", "b", "c"]
+        assert ds2["a"] == list(range(1, 11))
+        assert ds2["c"] == ["x"] * 10
+        assert ds["a"] == list(range(10))
+
+    def test_map_num_proc(self):
+        ds = fastrepl.Dataset.from_dict({"a": list(range(10))})
+        ds2 = ds.map(_double, batched=True, batch_size=3, num_proc=2)
+        assert ds2["a"] == [v * 2 for v in range(10)]
+
+    def test_filter(self):
+        ds = fastrepl.Dataset.from_dict({"a": list(range(10)), "b": list(range(10))})
+
+        assert ds.filter(lambda row: row["a"] % 2 == 0)["b"] == [0, 2, 4, 6, 8]
+        assert ds.compact().filter(
+            lambda batch: [v > 6 for v in batch["a"]], batched=True, batch_size=3
+        ).to_dict() == {"a": [7, 8, 9], "b": [7, 8, 9]}
+
+    @pytest.mark.parametrize("compact", [False, True])
+    def test_select(self, compact):
+        ds = fastrepl.Dataset.from_dict({"a": [0, 1, 2, 3], "b": ["a", "b", "c", "d"]})
+        if compact:
+            ds = ds.compact()
+
+        assert ds.select([3, 1]).to_dict() == {"a": [3, 1], "b": ["d", "b"]}
+        assert len(ds.select([])) == 0
+
+    def test_shuffle(self):
+        ds = fastrepl.Dataset.from_dict({"a": list(range(100)), "b": list(range(100))})
+
+        ds1, ds2 = ds.shuffle(seed=42), ds.shuffle(seed=42)
+        assert ds1.to_dict() == ds2.to_dict()
+        assert ds1["a"] != list(range(100))
+        assert sorted(ds1["a"]) == list(range(100))
+        assert ds1["a"] == ds1["b"]
+
+    def test_train_test_split(self):
+        ds = fastrepl.Dataset.from_dict({"a": list(range(10))})
+
+        train, test = ds.train_test_split(test_size=0.3, seed=0)
+        assert (len(train), len(test)) == (7, 3)
+        assert sorted(list(train["a"]) + list(test["a"])) == list(range(10))
+
+        train, test = ds.train_test_split(test_size=2, shuffle=False)
+        assert train["a"] == list(range(2, 10))
+        assert test["a"] == [0, 1]
+
+        with pytest.raises(ValueError):
+            ds.train_test_split(test_size=11)
+
+
+class TestDisk:
+    @pytest.mark.parametrize("mmap", [True, False])
+    def test_roundtrip(self, tmp_path, mmap):
+        data = {
+            "a": list(range(25)),
+            "b": [f"s{i}" for i in range(25)],
+            "c": [[i, i] for i in range(25)],
+            "d": [{"k": 1}, 2, "3", None, [1]] * 5,
+        }
+        fastrepl.Dataset.from_dict(data).save_to_disk(str(tmp_path), chunk_size=10)
+
+        ds = fastrepl.Dataset.load_from_disk(str(tmp_path), mmap=mmap)
+        assert ds.to_dict() == data
+        assert isinstance(ds["a"], fastrepl.dataset.ArrowColumn)
+        assert ds["a"].array.num_chunks == 3
+
+    @pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs procfs")
+    @pytest.mark.parametrize("mmap", [True, False])
+    def test_closes_file(self, tmp_path, mmap):
+        fastrepl.Dataset.from_dict({"a": [1, 2]}).save_to_disk(str(tmp_path))
+
+        before = len(os.listdir("/proc/self/fd"))
+        datasets = [
+            fastrepl.Dataset.load_from_disk(str(tmp_path), mmap=mmap) for _ in range(5)
+        ]
+        assert len(os.listdir("/proc/self/fd")) == before
+        assert all(ds.to_dict() == {"a": [1, 2]} for ds in datasets)
+
+    def test_roundtrip_lossy(self, tmp_path):
+        data = {
+            "a": [1, 2.5],
+            "b": [{"x": 1}, {"y": 2}],
+            "c": [(1, 2), (3, 4)],
+            "d": [2**64, 1],
+            "e": [{1: "x"}, {1, 2}],
+            "f": [object, None],
+        }
+        fastrepl.Dataset.from_dict(data).save_to_disk(str(tmp_path))
+
+        ds = fastrepl.Dataset.load_from_disk(str(tmp_path))
+        assert ds.to_dict() == data
+        assert type(ds["c"][0]) is tuple
+
+    def test_lazy(self, tmp_path):
+        import pyarrow as pa
+
+        values = [f"sample {i}" * 10 for i in range(50000)]
+        fastrepl.Dataset.from_dict({"a": values}).save_to_disk(str(tmp_path))
+
+        before = pa.total_allocated_bytes()
+        ds = fastrepl.Dataset.load_from_disk(str(tmp_path))
+        assert ds["a"][30000:30002] == values[30000:30002]
+        assert pa.total_allocated_bytes() - before < 1024 * 1024
+
+    def test_compacted(self, tmp_path):
+        ds = fastrepl.Dataset.from_dict({"a": [1, 2, 3]}).compact()
+        ds.save_to_disk(str(tmp_path))
+
+        assert fastrepl.Dataset.load_from_disk(str(tmp_path)).to_dict() == {
+            "a": [1, 2, 3]
+        }
+
+
+def test_from_cloud(httpx_mock: HTTPXMock):
+    # NOTE: A server without the chunked routes.
+    httpx_mock.add_response(
+        url=re.compile(r".*/dataset/download/123.*"), status_code=404
+    )
+    httpx_mock.add_response(json={"data": {"a": ["1"]}})
+
+    ds = fastrepl.Dataset.from_cloud(id="123")
+    assert ds._data == {"a": ["1"]}
+
+
+def test_push_to_cloud(httpx_mock: HTTPXMock):
+    httpx_mock.add_response(
+        url="http://api.fastrepl.com/dataset/upload/start", status_code=404
+    )
+    httpx_mock.add_response(json={"id": "123"})
+
+    ds = fastrepl.Dataset.from_dict({"a": [1]})
+    id = ds.push_to_cloud(id="123")
+    assert id == "123"
+
+
+class FakeCloud:
+    def __init__(self) -> None:
+        self.datasets: dict = {}  # id -> [(version, columns, rows)]
+        self.uploads: dict = {}
+        self.puts: list = []
+        self.fail_once: set = set()  # paths that return 503 on the first request
+        self.drop_after = None  # rows sent before the first download is cut off
+        self.down = False  # connections to commit fail
+
+    def latest(self, id):
+        return self.datasets[id][-1]
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.removeprefix("/dataset")
+        if path in self.fail_once:
+            self.fail_once.remove(path)
+            return httpx.Response(503)
+
+        if path == "/upload/start":
+            body = json.loads(request.content)
+            if body["base_version"] is not None and (
+                self.latest(body["id"])[0] != body["base_version"]
+            ):
+                return httpx.Response(409)
+
+            upload_id = hashlib.sha256(json.dumps(body).encode()).hexdigest()[:8]
+            upload = self.uploads.setdefault(upload_id, {**body, "chunks": {}})
+            received = {i: c["checksum"] for i, c in upload["chunks"].items()}
+            return httpx.Response(
+                200, json={"upload_id": upload_id, "received": received}
+            )
+
+        if path.startswith("/upload/") and path.endswith("/commit"):
+            if self.down:
+                raise httpx.ConnectError("down")
+            upload = self.uploads[path.split("/")[2]]
+            rows = []
+            if upload["offset"] > 0:
+                rows = self.latest(upload["id"])[2][: upload["offset"]]
+            for i in sorted(upload["chunks"], key=int):
+                rows = rows + upload["chunks"][i]["rows"]
+            assert len(rows) == upload["num_rows"]
+
+            id = upload["id"] or "generated"
+            versions = self.datasets.setdefault(id, [])
+            versions.append((str(len(versions) + 1), upload["columns"], rows))
+            return httpx.Response(200, json={"id": id, "version": versions[-1][0]})
+
+        if path.startswith("/upload/"):
+            _, _, upload_id, i = path.split("/")
+            assert request.headers["Content-Encoding"] == "gzip"
+            content = gzip.decompress(request.content)
+            assert hashlib.sha256(content).hexdigest() == request.headers["X-Checksum"]
+
+            self.puts.append(i)
+            self.uploads[upload_id]["chunks"][i] = {
+                "checksum": request.headers["X-Checksum"],
+                "rows": [json.loads(line) for line in content.splitlines()],
+            }
+            return httpx.Response(200)
+
+        if path.startswith("/download/"):
+            id = path.split("/")[2]
+            version = request.url.params.get("version")
+            versions = {v[0]: v for v in self.datasets[id]}
+            version, columns, rows = versions[version or self.latest(id)[0]]
+
+            rows = rows[int(request.url.params["offset"]) :]
+            if self.drop_after is not None:
+                rows, self.drop_after = rows[: self.drop_after], None
+
+            header = {
+                "version": version,
+                "columns": columns,
+                "num_rows": len(versions[version][2]),
+            }
+            lines = [json.dumps(header)] + [json.dumps(row) for row in rows]
+            return httpx.Response(
+                200,
+                stream=httpx.ByteStream(gzip.compress("\n".join(lines).encode())),
+                headers={"Content-Encoding": "gzip"},
+            )
+
+        raise AssertionError(path)
+
+
+@pytest.fixture
+def cloud(httpx_mock: HTTPXMock, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda _: None)
+
+    server = FakeCloud()
+    httpx_mock.add_callback(server, is_reusable=True)
+    return server
+
+
+class TestCloud:
+    def test_roundtrip(self, cloud):
+        data = {"a": list(range(25)), "b": [{"k": i} for i in range(25)]}
+
+        id = fastrepl.Dataset.from_dict(data).push_to_cloud(id="123", chunk_size=10)
+        assert id == "123"
+        assert cloud.puts == ["0", "1", "2"]
+
+        assert fastrepl.Dataset.from_cloud(id="123").to_dict() == data
+
+    def test_push_resume(self, cloud):
+        ds = fastrepl.Dataset.from_dict({"a": list(range(25))})
+
+        cloud.down = True
+        with pytest.raises(httpx.ConnectError):
+            ds.push_to_cloud(id="123", chunk_size=10)
+        assert cloud.puts == ["0", "1", "2"]
+
+        cloud.down = False
+        ds.push_to_cloud(id="123", chunk_size=10)
+        assert cloud.puts == ["0", "1", "2"]
+        assert cloud.latest("123")[2] == [{"a": i} for i in range(25)]
+
+    def test_pull_resume(self, cloud):
+        data = {"a": list(range(25))}
+        fastrepl.Dataset.from_dict(data).push_to_cloud(id="123")
+
+        cloud.drop_after = 7
+        assert fastrepl.Dataset.from_cloud(id="123").to_dict() == data
+
+    def test_delta(self, cloud):
+        fastrepl.Dataset.from_dict({"a": list(range(25))}).push_to_cloud(
+            id="123", chunk_size=10
+        )
+        cloud.puts.clear()
+
+        ds = fastrepl.Dataset.from_cloud(id="123")
+        ds.add_row({"a": 25})
+        ds.add_row({"a": 26})
+        ds.push_to_cloud(id="123", chunk_size=10)
+
+        assert cloud.puts == ["0"]
+        assert cloud.uploads[list(cloud.uploads)[-1]]["offset"] == 25
+        assert cloud.latest("123")[0] == "2"
+        assert fastrepl.Dataset.from_cloud(id="123")["a"] == list(range(27))
+
+    def test_delta_stale(self, cloud):
+        fastrepl.Dataset.from_dict({"a": [1, 2]}).push_to_cloud(id="123")
+        ds = fastrepl.Dataset.from_cloud(id="123")
+
+        fastrepl.Dataset.from_dict({"a": [3]}).push_to_cloud(id="123")
+
+        ds.add_row({"a": 4})
+        ds.push_to_cloud(id="123")
+        assert cloud.latest("123")[2] == [{"a": 1}, {"a": 2}, {"a": 4}]
+
+    def test_delta_modified(self, cloud):
+        fastrepl.Dataset.from_dict({"a": [1, 2]}).push_to_cloud(id="123")
+        ds = fastrepl.Dataset.from_cloud(id="123")
+
+        ds._data["a"][0] = 0
+        ds.add_row({"a": 3})
+        ds.push_to_cloud(id="123")
+
+        assert cloud.uploads[list(cloud.uploads)[-1]]["offset"] == 0
+        assert cloud.latest("123")[2] == [{"a": 0}, {"a": 2}, {"a": 3}]
+
+    def test_retry(self, cloud):
+        cloud.fail_once = {"/upload/start"}
+        assert (
+            fastrepl.Dataset.from_dict({"a": [1]}).push_to_cloud(id=None) == "generated"
+        )
@@ -274,6 +274,83 @@ class TestSemanticAnswerSimilarityMetric:
         assert np.allclose(actual["top_k_sas"], expected["top_k_sas"])
         assert np.allclose(actual["pred_label_matrix"], expected["pred_label_matrix"])
 
+    def test_cross_encoder_chunked(self, tmp_path):
+        from fastrepl.utils import ScoreCache
+
+        calls = []
+
+        class Model:
+            def predict(self, pairs, batch_size):
+                calls.append(list(pairs))
+                return np.array([len(p) - len(l) for p, l in pairs], dtype=np.float32)
+
+        def metric(cache):
+            m = object.__new__(fastrepl.SemanticAnswerSimilarityMetric)
+            m.is_cross_encoder, m.model = True, Model()
+            m.batch_size, m.chunk_size, m.cache = 16, 3, cache
+            return m
+
+        predictions = [["a", "bb"], ["a"], ["ccc", "a"]]
+        references = [["x", "yy"], ["x", "yy"], ["x"]]
+
+        m = metric(ScoreCache(str(tmp_path / "scores.sqlite")))
+        actual = m.run(predictions=predictions, references=references)
+
+        assert actual["pred_label_matrix"] == [
+            [[0, -1], [1, 0]],
+            [[0, -1]],
+            [[2], [0]],
+        ]
+        assert actual["top_1_sas"] == [0, 0, 2]
+        assert actual["top_k_sas"] == [1, 0, 2]
+
+        # 8 pairs in chunks of 3, and ("a", "x") / ("a", "yy") are scored once.
+        assert all(len(c) <= 3 for c in calls)
+        assert sorted(p for c in calls for p in c) == sorted(
+            [("a", "x"), ("a", "yy"), ("bb", "x"), ("bb", "yy"), ("ccc", "x")]
+        )
+
+        calls.clear()
+        m = metric(ScoreCache(str(tmp_path / "scores.sqlite"), max_size=1))
+        assert m.run(predictions=predictions, references=references) == actual
+        assert calls == []
+        assert len(m.cache._memory) == 1
+
+    def test_bi_encoder_vectorized(self):
+        from sklearn.metrics.pairwise import cosine_similarity
+        from fastrepl.utils import EmbeddingCache
+
+        calls = []
+
+        class Model:
+            def encode(self, texts, batch_size):
+                calls.append((texts, batch_size))
+                rng = np.random.default_rng(0)
+                table = rng.normal(size=(128, 8))
+                return np.array([table[sum(map(ord, t)) % 128] for t in texts])
+
+        m = object.__new__(fastrepl.SemanticAnswerSimilarityMetric)
+        m.is_cross_encoder, m.model = False, Model()
+        m.batch_size, m.cache = 16, EmbeddingCache()
+
+        predictions = [["a", "b"], ["c"], ["d", "e", "f"]]
+        references = [["x"], ["y", "z", "a"], ["x", "y"]]
+        actual = m.run(predictions=predictions, references=references)
+        assert all(type(v) is float for v in actual["top_1_sas"] + actual["top_k_sas"])
+
+        model = Model()
+        for i, (preds, refs) in enumerate(zip(predictions, references)):
+            sims = cosine_similarity(model.encode(preds, 0), model.encode(refs, 0))
+            assert np.allclose(actual["pred_label_matrix"][i], sims)
+            assert np.isclose(actual["top_1_sas"][i], sims[0].max())
+            assert np.isclose(actual["top_k_sas"][i], sims.max())
+
+        # "a" is both a prediction and a reference, and the fixed references are not embedded again.
+        assert calls[0] == (list("abcdefxyz"), 16)
+        calls.clear()
+        m.run(predictions=[["g"], ["a"], ["h"]], references=references, batch_size=4)
+        assert calls == [(["g", "h"], 4)]
+
     @pytest.mark.parametrize(
         "predictions, references, expected",
         [
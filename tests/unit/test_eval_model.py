@@ -3,6 +3,7 @@ import warnings
 import litellm
 
 import fastrepl
+import fastrepl.llm
 
 # TODO: Here we should fix range to 1-5
 
@@ -56,6 +57,38 @@ class TestClassificationHeadShuffle:
     def test_basic(self):
         pass
 
+    def test_memoized(self, mock_completion, monkeypatch):
+        import random
+        import fastrepl.llm
+        from fastrepl.eval.model.utils import mappings_from_labels
+
+        labels = {"POSITIVE": "positive", "NEGATIVE": "negative", "NEUTRAL": "neutral"}
+        eval = fastrepl.LLMClassificationHead(
+            context="test", labels=labels, rg=random.Random(7)
+        )
+
+        tokenized = []
+        tokenize = fastrepl.llm.tokenize
+        monkeypatch.setattr(
+            fastrepl.llm,
+            "tokenize",
+            lambda model, text: tokenized.append(text) or tokenize(model, text),
+        )
+
+        mock_completion(["A"] * 10)
+        mappings = []
+        for _ in range(10):
+            eval.run(sample="")
+            mappings.append(eval.mapping)
+
+        # NOTE: Only the initial logit_bias tokenizes. (estimate_tokens is only used with a rate limit)
+        assert sorted(tokenized) == ["A", "B", "C"]
+
+        rg = random.Random(7)
+        assert mappings == [mappings_from_labels(labels, rg=rg) for _ in range(10)]
+        precomputed = list(eval._permutations.values())
+        assert all(any(m is p for p in precomputed) for m in mappings)
+
 
 class TestClassificationHeadConsensus:
     def test_no_need_for_consensus(self, mock_completion):
@@ -103,6 +136,198 @@ class TestClassificationHeadConsensus:
         assert eval.run(sample="") is None
 
 
+def _order(messages):
+    import re
+
+    return re.findall(r"^[A-Z]: (.+)$", messages[0]["content"], re.M)
+
+
+def _token_of(description):
+    return lambda order, sample: chr(ord("A") + order.index(description))
+
+
+@pytest.fixture
+def mock_pick(monkeypatch):
+    """
+    `pick(descriptions, sample)` gets the label descriptions in the order of the prompt, and returns the answer.
+    Returns the messages of every call.
+    """
+
+    def ret(pick, delay=0.0):
+        import time
+        import threading
+
+        calls = []
+        lock = threading.Lock()
+
+        def mock(**kwargs):
+            time.sleep(delay)
+            messages = kwargs["messages"]
+            with lock:
+                calls.append(messages)
+
+            content = pick(_order(messages), messages[-1]["content"])
+            return {
+                "choices": [{"message": {"content": content}, "finish_reason": "stop"}]
+            }
+
+        monkeypatch.setattr(litellm, "completion", mock)
+        # NOTE: `litellm_completion` runs in a subprocess off the main thread because of its timeout.
+        monkeypatch.setattr(fastrepl.llm, "litellm_completion", mock)
+        return calls
+
+    return ret
+
+
+class TestClassificationHeadVote:
+    labels = {"POSITIVE": "positive", "NEGATIVE": "negative", "NEUTRAL": "neutral"}
+
+    def test_majority(self, mock_pick):
+        eval = fastrepl.LLMClassificationHead(
+            context="test", labels=self.labels, position_debias_strategy="vote"
+        )
+
+        calls = mock_pick(_token_of("negative"))
+        assert eval.run(sample="") == "NEGATIVE"
+
+        # Every label took every position once.
+        assert len(calls) == 3
+        for position in zip(*map(_order, calls)):
+            assert sorted(position) == ["negative", "neutral", "positive"]
+
+    def test_position_bias(self, mock_pick):
+        eval = fastrepl.LLMClassificationHead(
+            context="test", labels=self.labels, position_debias_strategy="vote"
+        )
+
+        mock_pick(lambda order, sample: "A")
+        assert eval.run(sample="") is None
+
+    def test_invalid_counts_against(self, mock_pick):
+        def pick(order, sample):
+            return (
+                "Z" if order[0] == "neutral" else _token_of("positive")(order, sample)
+            )
+
+        mock_pick(pick)
+
+        eval = fastrepl.LLMClassificationHead(
+            context="test", labels=self.labels, position_debias_strategy="vote"
+        )
+        with pytest.warns():
+            assert eval.run(sample="") == "POSITIVE"
+
+        eval = fastrepl.LLMClassificationHead(
+            context="test",
+            labels={"POSITIVE": "positive", "NEUTRAL": "neutral"},
+            position_debias_strategy="vote",
+        )
+        with pytest.warns():
+            assert eval.run(sample="") is None
+
+    def test_num_permutations(self, mock_pick):
+        eval = fastrepl.LLMClassificationHead(
+            context="test",
+            labels=self.labels,
+            position_debias_strategy="vote",
+            num_permutations=5,
+        )
+
+        calls = mock_pick(_token_of("neutral"))
+        assert eval.run(sample="") == "NEUTRAL"
+        assert len({tuple(_order(messages)) for messages in calls}) == 5
+
+    def test_parallel(self, mock_pick):
+        import time
+
+        eval = fastrepl.LLMClassificationHead(
+            context="test", labels=self.labels, position_debias_strategy="vote"
+        )
+        mock_pick(_token_of("positive"), delay=0.3)
+
+        start = time.monotonic()
+        assert eval.run(sample="") == "POSITIVE"
+        assert time.monotonic() - start < 0.6
+
+    def test_shared_head(self, mock_pick):
+        from multiprocessing.pool import ThreadPool
+
+        eval = fastrepl.LLMClassificationHead(
+            context="test", labels=self.labels, position_debias_strategy="vote"
+        )
+        mapping = eval.mapping
+        mock_pick(lambda order, sample: _token_of(sample)(order, sample), delay=0.01)
+
+        samples = ["positive", "negative", "neutral"] * 10
+        with ThreadPool(8) as pool:
+            results = pool.map(lambda s: eval.run(sample=s), samples)
+
+        assert results == [s.upper() for s in samples]
+        assert eval.mapping is mapping
+
+    def test_shared_executor(self, mock_pick, monkeypatch):
+        import threading
+        from multiprocessing.pool import ThreadPool
+        from concurrent.futures import ThreadPoolExecutor
+        import fastrepl.eval.model.llm_head as llm_head
+
+        executor = ThreadPoolExecutor(2)
+        monkeypatch.setattr(llm_head, "VOTE_EXECUTOR", executor)
+
+        threads = set()
+
+        def pick(order, sample):
+            threads.add(threading.current_thread().name)
+            return _token_of(sample)(order, sample)
+
+        eval = fastrepl.LLMClassificationHead(
+            context="test", labels=self.labels, position_debias_strategy="vote"
+        )
+        mock_pick(pick, delay=0.01)
+
+        samples = ["positive", "negative", "neutral"] * 10
+        with ThreadPool(8) as pool:
+            results = pool.map(lambda s: eval.run(sample=s), samples)
+        executor.shutdown()
+
+        assert results == [s.upper() for s in samples]
+        # The 8 runner threads, plus at most 2 for the other votes.
+        assert len(threads) <= 10
+
+    def test_async(self, mock_pick):
+        import asyncio
+
+        eval = fastrepl.LLMClassificationHead(
+            context="test", labels=self.labels, position_debias_strategy="vote"
+        )
+        calls = mock_pick(
+            lambda order, sample: _token_of(sample)(order, sample), delay=0.05
+        )
+
+        async def run():
+            samples = ["positive", "negative", "neutral"] * 5
+            return await asyncio.gather(*[eval.arun(sample=s) for s in samples])
+
+        assert asyncio.run(run()) == ["POSITIVE", "NEGATIVE", "NEUTRAL"] * 5
+        # NOTE: Identical prompts in flight at the same time share one call, so 3 samples x 3 orderings.
+        assert len(calls) == 9
+
+    def test_references(self, mock_pick):
+        eval = fastrepl.LLMClassificationHead(
+            context="test",
+            labels=self.labels,
+            position_debias_strategy="vote",
+            references=[("a", "POSITIVE"), ("b", "NEGATIVE")],
+        )
+
+        calls = mock_pick(_token_of("positive"))
+        assert eval.run(sample="") == "POSITIVE"
+
+        # Rotated per call, rather than drawn from the shared `rg`.
+        inputs = sorted([m["content"] for m in messages[1:-1:2]] for messages in calls)
+        assert inputs == [["a", "b"], ["a", "b"], ["b", "a"]]
+
+
 class TestLLMGradingHead:
     @pytest.mark.parametrize(
         "return_value, number_from, number_to",
@@ -147,3 +372,63 @@ class TestLLMGradingHead:
 
         with pytest.warns():
             assert eval.run(sample="") == score
+
+
+class TestAsync:
+    def test_classification(self, mock_completion):
+        import asyncio
+
+        eval = fastrepl.LLMClassificationHead(
+            context="test",
+            labels={
+                "POSITIVE": "this is positive",
+                "NEGATIVE": "this is negative",
+            },
+        )
+
+        mock_completion(["A"] * 20)
+
+        async def run():
+            return await asyncio.gather(*[eval.arun(sample="") for _ in range(20)])
+
+        # Each result is decoded with the mapping used to build its own prompt.
+        results = asyncio.run(run())
+        assert set(results) <= {"POSITIVE", "NEGATIVE"}
+        assert len(set(results)) == 2
+
+    def test_consensus(self, mock_completion):
+        import asyncio
+
+        eval = fastrepl.LLMClassificationHead(
+            context="test",
+            labels={ch: ch for ch in "ABC"},
+            position_debias_strategy="consensus",
+        )
+
+        mock_completion([eval.mapping[0].token, eval.mapping[1].token])
+        assert asyncio.run(eval.arun(sample="")) is None
+
+    def test_grading(self, mock_completion):
+        import asyncio
+
+        eval = fastrepl.LLMGradingHead(context="test", number_from=1, number_to=5)
+
+        mock_completion(["3"])
+        assert asyncio.run(fastrepl.SimpleEvaluator(eval).arun(sample="")) == 3
+
+
+class TestRAGAS:
+    def test_shared_critique(self, monkeypatch):
+        pytest.importorskip("ragas")
+        from ragas.metrics.critique import harmfulness
+        from fastrepl.eval.model.ragas import RAGAS
+
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        llm, batch_size = harmfulness.llm, harmfulness.batch_size
+
+        a = RAGAS("harmfulness", batch_size=1)
+        b = RAGAS("harmfulness", model="gpt-4", batch_size=4)
+
+        assert (a._metric.batch_size, b._metric.batch_size) == (1, 4)
+        assert a._metric.llm is not b._metric.llm
+        assert (harmfulness.llm, harmfulness.batch_size) == (llm, batch_size)
@@ -5,6 +5,8 @@ import fastrepl.llm
 from fastrepl.eval.model.utils import (
     logit_bias_from,
     mappings_from_labels,
+    permuted_mappings,
+    rotated_mappings,
     next_mappings_for_consensus,
     LabelMapping,
 )
@@ -90,6 +92,20 @@ def test_mapping_from_labels():
     ]
 
 
+def test_permuted_mappings():
+    labels = {"POSITIVE": "positive", "NEGATIVE": "negative", "NEUTRAL": "neutral"}
+    precomputed = permuted_mappings(labels)
+    assert len(precomputed) == 6
+
+    rg1, rg2 = random.Random(0), random.Random(0)
+    for _ in range(20):
+        assert mappings_from_labels(
+            labels, rg=rg1, precomputed=precomputed
+        ) == mappings_from_labels(labels, rg=rg2)
+
+    assert permuted_mappings({str(i): "" for i in range(6)}) == {}
+
+
 class TestNextMappingsForConsensus:
     @pytest.mark.parametrize(
         "mappings, result, expected",
@@ -180,6 +196,19 @@ class TestNextMappingsForConsensus:
         assert next_mappings_for_consensus(mappings, result) == expected
 
 
+def test_rotated_mappings():
+    mappings = mappings_from_labels({"A": "a", "B": "b", "C": "c"})
+
+    rotated = rotated_mappings(mappings, 6)
+    assert rotated[0] == mappings
+    assert [m.label for m in rotated[3]] == [m.label for m in reversed(mappings)]
+    assert all([m.token for m in r] == ["A", "B", "C"] for r in rotated)
+    assert len({tuple(m.label for m in r) for r in rotated}) == 6
+
+    for position in zip(*rotated[:3]):
+        assert sorted(m.label for m in position) == ["A", "B", "C"]
+
+
 def test_check_length_inbalance():
     assert check_length_inbalance(["A" * 9, "B" * 3, "C"])
     assert not check_length_inbalance(["A" * 4, "B" * 3, "C" * 2])
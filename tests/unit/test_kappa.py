@@ -1,8 +1,10 @@
 import pytest
+import numpy as np
 
 from statsmodels.stats.inter_rater import cohens_kappa, fleiss_kappa, aggregate_raters
 
-from fastrepl.utils import kappa
+from fastrepl.utils import kappa, kappa_interval, Agreement
+from fastrepl.utils.kappa import fleiss_kappa_ragged
 
 
 class TestCohensKappa:
@@ -115,3 +117,122 @@ def test_kappa_single_rater():
 def test_kappa_single_result():
     with pytest.warns():
         kappa([[1, 1, 1]])
+
+
+def test_fleiss_kappa_ragged():
+    predictions = [
+        ["A", "A", "B"],
+        ["B", "B", "B"],
+        ["A", "C", "C"],
+        ["A", "A", "A"],
+    ]
+    table, _ = aggregate_raters(
+        [[{"A": 0, "B": 1, "C": 2}[p] for p in ps] for ps in predictions]
+    )
+    assert fleiss_kappa_ragged(predictions) == pytest.approx(fleiss_kappa(table))
+
+    # Observed agreement: (1/3 + 1 + 1) / 3 = 7/9, rows with a single rating are skipped.
+    # Expected agreement, over the same rows: (4/9)^2 + (5/9)^2 = 41/81
+    ragged = [["A", "A", "B"], ["B", "B", "B", "B"], ["C"], ["A", "A"]]
+    expected = (7 / 9 - 41 / 81) / (1 - 41 / 81)
+    assert fleiss_kappa_ragged(ragged) == pytest.approx(expected)
+    assert kappa(ragged) == pytest.approx(expected)
+
+
+def test_kappa_interval():
+    predictions = [["A"] * 3 if i % 4 else ["A", "B", "B"] for i in range(40)]
+    predictions += [["B"] * 3 for _ in range(20)]
+
+    low, high = kappa_interval(predictions)
+    assert low < kappa(predictions) < high
+    assert kappa_interval(predictions) == (low, high)
+
+    narrower = kappa_interval(predictions * 10)
+    assert narrower[1] - narrower[0] < high - low
+
+
+def test_kappa_none_label():
+    assert kappa([["A", None], ["A", None]]) == pytest.approx(0)
+    assert kappa([["A", "A", None], ["B", "B", "B"]]) == pytest.approx(
+        fleiss_kappa(aggregate_raters([[0, 0, 2], [1, 1, 1]])[0])
+    )
+
+
+class TestAgreement:
+    @pytest.fixture
+    def codes(self):
+        rng = np.random.default_rng(0)
+        truth = rng.integers(0, 4, 500)
+        noise = rng.integers(0, 4, (500, 5))
+        return np.where(rng.random((500, 5)) < 0.7, truth[:, None], noise)
+
+    def test_fleiss(self, codes):
+        table, _ = aggregate_raters(codes)
+        assert Agreement().update_codes(codes).fleiss() == pytest.approx(
+            fleiss_kappa(table)
+        )
+
+    def test_cohen(self, codes):
+        from sklearn.metrics import confusion_matrix
+
+        agreement = Agreement().update_codes(codes[:, :2])
+        assert agreement.paired
+        assert agreement.cohen() == pytest.approx(
+            cohens_kappa(
+                confusion_matrix(codes[:, 0], codes[:, 1]), return_results=False
+            )
+        )
+
+        with pytest.raises(ValueError):
+            Agreement().update_codes(codes).cohen()
+
+    def test_krippendorff(self):
+        # Reliability data of 4 coders over 12 units, from Krippendorff (2011), nominal alpha = 0.743
+        coders = [
+            [1, 2, 3, 3, 2, 1, 4, 1, 2, -1, -1, -1],
+            [1, 2, 3, 3, 2, 2, 4, 1, 2, 5, -1, 3],
+            [-1, 3, 3, 3, 2, 3, 4, 2, 2, 5, 1, -1],
+            [1, 2, 3, 3, 2, 4, 4, 1, 2, 5, 1, -1],
+        ]
+        agreement = Agreement().update_codes(np.array(coders).T)
+        assert agreement.krippendorff() == pytest.approx(0.743, abs=1e-3)
+
+    def test_per_label(self):
+        agreement = Agreement().update([["A", "A"], ["A", "B"], ["B", "B"]])
+        # "A" is chosen 3 times, and 2 of those are matched by the other rater.
+        assert agreement.per_label() == pytest.approx({"A": 2 / 3, "B": 2 / 3})
+
+    def test_incremental(self, codes):
+        agreement = Agreement()
+        for start in range(0, len(codes), 64):
+            agreement.update_codes(codes[start : start + 64])
+
+        full = Agreement().update_codes(codes)
+        assert agreement.num_rows == full.num_rows == 500
+        assert agreement.fleiss() == pytest.approx(full.fleiss())
+        assert agreement.krippendorff() == pytest.approx(full.krippendorff())
+        assert agreement.interval() == full.interval()
+
+    def test_new_labels(self):
+        agreement = Agreement().update([["A", "A"], ["A", "B"]])
+        agreement.update([["C", "C"], ["B", "C"]])
+        assert agreement.cohen() == pytest.approx(
+            kappa([["A", "A"], ["A", "B"], ["C", "C"], ["B", "C"]])
+        )
+
+    def test_interval(self, codes):
+        agreement = Agreement().update_codes(codes)
+
+        for statistic, value in [
+            ("fleiss", agreement.fleiss()),
+            ("krippendorff", agreement.krippendorff()),
+        ]:
+            low, high = agreement.interval(statistic)
+            assert low < value < high
+
+        paired = Agreement().update_codes(codes[:, :2])
+        low, high = paired.interval("cohen")
+        assert low < paired.cohen() < high
+
+        with pytest.raises(ValueError):
+            agreement.interval("unknown")
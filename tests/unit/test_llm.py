@@ -2,11 +2,14 @@ import pytest
 import openai.error
 import litellm
 
+import fastrepl.llm
+from fastrepl.utils import SingleFlight
 from fastrepl.llm import (
     raise_openai_exception_for_retry,
     RetryConstantException,
     RetryExpoException,
     completion,
+    acompletion,
 )
 
 
@@ -15,6 +18,33 @@ class TestCompletion:
         with pytest.raises(TypeError):
             completion("gpt-3.5-turbo", messages=[{"role": "user", "content": "hi"}])
 
+    def test_async(self, monkeypatch):
+        import asyncio
+
+        def mock(**kwargs):
+            content = kwargs["messages"][0]["content"]
+            return {
+                "choices": [{"finish_reason": "stop", "message": {"content": content}}]
+            }
+
+        monkeypatch.setattr(litellm, "completion", mock)
+
+        async def run():
+            return await asyncio.gather(
+                *[
+                    acompletion(
+                        model="gpt-3.5-turbo",
+                        messages=[{"role": "user", "content": str(i)}],
+                    )
+                    for i in range(10)
+                ]
+            )
+
+        results = asyncio.run(run())
+        assert [r["choices"][0]["message"]["content"] for r in results] == [
+            str(i) for i in range(10)
+        ]
+
 
 class TestHandleLLMException:
     @pytest.mark.parametrize(
@@ -91,3 +121,198 @@ class TestContextFallback:
                 model="gpt-3.5-turbo-16k",
                 messages=[{"role": "user", "content": "24k tokens"}],
             )
+
+
+class TestDiskCache:
+    def test_hit(self, monkeypatch, tmp_path):
+        calls = []
+
+        def mock(**kwargs):
+            calls.append(kwargs)
+            return {"choices": [{"finish_reason": "stop", "message": {"content": "A"}}]}
+
+        monkeypatch.setattr(litellm, "completion", mock)
+        monkeypatch.setattr(fastrepl.llm, "disk_cache", None)
+        cache = fastrepl.llm.use_disk_cache(path=str(tmp_path / "llm.db"))
+
+        messages = [{"role": "user", "content": "hi"}]
+        for _ in range(3):
+            result = completion(model="gpt-3.5-turbo", messages=messages)
+            assert result["choices"][0]["message"]["content"] == "A"
+
+        assert len(calls) == 1
+        assert cache.stats() == {"hits": 2, "misses": 1, "size": 1}
+
+        completion(model="gpt-3.5-turbo", messages=messages, max_tokens=1)
+        completion(model="gpt-3.5-turbo", messages=messages, stop=["\n"])
+        assert len(calls) == 3
+
+    def test_persistent(self, monkeypatch, tmp_path):
+        def mock(**kwargs):
+            return {"choices": [{"finish_reason": "stop", "message": {"content": "A"}}]}
+
+        monkeypatch.setattr(litellm, "completion", mock)
+        monkeypatch.setattr(fastrepl.llm, "disk_cache", None)
+
+        messages = [{"role": "user", "content": "hi"}]
+        fastrepl.llm.use_disk_cache(path=str(tmp_path / "llm.db"))
+        completion(model="gpt-3.5-turbo", messages=messages)
+
+        cache = fastrepl.llm.use_disk_cache(path=str(tmp_path / "llm.db"))
+        completion(model="gpt-3.5-turbo", messages=messages)
+        assert cache.stats() == {"hits": 1, "misses": 0, "size": 1}
+
+
+class TestRateLimit:
+    def test_paced(self, monkeypatch):
+        def mock(**kwargs):
+            return {"choices": [{"finish_reason": "stop", "message": {"content": "A"}}]}
+
+        monkeypatch.setattr(litellm, "completion", mock)
+        monkeypatch.setattr(fastrepl.llm, "rate_limiters", {})
+
+        waits = []
+        limiter = fastrepl.llm.set_rate_limit("gpt-3.5-turbo", rpm=60, tpm=1000)
+        monkeypatch.setattr(limiter, "acquire", lambda t: waits.append(t) or 0)
+
+        completion(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": "hi"}],
+            max_tokens=1,
+        )
+        completion(model="gpt-4", messages=[{"role": "user", "content": "hi"}])
+
+        # "hi" is a single token, plus per-message overhead and max_tokens.
+        assert waits == [1 + 4 + 1]
+
+
+class TestAdaptiveConcurrency:
+    def test_overload(self, monkeypatch):
+        import time
+
+        calls = []
+
+        def mock(**kwargs):
+            calls.append(kwargs["model"])
+            if len(calls) == 1:
+                raise openai.error.RateLimitError("slow down")
+            return {"choices": [{"finish_reason": "stop", "message": {"content": "A"}}]}
+
+        monkeypatch.setattr(fastrepl.llm, "litellm_completion", mock)
+        monkeypatch.setattr(fastrepl.llm, "concurrency_limits", {})
+        monkeypatch.setattr(time, "sleep", lambda _: None)
+
+        controller = fastrepl.llm.set_adaptive_concurrency(
+            "gpt-3.5-turbo", initial=8, maximum=16
+        )
+
+        result = completion(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": "hi"}],
+        )
+        assert result["choices"][0]["message"]["content"] == "A"
+        assert calls == ["gpt-3.5-turbo", "gpt-3.5-turbo"]
+
+        assert controller.stats()["overloads"] == 1
+        assert controller.stats()["successes"] == 1
+        assert controller.in_flight == 0
+        assert fastrepl.llm.concurrency_levels() == {"gpt-3.5-turbo": 4}
+
+    def test_async_timeout(self, monkeypatch):
+        import time
+        import asyncio
+        import threading
+
+        started, finish = threading.Event(), threading.Event()
+
+        def mock(**kwargs):
+            if not started.is_set():
+                started.set()
+                finish.wait(5)
+            return {"choices": [{"finish_reason": "stop", "message": {"content": "A"}}]}
+
+        async def no_sleep(_):
+            pass
+
+        monkeypatch.setattr(fastrepl.llm, "_litellm_completion", mock)
+        monkeypatch.setattr(fastrepl.llm, "TIMEOUT", 0.1)
+        monkeypatch.setattr(fastrepl.llm, "concurrency_limits", {})
+        monkeypatch.setattr("backoff._async.asyncio.sleep", no_sleep)
+
+        controller = fastrepl.llm.set_adaptive_concurrency("gpt-3.5-turbo")
+        result = asyncio.run(
+            acompletion(
+                model="gpt-3.5-turbo", messages=[{"role": "user", "content": "hi"}]
+            )
+        )
+        assert result["choices"][0]["message"]["content"] == "A"
+
+        # The timed out call is still running in its thread, so it still holds a slot.
+        assert controller.in_flight == 1
+        finish.set()
+        for _ in range(100):
+            if controller.in_flight == 0:
+                break
+            time.sleep(0.01)
+        assert controller.in_flight == 0
+
+
+class TestSingleFlight:
+    def test_coalesced(self, monkeypatch):
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+
+        calls = []
+
+        def mock(**kwargs):
+            calls.append(kwargs["temperature"])
+            time.sleep(0.2)
+            return {"choices": [{"finish_reason": "stop", "message": {"content": "A"}}]}
+
+        # NOTE: `litellm_completion` runs in a subprocess off the main thread because of its timeout.
+        monkeypatch.setattr(fastrepl.llm, "litellm_completion", mock)
+        monkeypatch.setattr(fastrepl.llm, "in_flight", SingleFlight())
+
+        def run(temperature):
+            return completion(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": "hi"}],
+                temperature=temperature,
+            )
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(run, [0, 0, 0, 0]))
+        assert all(r["choices"][0]["message"]["content"] == "A" for r in results)
+        assert calls == [0]
+
+        calls.clear()
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(run, [0.5, 0.5]))
+        assert calls == [0.5, 0.5]
+
+
+class TestPreflight:
+    def test_route_model(self):
+        assert fastrepl.llm.route_model("gpt-3.5-turbo", 4000) == "gpt-3.5-turbo"
+        assert fastrepl.llm.route_model("gpt-3.5-turbo", 5000) == "gpt-3.5-turbo-16k"
+        assert fastrepl.llm.route_model("gpt-4-0613", 9000) == "gpt-4-32k-0613"
+        assert fastrepl.llm.route_model("gpt-4", 40000) == "gpt-4-32k"
+        assert fastrepl.llm.route_model("command-nightly", 40000) == "command-nightly"
+
+    def test_fallback(self, monkeypatch):
+        models = []
+
+        def mock(**kwargs):
+            models.append(kwargs["model"])
+            return {"choices": [{"finish_reason": "stop", "message": {"content": "A"}}]}
+
+        monkeypatch.setattr(fastrepl.llm, "litellm_completion", mock)
+        monkeypatch.setattr(fastrepl.llm, "preflight_fallback", True)
+
+        for content in ["hi", "hi " * 5000]:
+            completion(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": content}],
+                temperature=0.5,
+            )
+        assert models == ["gpt-3.5-turbo", "gpt-3.5-turbo-16k"]
@@ -1,7 +1,73 @@
 import pytest
+import threading
 
 import fastrepl.runner
 from fastrepl.dataset import Dataset
+from fastrepl.eval.base import BaseSimpleEvalNode
+from fastrepl.errors import ShardFailedError
+
+
+def _square(x):
+    return x * x
+
+
+def _fail_on_19(x):
+    if x == 19:
+        raise ValueError(x)
+    return x
+
+
+class _Tagged:
+    """
+    Returns the worker's pid and the id of its own copy, to count how often it was unpickled.
+    """
+
+    def __call__(self, x):
+        import os
+
+        return (os.getpid(), id(self), x)
+
+
+class _Double(BaseSimpleEvalNode):
+    def run(self, *, sample):
+        return sample * 2
+
+
+class _Flaky(BaseSimpleEvalNode):
+    """
+    Kills its worker process the first time it sees `sample == 5`, fails every time on `sample == 7` if `broken`.
+    """
+
+    def __init__(self, marker, broken=False):
+        self.marker = marker
+        self.broken = broken
+
+    def run(self, *, sample):
+        import os
+
+        if sample == 5 and not os.path.exists(self.marker):
+            open(self.marker, "w").close()
+            os._exit(1)
+        if sample == 7 and self.broken:
+            raise RuntimeError("broken")
+        return sample * 2
+
+
+class _Unreachable(BaseSimpleEvalNode):
+    """
+    Raises a `ConnectionError` (an `OSError`) the first time it sees `sample == 4`, like a failed LLM call.
+    """
+
+    def __init__(self, marker):
+        self.marker = marker
+
+    def run(self, *, sample):
+        import os
+
+        if sample == 4 and not os.path.exists(self.marker):
+            open(self.marker, "w").close()
+            raise ConnectionError("unreachable")
+        return sample * 2
 
 
 @pytest.fixture
@@ -117,3 +183,786 @@ class TestLocalRunnerCustom:
         r = fastrepl.runner.LocalCustomRunner(adder)
         result = r.run(args_list=[(1,), (2,)], kwds_list=[{"y": 2}, {"y": 3}], num=2)
         assert result.to_dict() == {"sample": [[3, 3], [5, 5]]}
+
+
+class TestLocalRunnerEvaluatorAsync:
+    def test_concurrency(self):
+        import asyncio
+        from fastrepl.eval.base import BaseSimpleEvalNode
+
+        class SlowEval(BaseSimpleEvalNode):
+            def __init__(self):
+                self.in_flight, self.max_in_flight = 0, 0
+
+            def run(self, *, sample):
+                raise NotImplementedError
+
+            async def arun(self, *, sample):
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                await asyncio.sleep(0.01)
+                self.in_flight -= 1
+                return sample * 2
+
+        node = SlowEval()
+        ds = Dataset.from_dict({"sample": list(range(100))})
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(node), dataset=ds
+        )
+
+        result = asyncio.run(runner.arun(show_progress=False, concurrency=30))
+
+        assert result.column_names == ["sample", "result"]
+        assert result["result"] == [i * 2 for i in range(100)]
+        assert node.max_in_flight == 30
+
+    def test_num_2_aggregate(self):
+        import asyncio
+        from fastrepl.eval.base import BaseSimpleEvalNode
+
+        class CountingEval(BaseSimpleEvalNode):
+            def __init__(self):
+                self.calls = 0
+
+            def run(self, *, sample):
+                self.calls += 1
+                return sample + self.calls % 2
+
+        ds = Dataset.from_dict({"sample": [1, 2, 3]})
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(CountingEval()), dataset=ds
+        )
+
+        result = asyncio.run(runner.arun(num=2, show_progress=False))
+        assert len(result["result"]) == 3
+        assert all(len(item) == 2 for item in result["result"])
+
+        ds = Dataset.from_dict({"sample": [1, 2, 3]})
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(CountingEval()), dataset=ds
+        )
+        result = asyncio.run(runner.arun(num=2, aggregate=True, show_progress=False))
+        assert result["result"] == [1.5, 2.5, 3.5]
+
+
+class TestBatch:
+    @pytest.fixture
+    def node(self):
+        from fastrepl.eval.base import BaseRAGEvalNode
+
+        batches = []
+
+        class Batched(BaseRAGEvalNode):
+            batch_size = 3
+
+            def run(self, **kwargs):
+                raise NotImplementedError
+
+            def run_batch(self, rows):
+                batches.append([row["question"] for row in rows])
+                return [len(row["question"]) for row in rows]
+
+            def inputs(self):
+                return ["question"]
+
+        return Batched(), batches
+
+    def test_run(self, node):
+        node, batches = node
+        ds = Dataset.from_dict({"question": ["a" * i for i in range(7)]})
+
+        result = fastrepl.local_runner(
+            evaluator=fastrepl.RAGEvaluator(node), dataset=ds
+        ).run(show_progress=False)
+
+        assert result["result"] == list(range(7))
+        assert sorted(len(batch) for batch in batches) == [1, 3, 3]
+
+    def test_checkpoint(self, tmp_path, node):
+        node, batches = node
+
+        def runner(n):
+            return fastrepl.local_runner(
+                evaluator=fastrepl.RAGEvaluator(node),
+                dataset=Dataset.from_dict({"question": ["a" * i for i in range(n)]}),
+                checkpoint_dir=str(tmp_path),
+            )
+
+        runner(3).run(show_progress=False)
+        batches.clear()
+
+        result = runner(5).run(show_progress=False)
+        assert result["result"] == list(range(5))
+        assert batches == [["aaa", "aaaa"]]
+
+    def test_default(self):
+        from fastrepl.eval.base import BaseSimpleEvalNode
+
+        class Double(BaseSimpleEvalNode):
+            def run(self, *, sample):
+                return sample * 2
+
+        evaluator = fastrepl.SimpleEvaluator(Double())
+        assert evaluator.batch_size == 1
+        assert evaluator.run_batch([{"sample": 1}, {"sample": 2}]) == [2, 4]
+
+
+class TestSequential:
+    @pytest.fixture
+    def node(self):
+        import threading
+        from collections import Counter
+        from fastrepl.eval.base import BaseSimpleEvalNode
+
+        lock = threading.Lock()
+        calls: Counter = Counter()
+
+        class Cycle(BaseSimpleEvalNode):
+            # NOTE: Even samples always agree, odd ones cycle through 4 labels.
+            def run(self, *, sample):
+                with lock:
+                    n = calls[sample]
+                    calls[sample] += 1
+                return "A" if sample % 2 == 0 else "ABCD"[n % 4]
+
+        return Cycle(), calls
+
+    def test_row_stopping(self, node):
+        from fastrepl.analyze import Analyzer
+
+        node, calls = node
+        ds = Dataset.from_dict({"sample": list(range(6))})
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(node), dataset=ds
+        )
+
+        result = runner.run_sequential(
+            max_num=10, min_num=3, unstable_below=0.6, ci_width=0, show_progress=False
+        )
+
+        assert result["result"][0] == ["A", "A", "A"]
+        assert result["result"][1] == ["A", "B", "C", "D", "A", "B", "C"]
+        # Consistent rows stop at `min_num`, and unstable rows once 6 of 10 is out of reach.
+        assert dict(calls) == {0: 3, 1: 7, 2: 3, 3: 7, 4: 3, 5: 7}
+        assert "kappa" in Analyzer(result).run("kappa")
+
+    def test_interval_stopping(self, node):
+        node, calls = node
+        ds = Dataset.from_dict({"sample": list(range(6))})
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(node), dataset=ds
+        )
+
+        result = runner.run_sequential(max_num=10, ci_width=2, show_progress=False)
+        assert [len(r) for r in result["result"]] == [3] * 6
+
+    def test_invalid(self, node):
+        node, _ = node
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(node),
+            dataset=Dataset.from_dict({"sample": [1]}),
+        )
+        with pytest.raises(ValueError):
+            runner.run_sequential(max_num=2, min_num=3)
+
+
+class TestMultiEvaluator:
+    @pytest.fixture
+    def make(self):
+        import time
+        import threading
+        from fastrepl.eval.base import BaseSimpleEvalNode
+
+        lock = threading.Lock()
+        active, peak = {}, {}
+
+        class Slow(BaseSimpleEvalNode):
+            def __init__(self, model, factor):
+                self.model = model
+                self.factor = factor
+
+            def run(self, *, sample):
+                with lock:
+                    active[self.model] = active.get(self.model, 0) + 1
+                    peak[self.model] = max(peak.get(self.model, 0), active[self.model])
+                time.sleep(0.05)
+                with lock:
+                    active[self.model] -= 1
+                return sample * self.factor
+
+        def make(model, factor):
+            return fastrepl.SimpleEvaluator(Slow(model, factor))
+
+        return make, peak
+
+    def test_run(self, make):
+        import time
+
+        make, peak = make
+        ds = Dataset.from_dict({"sample": list(range(8))})
+
+        runner = fastrepl.local_runner(
+            evaluators={
+                "gpt": make("gpt-3.5-turbo", 2),
+                "mistral": make("mistral-7b", 3),
+                "gpt4": make("gpt-4", 4),
+            },
+            dataset=ds,
+            concurrency={"gpt-3.5-turbo": 8, "mistral-7b": 8, "gpt-4": 2},
+        )
+
+        start = time.monotonic()
+        result = runner.run(show_progress=False)
+        elapsed = time.monotonic() - start
+
+        assert result.column_names == ["sample", "gpt", "mistral", "gpt4"]
+        assert result["gpt"] == [i * 2 for i in range(8)]
+        assert result["mistral"] == [i * 3 for i in range(8)]
+        assert result["gpt4"] == [i * 4 for i in range(8)]
+
+        assert peak["gpt-4"] == 2
+        # gpt-4 takes 4 rounds of 0.05s on its own, and the others finish alongside it.
+        assert elapsed < 0.05 * 4 + 0.1
+
+    def test_num_2_aggregate(self, make):
+        make, _ = make
+        ds = Dataset.from_dict({"sample": [1, 2]})
+
+        result = fastrepl.local_runner(
+            evaluators={"a": make("a", 1), "b": make("b", 2)}, dataset=ds
+        ).run(num=2, show_progress=False, aggregate=True)
+        assert result["a"] == [1, 2]
+        assert result["b"] == [2, 4]
+
+    def test_validation(self, make):
+        make, _ = make
+
+        with pytest.raises(ValueError):
+            fastrepl.local_runner(
+                evaluators={"a": make("a", 1)},
+                dataset=Dataset.from_dict({"input": [1]}),
+            )
+
+
+class TestAdaptiveConcurrency:
+    def test_pool_size(self, monkeypatch):
+        import threading
+        import fastrepl.llm
+        from fastrepl.runner import custom
+
+        monkeypatch.setattr(fastrepl.llm, "concurrency_limits", {})
+        monkeypatch.setattr(custom, "NUM_THREADS", 2)
+
+        def fn(i):
+            return threading.current_thread().name
+
+        runner = fastrepl.local_runner(fn=fn)
+        names = runner.run(args_list=[[i] for i in range(64)], show_progress=False)
+        assert len(set(names["result"])) <= 2
+
+        fastrepl.llm.set_adaptive_concurrency("gpt-3.5-turbo", initial=4, maximum=32)
+        assert runner.concurrency == {"gpt-3.5-turbo": 4}
+
+        from fastrepl.runner.base import num_workers
+
+        assert num_workers(2, 64, ["gpt-3.5-turbo"]) == 32
+        assert num_workers(2, 8, ["gpt-3.5-turbo"]) == 8
+        # Runners that do not call a model with a controller keep their own size.
+        assert num_workers(2, 64) == 2
+        assert num_workers(2, 64, ["gpt-4"]) == 2
+
+        head = fastrepl.LLMClassificationHead(context="", labels={"A": "a"})
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(head),
+            dataset=Dataset.from_dict({"sample": [1]}),
+        )
+        assert runner._models() == ["gpt-3.5-turbo"]
+
+    def test_custom_pool(self, monkeypatch):
+        import threading
+        import fastrepl.llm
+        from fastrepl.runner import custom
+
+        monkeypatch.setattr(fastrepl.llm, "concurrency_limits", {})
+        monkeypatch.setattr(custom, "NUM_THREADS", 2)
+        fastrepl.llm.set_adaptive_concurrency("gpt-3.5-turbo", initial=4, maximum=8)
+
+        # Only returns once 8 calls are in flight together, which takes more than NUM_THREADS threads.
+        barrier = threading.Barrier(8, timeout=5)
+
+        def fn(i):
+            barrier.wait()
+            return i
+
+        args_list = [[i] for i in range(16)]
+        for runner in [
+            fastrepl.local_runner(fn=fn),
+            fastrepl.local_runner(fn=fn, models=["gpt-3.5-turbo"]),
+        ]:
+            result = runner.run(args_list=args_list, show_progress=False)
+            assert result["result"] == list(range(16))
+            assert sorted(i for i, _ in runner.stream(args_list=args_list)) == list(
+                range(16)
+            )
+
+        runner = fastrepl.local_runner(fn=lambda i: i, models=["gpt-4"])
+        assert runner._models() == ["gpt-4"]
+
+
+class TestProcess:
+    def test_custom(self):
+        runner = fastrepl.local_runner(fn=_square, executor="process")
+
+        result = runner.run(args_list=[(i,) for i in range(100)], show_progress=False)
+        assert result["result"] == [i * i for i in range(100)]
+
+        result = runner.run(
+            kwds_list=[{"x": i} for i in range(3)], num=2, show_progress=False
+        )
+        assert result["result"] == [[0, 0], [1, 1], [4, 4]]
+
+    def test_once_per_worker(self):
+        from fastrepl.runner.process import ProcessPool
+
+        with ProcessPool(_Tagged(), num_processes=2, chunk_size=5) as pool:
+            results = pool.map([((i,), {}) for i in range(40)])
+
+        assert [x for _, _, x in results] == list(range(40))
+        copies = {(pid, copy) for pid, copy, _ in results}
+        assert len(copies) == len({pid for pid, _ in copies}) <= 2
+
+    def test_on_chunk(self):
+        from fastrepl.runner.process import ProcessPool
+
+        chunks = {}
+        with ProcessPool(_square, num_processes=1, chunk_size=5) as pool:
+            results = pool.map(
+                [((i,), {}) for i in range(12)],
+                on_chunk=lambda start, chunk: chunks.update({start: chunk}),
+            )
+        assert results == [i * i for i in range(12)]
+        assert chunks == {s: results[s : s + 5] for s in (0, 5, 10)}
+
+        # Chunks that completed before a failing one are still handed over.
+        chunks.clear()
+        with ProcessPool(_fail_on_19, num_processes=1, chunk_size=5) as pool:
+            with pytest.raises(ValueError):
+                pool.map(
+                    [((i,), {}) for i in range(20)],
+                    on_chunk=lambda start, chunk: chunks.update({start: chunk}),
+                )
+        assert chunks == {s: list(range(s, s + 5)) for s in (0, 5, 10)}
+
+    def test_export(self):
+        pytest.importorskip("pyarrow")
+        from fastrepl.runner.process import _export, _import
+
+        for results in [[1, 2, None], [0.5, None], ["a", "b"], [True, False], [None]]:
+            kind, payload = _export(results)
+            assert kind == "arrow"
+            assert _import(kind, payload) == results
+
+        for results in [
+            [(1, 2)],
+            [{"a": 1}, {"b": 2}],
+            [1, 2.5],
+            [1 + 2j],
+            [2**64],
+            [1, -(2**70)],
+        ]:
+            kind, payload = _export(results)
+            assert kind == "pickle"
+            assert _import(kind, payload) == results
+
+    def test_evaluator(self, tmp_path):
+        ds = Dataset.from_dict({"sample": list(range(20))})
+        evaluator = fastrepl.SimpleEvaluator(_Double())
+
+        runner = fastrepl.local_runner(
+            evaluator=evaluator,
+            dataset=ds,
+            checkpoint_dir=str(tmp_path),
+            executor="process",
+        )
+        result = runner.run(num=2, show_progress=False)
+        assert result["result"] == [[i * 2, i * 2] for i in range(20)]
+
+        result = runner.run_sequential(max_num=4, show_progress=False)
+        assert result["result"] == [[i * 2] * 3 for i in range(20)]
+
+
+class TestRemote:
+    def test_run(self):
+        ds = Dataset.from_dict({"sample": list(range(30))})
+        runner = fastrepl.remote_runner(
+            evaluator=fastrepl.SimpleEvaluator(_Double()),
+            dataset=ds,
+            shard_size=4,
+            num_local_workers=3,
+        )
+
+        result = runner.run(show_progress=False)
+        assert result["result"] == [i * 2 for i in range(30)]
+
+    def test_num(self):
+        ds = Dataset.from_dict({"sample": [1, 2, 3]})
+        runner = fastrepl.runner.RemoteEvaluatorRunner(
+            fastrepl.SimpleEvaluator(_Double()), ds, shard_size=2, num_local_workers=2
+        )
+
+        result = runner.run(num=2, show_progress=False)
+        assert result["result"] == [[2, 2], [4, 4], [6, 6]]
+
+    def test_lost_worker(self, tmp_path):
+        ds = Dataset.from_dict({"sample": list(range(12))})
+        runner = fastrepl.runner.RemoteEvaluatorRunner(
+            fastrepl.SimpleEvaluator(_Flaky(str(tmp_path / "marker"))),
+            ds,
+            shard_size=3,
+            num_local_workers=2,
+        )
+
+        result = runner.run(show_progress=False)
+        assert (tmp_path / "marker").exists()
+        assert result["result"] == [i * 2 for i in range(12)]
+
+    def test_failed_shard(self, tmp_path):
+        (tmp_path / "marker").touch()
+
+        ds = Dataset.from_dict({"sample": list(range(12))})
+        runner = fastrepl.runner.RemoteEvaluatorRunner(
+            fastrepl.SimpleEvaluator(_Flaky(str(tmp_path / "marker"), broken=True)),
+            ds,
+            shard_size=3,
+            max_retries=1,
+            num_local_workers=2,
+        )
+
+        with pytest.raises(ShardFailedError, match="broken"):
+            runner.run(show_progress=False)
+
+    def test_expired_lease(self):
+        from multiprocessing.connection import Client
+        from fastrepl.runner.remote import Broker, serve
+
+        ds = Dataset.from_dict({"sample": list(range(6))})
+        evaluator = fastrepl.SimpleEvaluator(_Double())
+
+        with Broker(evaluator, ds, 1, 3, authkey=b"k", lease_timeout=0.3) as broker:
+            # Takes a shard and goes silent, without disconnecting.
+            stuck = Client(broker.address, authkey=b"k")
+            stuck.send(("hello",))
+            stuck.recv()
+            stuck.send(("get",))
+            shard_id, rows, _ = stuck.recv()
+            assert rows == [0, 1, 2]
+
+            worker = threading.Thread(target=serve, args=(broker.address, b"k"))
+            worker.start()
+
+            assert broker.wait() == {i: i * 2 for i in range(6)}
+            worker.join()
+
+            # Late results of the expired lease are ignored.
+            stuck.send(("result", shard_id, 0, -1))
+            stuck.recv()
+            assert broker.results[0] == 0
+            stuck.close()
+
+    def test_evaluator_oserror(self, tmp_path):
+        from fastrepl.runner.remote import Broker, serve
+
+        ds = Dataset.from_dict({"sample": list(range(6))})
+        evaluator = fastrepl.SimpleEvaluator(_Unreachable(str(tmp_path / "marker")))
+
+        with Broker(evaluator, ds, 1, 3, authkey=b"k") as broker:
+            # A single worker, which must report the failed row and carry on with the retried shard.
+            worker = threading.Thread(target=serve, args=(broker.address, b"k"))
+            worker.start()
+            worker.join(timeout=10)
+
+            assert not worker.is_alive()
+            assert (tmp_path / "marker").exists()
+            assert broker.done
+            assert broker.results == {i: i * 2 for i in range(6)}
+
+    def test_wrong_key(self):
+        from multiprocessing import AuthenticationError
+        from multiprocessing.connection import Client
+        from fastrepl.runner.remote import Broker
+
+        ds = Dataset.from_dict({"sample": [1]})
+        with Broker(None, ds, 1, 1, authkey=b"k") as broker:
+            with pytest.raises(AuthenticationError):
+                Client(broker.address, authkey=b"wrong")
+
+
+class TestEstimate:
+    def test_classification(self):
+        import fastrepl.llm
+
+        head = fastrepl.LLMClassificationHead(
+            context="context",
+            labels={"POSITIVE": "positive", "NEGATIVE": "negative"},
+            references=[("good", "POSITIVE"), ("bad", "NEGATIVE")],
+        )
+        ds = Dataset.from_dict({"sample": ["short", "long " * 5000]})
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(head), dataset=ds
+        )
+
+        state = head.rg.getstate()
+        result = runner.estimate(num=2)
+        assert head.rg.getstate() == state
+
+        expected = [
+            fastrepl.llm.estimate_tokens(head.messages(sample), 0)
+            for sample in ds["sample"]
+        ]
+        assert result.num_rows == 2
+        assert result.input_tokens == sum(expected) * 2
+        assert result.output_tokens == 1 * 2 * 2
+
+        assert result.overflows == [1]
+        assert result.fallbacks == {1: "gpt-3.5-turbo-16k"}
+        assert set(result.cost) == {"gpt-3.5-turbo", "gpt-3.5-turbo-16k"}
+        assert result.cost["gpt-3.5-turbo-16k"] == pytest.approx(
+            2 * (expected[1] * 3e-06 + 1 * 4e-06)
+        )
+        assert result.total_cost == sum(result.cost.values())
+
+    def test_position_debias(self):
+        ds = Dataset.from_dict({"sample": ["a", "b"]})
+
+        def estimate(**kwargs):
+            head = fastrepl.LLMClassificationHead(
+                context="context",
+                labels={"A": "a", "B": "b", "C": "c"},
+                **kwargs,
+            )
+            runner = fastrepl.local_runner(
+                evaluator=fastrepl.SimpleEvaluator(head), dataset=ds
+            )
+            return runner.estimate()
+
+        single = estimate()
+        for kwargs, calls in [
+            ({"position_debias_strategy": "consensus"}, 2),
+            ({"position_debias_strategy": "vote"}, 3),
+            ({"position_debias_strategy": "vote", "num_permutations": 5}, 5),
+        ]:
+            result = estimate(**kwargs)
+            assert result.input_tokens == single.input_tokens * calls
+            assert result.output_tokens == single.output_tokens * calls
+            assert result.total_cost == pytest.approx(single.total_cost * calls)
+
+    def test_no_fallback(self):
+        head = fastrepl.LLMGradingHeadCOT(
+            context="context", number_from=1, number_to=5, model="gpt-4-32k"
+        )
+        ds = Dataset.from_dict({"sample": ["long " * 40000]})
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(head), dataset=ds
+        )
+
+        result = runner.estimate()
+        assert result.output_tokens == 200
+        assert result.overflows == [0]
+        assert result.fallbacks == {}
+
+    def test_unsupported(self):
+        from fastrepl.eval.base import BaseSimpleEvalNode
+
+        class Double(BaseSimpleEvalNode):
+            def run(self, *, sample):
+                return sample * 2
+
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(Double()),
+            dataset=Dataset.from_dict({"sample": [1]}),
+        )
+        with pytest.raises(ValueError):
+            runner.estimate()
+
+
+class TestStream:
+    def test_evaluator_ordered(self):
+        from fastrepl.eval.base import BaseSimpleEvalNode
+
+        class Double(BaseSimpleEvalNode):
+            def run(self, *, sample):
+                return sample * 2
+
+        ds = Dataset.from_dict({"sample": list(range(20))})
+        runner = fastrepl.local_runner(
+            evaluator=fastrepl.SimpleEvaluator(Double()), dataset=ds
+        )
+
+        assert list(runner.stream(ordered=True)) == [(i, i * 2) for i in range(20)]
+        assert list(runner.stream(num=2, ordered=True)) == [
+            (i, [i * 2, i * 2]) for i in range(20)
+        ]
+
+    def test_custom_completion_order(self):
+        import time
+
+        def fn(x):
+            time.sleep(x)
+            return x
+
+        r = fastrepl.runner.LocalCustomRunner(fn)
+        items = list(r.stream(args_list=[(0.2,), (0.0,), (0.1,)]))
+        assert items == [(1, 0.0), (2, 0.1), (0, 0.2)]
+
+        items = list(r.stream(args_list=[(0.2,), (0.0,), (0.1,)], ordered=True))
+        assert items == [(0, 0.2), (1, 0.0), (2, 0.1)]
+
+    def test_custom_early_exit(self):
+        r = fastrepl.runner.LocalCustomRunner(lambda x: x)
+        stream = r.stream(args_list=[(i,) for i in range(5)], ordered=True)
+
+        assert next(stream) == (0, 0)
+        stream.close()
+
+
+class TestCheckpoint:
+    @pytest.fixture
+    def node(self):
+        calls, failing = [], set()
+
+        class Counter(fastrepl.eval.base.BaseSimpleEvalNode):
+            def run(self, *, sample):
+                if sample in failing:
+                    raise RuntimeError
+                calls.append(sample)
+                return sample * 10
+
+        return Counter(), calls, failing
+
+    def test_resume(self, tmp_path, node):
+        node, calls, failing = node
+
+        def runner():
+            return fastrepl.local_runner(
+                evaluator=fastrepl.SimpleEvaluator(node),
+                dataset=Dataset.from_dict({"sample": [1, 2, 3, 4]}),
+                checkpoint_dir=str(tmp_path),
+            )
+
+        failing.add(3)
+        with pytest.raises(RuntimeError):
+            runner().run(show_progress=False)
+
+        calls.clear()
+        failing.clear()
+        result = runner().run(show_progress=False)
+
+        assert result["result"] == [10, 20, 30, 40]
+        assert 3 in calls
+        assert len(calls) < 4
+
+    def test_num_2(self, tmp_path, node):
+        node, calls, _ = node
+
+        def runner():
+            return fastrepl.local_runner(
+                evaluator=fastrepl.SimpleEvaluator(node),
+                dataset=Dataset.from_dict({"sample": [1, 2]}),
+                checkpoint_dir=str(tmp_path),
+            )
+
+        runner().run(show_progress=False)
+        assert sorted(calls) == [1, 2]
+
+        result = runner().run(num=2, show_progress=False)
+        assert result["result"] == [[10, 10], [20, 20]]
+        assert sorted(calls) == [1, 1, 2, 2]
+
+        assert list(runner().stream(num=2, ordered=True)) == [
+            (0, [10, 10]),
+            (1, [20, 20]),
+        ]
+        assert sorted(calls) == [1, 1, 2, 2]
+
+    def test_config(self, tmp_path):
+        def runner(context):
+            head = fastrepl.LLMClassificationHead(context=context, labels={"A": "a"})
+            return fastrepl.local_runner(
+                evaluator=fastrepl.SimpleEvaluator(head),
+                dataset=Dataset.from_dict({"sample": [1]}),
+                checkpoint_dir=str(tmp_path),
+            )
+
+        assert runner("a")._checkpoint._dir == runner("a")._checkpoint._dir
+        assert runner("a")._checkpoint._dir != runner("b")._checkpoint._dir
+
+    def test_fingerprint(self):
+        from fastrepl.utils import prompt
+        from fastrepl.eval.model.ragas import RAGAS
+        from fastrepl.runner.checkpoint import fingerprint
+
+        class Other(fastrepl.LLMClassificationHead):
+            @prompt
+            def system_prompt(context, labels, label_keys):
+                """{{context}} {{labels}} {{label_keys}}"""
+
+        kwargs = {"context": "a", "labels": {"A": "a"}}
+        head = fastrepl.LLMClassificationHead(**kwargs)
+        assert fingerprint(head) != fingerprint(Other(**kwargs))
+
+        def ragas(metric, model="gpt-3.5-turbo"):
+            # NOTE: Skips loading the metric, which needs `ragas` and `langchain`.
+            node = object.__new__(RAGAS)
+            node.metric, node.model, node.batch_size = metric, model, 1
+            node._metric = object()
+            return node
+
+        assert fingerprint(ragas("Faithfulness")) != fingerprint(
+            ragas("AnswerRelevancy")
+        )
+        assert fingerprint(ragas("Faithfulness")) != fingerprint(
+            ragas("Faithfulness", "gpt-4")
+        )
+
+    def test_numpy_result(self, tmp_path):
+        import asyncio
+        import numpy as np
+        from fastrepl.eval.base import BaseSimpleEvalNode
+
+        class Score(BaseSimpleEvalNode):
+            def __init__(self, wrap):
+                self.wrap = wrap
+
+            def run(self, *, sample):
+                return self.wrap(sample / 2)
+
+        def runner(wrap):
+            return fastrepl.local_runner(
+                evaluator=fastrepl.SimpleEvaluator(Score(wrap)),
+                dataset=Dataset.from_dict({"sample": [1, 2]}),
+                checkpoint_dir=str(tmp_path),
+            )
+
+        result = runner(np.float32).run(show_progress=False)
+        assert result["result"] == [0.5, 1.0]
+        assert sorted(runner(np.float32)._checkpoint.load(0).values()) == [0.5, 1.0]
+
+        # Values JSON can not hold fail with the same error everywhere, instead of hanging or being dropped.
+        with pytest.raises(TypeError, match="checkpointed"):
+            runner(lambda x: {x}).run(show_progress=False)
+        with pytest.raises(TypeError, match="checkpointed"):
+            list(runner(lambda x: {x}).stream())
+        with pytest.raises(TypeError, match="checkpointed"):
+            asyncio.run(runner(lambda x: {x}).arun(show_progress=False))
+
+    def test_partial_line(self, tmp_path):
+        from fastrepl.runner.checkpoint import Checkpoint
+
+        checkpoint = Checkpoint(str(tmp_path), evaluator=None)
+        checkpoint.save(0, "a", 1)
+        with open(checkpoint._path(0), "a") as f:
+            f.write('{"key": "b", "res')
+
+        assert checkpoint.load(0) == {"a": 1}
+        checkpoint.save(0, "c", 3)
+        assert checkpoint.load(0) == {"a": 1, "c": 3}
@@ -10,6 +10,13 @@ from fastrepl.utils import (
     to_number,
     DEBUG,
     map_number_range,
+    SQLiteCache,
+    EmbeddingCache,
+    ScoreCache,
+    RateLimiter,
+    AdaptiveConcurrency,
+    SingleFlight,
+    TokenizerRegistry,
 )
 
 
@@ -250,6 +257,33 @@ this is context
 Q: hello?"""
         )
 
+    def test_compiled_once(self, monkeypatch):
+        import importlib
+
+        # NOTE: `fastrepl.utils.prompt` is shadowed by the decorator of the same name.
+        prompt_module = importlib.import_module("fastrepl.utils.prompt")
+
+        @prompt
+        def fn(question):
+            """Q: {{ question }}"""
+
+        def fail(*args, **kwargs):
+            raise AssertionError("template compiled again")
+
+        monkeypatch.setattr(prompt_module.ENV, "from_string", fail)
+
+        assert fn("a") == "Q: a"
+        assert fn(question="b") == "Q: b"
+        assert prompt_module.render("""Q: {{ question }}""", question="c") == "Q: c"
+
+    def test_class_level(self):
+        class Head:
+            @prompt
+            def system_prompt(context):
+                """Context: {{ context }}"""
+
+        assert Head().system_prompt(context="a") == "Context: a"
+
 
 def test_truncate():
     assert truncate("hello", 10) == "hello"
@@ -318,3 +352,507 @@ def test_map_range(value_input, value_output, from_min, from_max, to_min, to_max
         map_number_range(value_input, from_min, from_max, to_min, to_max)
         == value_output
     )
+
+
+class TestSQLiteCache:
+    def test_basic(self, tmp_path):
+        cache = SQLiteCache(str(tmp_path / "cache.db"))
+
+        assert cache.get_cache("a") is None
+        cache.set_cache("a", {"choices": [1, 2]})
+        assert cache.get_cache("a") == {"choices": [1, 2]}
+
+        assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+        cache.clear()
+        assert cache.stats() == {"hits": 0, "misses": 0, "size": 0}
+
+    def test_ttl(self, tmp_path, monkeypatch):
+        import time
+
+        now = [1000.0]
+        monkeypatch.setattr(time, "time", lambda: now[0])
+
+        cache = SQLiteCache(str(tmp_path / "cache.db"), ttl=10)
+        cache.set_cache("a", 1)
+
+        now[0] += 5
+        assert cache.get_cache("a") == 1
+
+        now[0] += 10
+        assert cache.get_cache("a") is None
+        assert len(cache) == 0
+
+    def test_max_size(self, tmp_path, monkeypatch):
+        import time
+
+        now = [1000.0]
+        monkeypatch.setattr(time, "time", lambda: now[0])
+
+        cache = SQLiteCache(str(tmp_path / "cache.db"), max_size=2)
+        for key in "abc":
+            now[0] += 1
+            cache.set_cache(key, key)
+            if key == "b":
+                now[0] += 1
+                cache.get_cache("a")
+
+        assert len(cache) == 2
+        assert cache.get_cache("a") == "a"
+        assert cache.get_cache("b") is None
+        assert cache.get_cache("c") == "c"
+
+    def test_threads(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+
+        cache = SQLiteCache(str(tmp_path / "cache.db"))
+
+        def work(i):
+            cache.set_cache(str(i % 10), i % 10)
+            return cache.get_cache(str(i % 10))
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(work, range(100)))
+
+        assert results == [i % 10 for i in range(100)]
+        assert cache.stats() == {"hits": 100, "misses": 0, "size": 10}
+
+
+class TestEmbeddingCache:
+    @staticmethod
+    def encoder(calls):
+        import numpy as np
+
+        def encode(texts):
+            calls.append(texts)
+            return np.array([[len(t), t.count("a"), 1.0] for t in texts])
+
+        return encode
+
+    def test_dedup(self):
+        calls = []
+        cache = EmbeddingCache()
+
+        vectors = cache.embed(["a", "bb", "a"], self.encoder(calls))
+        assert vectors.tolist() == [[1, 1, 1], [2, 0, 1], [1, 1, 1]]
+        assert calls == [["a", "bb"]]
+
+        cache.embed(["bb", "aaa"], self.encoder(calls))
+        assert calls[-1] == ["aaa"]
+        assert cache.stats() == {"hits": 2, "misses": 3, "size": 3}
+
+    def test_disk(self, tmp_path):
+        import numpy as np
+
+        calls = []
+        path = str(tmp_path / "embeddings")
+        EmbeddingCache(path).embed(["a", "bb"], self.encoder(calls))
+
+        cache = EmbeddingCache(path)
+        assert isinstance(cache._mmap, np.memmap)
+        assert len(cache) == 2
+
+        vectors = cache.embed(["bb", "a", "ccc"], self.encoder(calls))
+        assert vectors.tolist() == [[2, 0, 1], [1, 1, 1], [3, 0, 1]]
+        assert calls == [["a", "bb"], ["ccc"]]
+        assert len(EmbeddingCache(path)) == 3
+
+    def test_partial_write(self, tmp_path):
+        calls = []
+        path = tmp_path / "embeddings"
+        EmbeddingCache(str(path)).embed(["a", "bb"], self.encoder(calls))
+
+        # Killed after writing the second vector, but before its key.
+        keys = (path / EmbeddingCache.KEYS).read_text().splitlines()
+        (path / EmbeddingCache.KEYS).write_text(
+            "\n".join(keys[:2]) + "\n" + keys[2][:10]
+        )
+
+        cache = EmbeddingCache(str(path))
+        assert len(cache) == 1
+        assert cache.embed(["a", "bb"], self.encoder(calls)).tolist() == [
+            [1, 1, 1],
+            [2, 0, 1],
+        ]
+        assert calls[-1] == ["bb"]
+        assert len(EmbeddingCache(str(path))) == 2
+
+    def test_concurrent_writers(self, tmp_path):
+        import multiprocessing
+
+        path = str(tmp_path / "embeddings")
+
+        def write(i):
+            cache = EmbeddingCache(path)
+            for j in range(20):
+                cache.embed([f"{i}-{j}" + "a" * j], self.encoder([]))
+
+        procs = [multiprocessing.Process(target=write, args=(i,)) for i in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+
+        calls = []
+        cache = EmbeddingCache(path)
+        assert len(cache) == 80
+        texts = [f"{i}-{j}" + "a" * j for i in range(4) for j in range(20)]
+        assert cache.embed(texts, self.encoder(calls)).tolist() == [
+            [len(t), t.count("a"), 1.0] for t in texts
+        ]
+        assert calls == []
+
+    def test_dim(self):
+        import numpy as np
+
+        cache = EmbeddingCache()
+        cache.embed(["a"], lambda texts: np.ones((len(texts), 3)))
+        with pytest.raises(ValueError):
+            cache.embed(["b"], lambda texts: np.ones((len(texts), 4)))
+
+
+class TestScoreCache:
+    @staticmethod
+    def scorer(calls):
+        def score(items):
+            calls.append(items)
+            return [len(a) - len(b) for a, b in items]
+
+        return score
+
+    def test_lru(self):
+        calls = []
+        cache = ScoreCache(max_size=2)
+
+        scores = cache.score(
+            [("a", "bb"), ("ccc", "a"), ("a", "bb")], self.scorer(calls)
+        )
+        assert scores.tolist() == [-1, 2, -1]
+        assert calls == [[("a", "bb"), ("ccc", "a")]]
+
+        # ("a", "bb") is evicted as the least recently used.
+        cache.score([("ccc", "a"), ("x", "")], self.scorer(calls))
+        assert calls[-1] == [("x", "")]
+        cache.score([("a", "bb")], self.scorer(calls))
+        assert calls[-1] == [("a", "bb")]
+        assert len(cache) == 2
+        assert cache.stats() == {"hits": 2, "misses": 4, "size": 2}
+
+    def test_disk(self, tmp_path):
+        calls = []
+        path = str(tmp_path / "scores.sqlite")
+        ScoreCache(path, max_size=1).score(
+            [("a", "bb"), ("b", "a")], self.scorer(calls)
+        )
+
+        cache = ScoreCache(path, max_size=1)
+        assert len(cache) == 2
+        items = [("b", "a"), ("a", "bb"), ("cc", "")]
+        assert cache.score(items, self.scorer(calls)).tolist() == [0, -1, 2]
+        assert calls[-1] == [("cc", "")]
+        assert len(cache._memory) == 1
+        assert len(ScoreCache(path)) == 3
+
+    def test_max_size(self):
+        with pytest.raises(ValueError):
+            ScoreCache(max_size=0)
+
+
+class TestRateLimiter:
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        import time
+
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        monkeypatch.setattr(time, "monotonic", lambda: now[0])
+        monkeypatch.setattr(time, "sleep", sleep)
+        return now
+
+    def test_rpm(self, clock):
+        limiter = RateLimiter(rpm=2)
+
+        assert limiter.acquire() == 0
+        assert limiter.acquire() == 0
+        assert limiter.acquire() == pytest.approx(30)
+        assert clock[0] == pytest.approx(30)
+
+        assert limiter.wait_time == 0
+        assert limiter.queue_depth == 0
+
+    def test_tpm(self, clock):
+        limiter = RateLimiter(rpm=100, tpm=600)
+
+        assert limiter.acquire(500) == 0
+        assert limiter.acquire(200) == pytest.approx(10)
+
+        clock[0] += 60
+        assert limiter.acquire(600) == 0
+
+    def test_wait_time(self, clock):
+        limiter = RateLimiter(tpm=60)
+
+        limiter._reserve(90)
+        assert limiter.queue_depth == 1
+        assert limiter.wait_time == pytest.approx(30)
+
+        clock[0] += 10
+        assert limiter.wait_time == pytest.approx(20)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            RateLimiter(rpm=0)
+
+
+class TestAdaptiveConcurrency:
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        import time
+
+        now = [0.0]
+        monkeypatch.setattr(time, "monotonic", lambda: now[0])
+        return now
+
+    def test_additive_increase(self, clock):
+        controller = AdaptiveConcurrency(initial=2, maximum=4)
+
+        # 2 -> 2.5 -> 2.9 -> 3.24
+        for _ in range(3):
+            controller.on_success(clock[0])
+        assert controller.limit == 3
+
+        for _ in range(100):
+            controller.on_success(clock[0])
+        assert controller.limit == 4
+
+    def test_multiplicative_decrease(self, clock):
+        controller = AdaptiveConcurrency(initial=16, minimum=2)
+
+        clock[0] = 1.0
+        controller.on_overload(0.5)
+        assert controller.limit == 8
+
+        # Calls started before the cut are already in flight, and do not cut again.
+        controller.on_overload(0.5)
+        assert controller.limit == 8
+
+        for started in [2.0, 3.0, 4.0]:
+            clock[0] = started
+            controller.on_overload(started)
+        assert controller.limit == 2
+        assert controller.stats()["overloads"] == 5
+
+    def test_latency(self, clock):
+        controller = AdaptiveConcurrency(initial=8, smoothing=1.0)
+
+        clock[0] = 1.0
+        controller.on_success(0.0)
+        assert controller.limit == 8
+
+        clock[0] = 10.0
+        controller.on_success(5.0)
+        assert controller.limit == 4
+
+    def test_gate(self):
+        import time
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        controller = AdaptiveConcurrency(initial=2, maximum=2)
+        lock = threading.Lock()
+        active, peak = [0], [0]
+
+        def work(_):
+            controller.acquire()
+            try:
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.01)
+                with lock:
+                    active[0] -= 1
+            finally:
+                controller.release()
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(work, range(16)))
+
+        assert peak[0] == 2
+        assert controller.stats()["in_flight"] == 0
+
+    def test_gate_async(self):
+        import asyncio
+
+        controller = AdaptiveConcurrency(initial=1, maximum=1)
+
+        async def main():
+            await controller.aacquire()
+            waiter = asyncio.ensure_future(controller.aacquire())
+            cancelled = asyncio.ensure_future(controller.aacquire())
+            await asyncio.sleep(0)
+            assert not waiter.done()
+
+            cancelled.cancel()
+            controller.release()
+            await waiter
+            assert controller.in_flight == 1
+
+            controller.release()
+            assert controller.in_flight == 0
+
+        asyncio.run(main())
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            AdaptiveConcurrency(initial=8, maximum=4)
+        with pytest.raises(ValueError):
+            AdaptiveConcurrency(backoff=1)
+
+
+class TestSingleFlight:
+    def test_threads(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        sf, calls, release = SingleFlight(), [], threading.Event()
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return "A"
+
+        with ThreadPoolExecutor(8) as executor:
+            futures = [executor.submit(sf.do, "key", fn) for _ in range(8)]
+            while sf.coalesced < 7:
+                pass
+            release.set()
+
+        assert [f.result() for f in futures] == ["A"] * 8
+        assert len(calls) == 1
+
+        assert sf.do("key", lambda: "B") == "B"
+
+    def test_exception(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        sf, release = SingleFlight(), threading.Event()
+
+        def fn():
+            release.wait(5)
+            raise RuntimeError
+
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(sf.do, "key", fn) for _ in range(2)]
+            while sf.coalesced < 1:
+                pass
+            release.set()
+
+        for f in futures:
+            with pytest.raises(RuntimeError):
+                f.result()
+
+    def test_async(self):
+        import asyncio
+
+        sf, calls = SingleFlight(), []
+
+        async def fn(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        async def run():
+            return await asyncio.gather(
+                *[sf.ado("a", lambda: fn("a")) for _ in range(5)],
+                sf.ado("b", lambda: fn("b")),
+            )
+
+        assert asyncio.run(run()) == ["a"] * 5 + ["b"]
+        assert sorted(calls) == ["a", "b"]
+
+
+class TestTokenizerRegistry:
+    @pytest.fixture
+    def registry(self):
+        loaded, batches = [], []
+
+        class Encoder:
+            name = "chars"
+
+            def __init__(self):
+                loaded.append(1)
+
+            def encode(self, text):
+                batches.append([text])
+                return [ord(c) for c in text]
+
+            def encode_batch(self, texts):
+                batches.append(texts)
+                return [[ord(c) for c in text] for text in texts]
+
+        registry = TokenizerRegistry(max_size=3)
+        registry.register("a", Encoder)
+        registry.register("b", Encoder)
+        return registry, loaded, batches
+
+    def test_tokenize(self, registry):
+        registry, loaded, batches = registry
+
+        assert registry.tokenize("a-1", "hi") == [104, 105]
+        assert registry.tokenize("a-2", "hi") == [104, 105]
+        assert registry.tokenize("b", "hi") == [104, 105]
+
+        assert len(loaded) == 2
+        # Both encoders are named "chars", so they share cache entries.
+        assert batches == [["hi"]]
+
+    def test_tokenize_many(self, registry):
+        registry, _, batches = registry
+
+        registry.tokenize("a", "x")
+        batches.clear()
+
+        assert registry.tokenize_many("a", ["x", "y", "z"]) == [[120], [121], [122]]
+        assert batches == [["y", "z"]]
+
+    def test_lru(self, registry):
+        registry, _, batches = registry
+
+        registry.tokenize_many("a", ["1", "2", "3"])
+        registry.tokenize("a", "1")
+        registry.tokenize("a", "4")
+        assert len(registry) == 3
+
+        batches.clear()
+        registry.tokenize_many("a", ["1", "3", "4"])
+        assert batches == []
+        registry.tokenize("a", "2")
+        assert batches == [["2"]]
+
+    def test_count_tokens(self, registry):
+        registry, _, _ = registry
+
+        assert registry.count_tokens("a", (str(i) for i in range(2500))) == [
+            len(str(i)) for i in range(2500)
+        ]
+        assert len(registry) == 0
+
+    def test_not_implemented(self, registry):
+        from fastrepl.errors import TokenizeNotImplementedError
+
+        registry, _, _ = registry
+        with pytest.raises(TokenizeNotImplementedError):
+            registry.tokenize("c", "A")
+
+    def test_tiktoken(self):
+        import fastrepl.llm
+
+        texts = ["hello world", "A", ""]
+        assert fastrepl.llm.tokenize_many("gpt-4", texts) == [
+            fastrepl.llm.tokenize("gpt-3.5-turbo", text) for text in texts
+        ]
+        assert fastrepl.llm.count_tokens("gpt-4", texts) == [2, 1, 0]